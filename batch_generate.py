@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: generate results from saved query json files without gui
+#   the query files are saved by the 'Save Data' button of the generate dialog,
+#   every query is sent to its llm supply through the request scheduler with bounded parallelism,
+#   the response is streamed to an output file, and a checkpoint file records the finished queries,
+#   so an interrupted batch resumes from where it stopped
+# Usage:
+#   python batch_generate.py "queries/*.json" -o output --parallel 4
+
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from system import request_scheduler
+from system.llm import llm_interface
+
+
+def collect_query_files(inputs):
+    '''
+    every input is a directory, a glob pattern or a json file
+    '''
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, '**', '*.json'), recursive=True))
+        else:
+            files.extend(glob.glob(item, recursive=True))
+    # keep the order stable, so the checkpoint is meaningful
+    return sorted(set(os.path.abspath(file) for file in files))
+
+
+class BatchCheckpoint(object):
+    '''
+    BatchCheckpoint records the finished query files, it is saved after every query
+    '''
+
+    def __init__(self, checkpoint_file):
+        super().__init__()
+        self.checkpoint_file = checkpoint_file
+        self.mutex = threading.Lock()
+        self.finished = {}
+
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                self.finished = json.load(f).get('finished', {})
+
+    def is_finished(self, query_file):
+        return query_file in self.finished
+
+    def mark_finished(self, query_file, output_file):
+        self.mutex.acquire()
+        self.finished[query_file] = output_file
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'finished': self.finished}, f, ensure_ascii=False, indent=4)
+        # replace the file at once, an interruption never leaves a broken checkpoint
+        os.replace(temp_file, self.checkpoint_file)
+        self.mutex.release()
+
+
+class BatchGenerator(object):
+    '''
+    BatchGenerator runs the query files through the llm supplies
+    '''
+
+    def __init__(self, manager, output_dir, checkpoint, overrides=None):
+        super().__init__()
+        self.manager = manager
+        self.output_dir = output_dir
+        # the output files keep the paths of the query files under this directory,
+        # so the query files of the same name in different directories don't overwrite each other
+        self.input_root = ''
+        self.checkpoint = checkpoint
+        # override the supply, model or temperature saved in the query files
+        self.overrides = overrides or {}
+
+    def set_input_root(self, query_files):
+        self.input_root = os.path.commonpath([os.path.dirname(file) for file in query_files]) if query_files else ''
+
+    def get_output_file(self, query_file):
+        if self.input_root:
+            name = os.path.splitext(os.path.relpath(query_file, self.input_root))[0]
+        else:
+            name = os.path.splitext(os.path.basename(query_file))[0]
+        return os.path.join(self.output_dir, name + '.txt')
+
+    def run_query(self, query_file):
+        if self.checkpoint.is_finished(query_file):
+            print("skip {}, it's finished".format(query_file))
+            return True
+
+        # a broken query file fails alone, the others and the summary go on
+        try:
+            return self.generate_query(query_file)
+        except Exception as e:
+            print("generate {} failed: {}".format(query_file, e))
+            return False
+
+    def generate_query(self, query_file):
+        examples, prompts, generate_info, _ = self.manager.call_database("InterfaceLoadResultFile", query_file)
+        if not prompts:
+            print("skip {}, there is no prompt".format(query_file))
+            return False
+
+        # the old style query file has only one prompt
+        if isinstance(prompts, dict):
+            prompts = [prompts]
+        generate_info = dict(generate_info or {})
+        generate_info.update(self.overrides)
+        supply = generate_info.get('supply', 'OpenAI')
+        model = generate_info.get('model', 'gpt-3.5-turbo')
+        temperature = generate_info.get('temperature', 0.0)
+
+        output_file = self.get_output_file(query_file)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        # write to a partial file, it becomes the output only when the generation succeeds
+        partial_file = output_file + '.partial'
+        failed = []
+        with open(partial_file, 'w', encoding='utf-8') as f:
+            def on_reply(text, reason=None):
+                if not text:
+                    return
+                if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                    failed.append(text)
+                    return
+                if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                    # the reply is replaced, start the file again
+                    f.seek(0)
+                    f.truncate()
+                f.write(text)
+                f.flush()
+
+            request = self.manager.call_llm(supply, "InterfaceChatRequest", model=model, temperature=temperature,
+                                            examples=examples or [], prompts=prompts, new_chat=True, callback=on_reply,
+                                            priority=request_scheduler.RequestScheduler.PRIORITY_LOW)
+            if request is None:
+                failed.append("Cannot find valid api supply name {}".format(supply))
+            else:
+                request.wait()
+
+        if failed:
+            print("generate {} failed: {}".format(query_file, '; '.join(failed)))
+            return False
+
+        os.replace(partial_file, output_file)
+        self.checkpoint.mark_finished(query_file, output_file)
+        print("generate {} -> {}".format(query_file, output_file))
+        return True
+
+    def run(self, query_files, parallel):
+        self.set_input_root(query_files)
+        # the scheduler limits every supply, this only limits how many queries are loaded at the same time
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='batch') as executor:
+            results = list(executor.map(self.run_query, query_files))
+        return results.count(True), results.count(False)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate results from saved query json files without gui.")
+    parser.add_argument('inputs', nargs='+', help="query json files, directories or glob patterns")
+    parser.add_argument('-o', '--output', default='batch_output', help="the directory of the generated files")
+    parser.add_argument('-p', '--parallel', type=int, default=4, help="how many queries run at the same time")
+    parser.add_argument('--checkpoint', default='', help="the checkpoint file, default is <output>/checkpoint.json")
+    parser.add_argument('--supply', default='', help="override the supply saved in the query files")
+    parser.add_argument('--model', default='', help="override the model saved in the query files")
+    parser.add_argument('--temperature', type=float, default=None, help="override the temperature saved in the query files")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    query_files = collect_query_files(args.inputs)
+    if not query_files:
+        print("No query file is found.")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    checkpoint_file = os.path.abspath(args.checkpoint or os.path.join(args.output, 'checkpoint.json'))
+    checkpoint = BatchCheckpoint(checkpoint_file)
+    # the checkpoint is a json file too, it may be inside the input directory
+    query_files = [file for file in query_files if file != checkpoint_file]
+
+    overrides = {}
+    if args.supply:
+        overrides['supply'] = args.supply
+    if args.model:
+        overrides['model'] = args.model
+    if args.temperature is not None:
+        overrides['temperature'] = args.temperature
+
+    # import the manager here, so the help message doesn't wait for it
+    import system.manager
+    manager = system.manager.MainManager()
+    # there is no gui to show the supplies when they are ready, wait for them
+    manager.wait_providers()
+
+    generator = BatchGenerator(manager, args.output, checkpoint, overrides)
+    succeeded, failed = generator.run(query_files, max(args.parallel, 1))
+    print("{} succeeded, {} failed, {} in total".format(succeeded, failed, len(query_files)))
+    return 0 if failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: measure the build time and the query latency of the project embedding index
+#   the texts are embedded by a local hashing embedder by default, so the benchmark costs nothing,
+#   use --supply to embed them by a real llm supply
+# Usage:
+#   python benchmark_index.py path/to/project --queries 200
+#   python benchmark_index.py path/to/project --ivf --probes 8
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy
+
+from system import project_index
+
+
+class HashingEmbedder(object):
+    '''
+    HashingEmbedder maps the words of a text to a fixed size vector, similar texts get similar vectors
+    '''
+    WORD_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]+')
+
+    def __init__(self, dim):
+        super().__init__()
+        self.dim = dim
+
+    def embed_text(self, text):
+        vector = numpy.zeros(self.dim, dtype=numpy.float32)
+        for word in self.WORD_PATTERN.findall(text):
+            digest = hashlib.blake2b(word.lower().encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dim] += 1.0 if value & (1 << 63) else -1.0
+        return vector
+
+    def __call__(self, texts):
+        return [self.embed_text(text) for text in texts]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the build time and the query latency of the project embedding index.")
+    parser.add_argument('project', help="the root directory of the project")
+    parser.add_argument('--index-dir', default='', help="the directory of the index, default is a temporary directory")
+    parser.add_argument('--dim', type=int, default=256, help="the dimensions of the hashing embedder")
+    parser.add_argument('--queries', type=int, default=100, help="how many queries are measured")
+    parser.add_argument('--top-k', type=int, default=10, help="the top k of every query")
+    parser.add_argument('--changed', type=int, default=100, help="how many files are marked as changed for the incremental update")
+    parser.add_argument('--ivf', action='store_true', help="compare the ivf index with the brute force search")
+    parser.add_argument('--probes', type=int, default=project_index.ProjectIndex.IVF_PROBES, help="how many ivf lists are scanned by a query")
+    parser.add_argument('--supply', default='', help="embed by the llm supply instead of the hashing embedder, it costs money")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if not os.path.isdir(args.project):
+        print("{} is not a directory".format(args.project))
+        return 1
+
+    if args.supply:
+        import system.manager
+        manager = system.manager.MainManager()
+        manager.wait_providers()
+        embed = lambda texts: manager.embed_texts(args.supply, texts)
+        embed_name = args.supply
+    else:
+        embed = HashingEmbedder(args.dim)
+        embed_name = 'hashing-{}'.format(args.dim)
+
+    index_dir = args.index_dir or tempfile.mkdtemp(prefix='project_index_')
+    # the brute force search is measured first
+    index = project_index.ProjectIndex(index_dir, use_ivf=False)
+    print("index directory: {}".format(index_dir))
+
+    # build the index from nothing
+    index.clear()
+    result = index.update(args.project, embed, embed_name)
+    print("full build: {} files, {} chunks, {:.2f}s".format(result['files'], result['chunks'], result['seconds']))
+
+    # nothing is changed, only the file stats are compared
+    result = index.update(args.project, embed, embed_name)
+    print("no change update: {} files, {} changed, {:.2f}s".format(result['files'], result['changed'], result['seconds']))
+
+    # forget the hash of some files, they are read and embedded again, the files on disk are not touched
+    paths = [path for (path,) in index.db.execute('SELECT path FROM files')]
+    changed = random.sample(paths, min(args.changed, len(paths)))
+    for path in changed:
+        index.db.execute("UPDATE files SET hash = '', size = -1 WHERE path = ?", (path,))
+    index.db.commit()
+    result = index.update(args.project, embed, embed_name)
+    print("incremental update: {} files changed, {} chunks, {:.2f}s".format(result['changed'], result['chunks'], result['seconds']))
+
+    files, chunks, capacity, dim = index.get_statistics()
+    if not chunks:
+        print("the index is empty")
+        return 0
+
+    # query by the symbols of the indexed chunks
+    symbols = [symbol for (symbol,) in index.db.execute('SELECT symbol FROM chunks')]
+    queries = [random.choice(symbols) for _ in range(args.queries)]
+    embed_latencies = []
+    search_latencies = []
+    vectors = []
+    exact_results = []
+    for query in queries:
+        begin = time.perf_counter()
+        vector = embed([query])[0]
+        middle = time.perf_counter()
+        exact_results.append(index.search(vector, args.top_k))
+        end = time.perf_counter()
+        vectors.append(vector)
+        embed_latencies.append(middle - begin)
+        search_latencies.append(end - middle)
+
+    print("{} chunks x {} dimensions, capacity {}".format(chunks, dim, capacity))
+    print("search latency: mean {:.2f}ms, p50 {:.2f}ms, p95 {:.2f}ms".format(
+        statistics.mean(search_latencies) * 1000, percentile(search_latencies, 50) * 1000, percentile(search_latencies, 95) * 1000))
+    print("embed latency: mean {:.2f}ms".format(statistics.mean(embed_latencies) * 1000))
+
+    if args.ivf:
+        index.use_ivf = True
+        begin = time.perf_counter()
+        with index.mutex:
+            index.build_ivf()
+        print("ivf build: {} lists, {:.2f}s".format(len(index.centroids), time.perf_counter() - begin))
+        ivf_latencies = []
+        recalls = []
+        for vector, exact in zip(vectors, exact_results):
+            begin = time.perf_counter()
+            result = index.search(vector, args.top_k, args.probes)
+            ivf_latencies.append(time.perf_counter() - begin)
+            # the recall is the part of the exact top k that is found by the ivf index
+            expected = set(item[1:] for item in exact)
+            recalls.append(len(expected & set(item[1:] for item in result)) / max(len(expected), 1))
+        print("ivf search latency ({} probes): mean {:.2f}ms, p50 {:.2f}ms, p95 {:.2f}ms, recall@{} {:.3f}".format(
+            args.probes, statistics.mean(ivf_latencies) * 1000, percentile(ivf_latencies, 50) * 1000,
+            percentile(ivf_latencies, 95) * 1000, args.top_k, statistics.mean(recalls)))
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: highlight the fenced code blocks of the response
+#   QSyntaxHighlighter highlights a line only when it's changed, and the next lines only if the state of the line is changed,
+#   the state of a line tells whether it's in a code block and the language of the block,
+#   so appending a streamed piece highlights only the new lines of the open block
+
+import re
+
+from PySide6.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
+
+from system import code_fence
+
+
+def make_format(color, bold=False, italic=False):
+    text_format = QTextCharFormat()
+    text_format.setForeground(QColor(color))
+    if bold:
+        text_format.setFontWeight(QFont.Bold)
+    if italic:
+        text_format.setFontItalic(True)
+    return text_format
+
+
+class CodeHighlighter(QSyntaxHighlighter):
+    '''
+    CodeHighlighter highlights the code blocks of a markdown document, the text out of the blocks is left as it is
+    '''
+    # the state of a line in a block is 1 + (language index * 2 + (1 if the fence is ~~~)) * 8 + (fence length - 3)
+    STATE_TEXT = 0
+    LANGUAGES = ['', 'python', 'py', 'lua', 'c', 'cpp', 'c++', 'cs', 'csharp', 'java', 'javascript', 'js', 'typescript', 'ts',
+                 'go', 'rust', 'json', 'shell', 'bash', 'sh', 'hlsl', 'glsl']
+
+    KEYWORDS = {
+        'python': ('False None True and as assert async await break class continue def del elif else except finally for from '
+                   'global if import in is lambda nonlocal not or pass raise return self try while with yield'),
+        'lua': ('and break do else elseif end false for function goto if in local nil not or repeat return then true until while self'),
+        'c': ('auto bool break case char class const continue default delete do double else enum explicit extern false float for '
+              'friend goto if inline int long namespace new nullptr operator private protected public return short signed sizeof '
+              'static struct switch template this true typedef typename union unsigned using virtual void volatile while'),
+        'java': ('abstract async await bool boolean break case catch class const continue default do double else enum export extends '
+                 'false final finally float for fn func function go if impl implements import in instanceof int interface let long '
+                 'match mut namespace new null package private protected public return static string struct super switch this '
+                 'throw true try type typeof use using var void while'),
+    }
+    LANGUAGE_KEYWORDS = {'py': 'python', 'cpp': 'c', 'c++': 'c', 'hlsl': 'c', 'glsl': 'c'}
+    # the languages that comment by #, the others by //
+    HASH_COMMENT = ('python', 'py', 'shell', 'bash', 'sh')
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.fence_format = make_format('#808080', bold=True)
+        self.keyword_format = make_format('#0000c0', bold=True)
+        self.string_format = make_format('#008000')
+        self.comment_format = make_format('#808080', italic=True)
+        self.number_format = make_format('#a0522d')
+        self.keyword_patterns = {}
+
+    def get_language_index(self, language):
+        return self.LANGUAGES.index(language) if language in self.LANGUAGES else 0
+
+    def get_keyword_pattern(self, language):
+        language = self.LANGUAGE_KEYWORDS.get(language, language)
+        if language not in self.KEYWORDS:
+            language = 'java'
+        pattern = self.keyword_patterns.get(language)
+        if pattern is None:
+            pattern = re.compile(r'\b(?:{})\b'.format('|'.join(self.KEYWORDS[language].split())))
+            self.keyword_patterns[language] = pattern
+        return pattern
+
+    def highlightBlock(self, text):
+        state = self.previousBlockState()
+        if state <= self.STATE_TEXT:
+            fence = code_fence.match_fence(text)
+            if fence is None:
+                self.setCurrentBlockState(self.STATE_TEXT)
+                return
+            self.setFormat(0, len(text), self.fence_format)
+            tilde = 1 if fence[0][0] == '~' else 0
+            self.setCurrentBlockState(1 + (self.get_language_index(fence[1]) * 2 + tilde) * 8 + min(len(fence[0]) - 3, 7))
+            return
+
+        kind, fence_length = divmod(state - 1, 8)
+        fence = ('~' if kind % 2 else '`') * (fence_length + 3)
+        if code_fence.is_closing_fence(text, fence):
+            self.setFormat(0, len(text), self.fence_format)
+            self.setCurrentBlockState(self.STATE_TEXT)
+            return
+
+        self.setCurrentBlockState(state)
+        self.highlightCode(text, self.LANGUAGES[kind // 2])
+
+    def highlightCode(self, text, language):
+        for match in self.get_keyword_pattern(language).finditer(text):
+            self.setFormat(match.start(), match.end() - match.start(), self.keyword_format)
+        for match in re.finditer(r'\b\d+(?:\.\d+)?\b', text):
+            self.setFormat(match.start(), match.end() - match.start(), self.number_format)
+        # the strings and comments of a single line, the later formats cover the keywords in them
+        comment = '#' if language in self.HASH_COMMENT else ('--' if language == 'lua' else '//')
+        index = 0
+        while index < len(text):
+            char = text[index]
+            if char in '"\'':
+                end = index + 1
+                while end < len(text) and text[end] != char:
+                    end += 2 if text[end] == '\\' else 1
+                self.setFormat(index, min(end + 1, len(text)) - index, self.string_format)
+                index = end + 1
+            elif text.startswith(comment, index):
+                self.setFormat(index, len(text) - index, self.comment_format)
+                break
+            else:
+                index += 1
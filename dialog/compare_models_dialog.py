@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: run the same examples and prompts against several models at once, and compare the results side by side
+
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem, QPushButton,
+                               QSplitter, QPlainTextEdit, QTableWidget, QTableWidgetItem, QMessageBox)
+from PySide6.QtCore import Qt, Signal
+from PySide6 import QtGui
+from system.llm import llm_interface
+
+
+class CompareModelsDialog(QDialog):
+    '''
+    CompareModelsDialog sends one request to every checked (supply, model),
+    streams each reply into its own pane, and shows the latency, tokens and cost of every model
+    '''
+    # the signals are emitted from the worker threads, the slots run in the gui thread
+    replyReceived = Signal(int, str, object)
+    targetCompleted = Signal(int, object)
+
+    STATS_COLUMNS = ["Supply", "Model", "Latency(s)", "First token(s)", "Prompt tokens", "Completion tokens", "Cost($)", "Error"]
+
+    def __init__(self, parent, collect_request):
+        '''
+        collect_request returns (examples, prompts, temperature) of the generate dialog
+        '''
+        super().__init__(parent)
+        self.system = parent.system
+        self.collect_request = collect_request
+        self.targets = []
+        self.panes = []
+        self.request = None
+
+        self.setWindowTitle("Compare Models")
+        self.resize(1200, 800)
+        self.initUI()
+
+        self.replyReceived.connect(self.onReplyReceived)
+        self.targetCompleted.connect(self.onTargetCompleted)
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        top_layout = QHBoxLayout()
+        self.listWidgetModels = QListWidget(self)
+        self.listWidgetModels.setMaximumHeight(150)
+        top_layout.addWidget(self.listWidgetModels)
+        self.pushButtonRun = QPushButton("Run", self)
+        self.pushButtonRun.clicked.connect(self.clickRun)
+        top_layout.addWidget(self.pushButtonRun)
+        layout.addLayout(top_layout)
+
+        self.splitterPanes = QSplitter(Qt.Horizontal, self) # type: ignore
+        layout.addWidget(self.splitterPanes, 1)
+
+        self.tableWidgetStats = QTableWidget(0, len(self.STATS_COLUMNS), self)
+        self.tableWidgetStats.setHorizontalHeaderLabels(self.STATS_COLUMNS)
+        self.tableWidgetStats.setMaximumHeight(180)
+        layout.addWidget(self.tableWidgetStats)
+
+        self.initModelList()
+
+    def initModelList(self):
+        self.listWidgetModels.clear()
+        model_dict = self.system.InterfaceGetAllModels()
+        for supply, model_list in model_dict.items():
+            for model in model_list or []:
+                item = QListWidgetItem("{} / {}".format(supply, model))
+                item.setData(Qt.UserRole, (supply, model)) # type: ignore
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable) # type: ignore
+                item.setCheckState(Qt.Unchecked) # type: ignore
+                self.listWidgetModels.addItem(item)
+
+    def getCheckedTargets(self):
+        targets = []
+        for row in range(self.listWidgetModels.count()):
+            item = self.listWidgetModels.item(row)
+            if item.checkState() == Qt.Checked: # type: ignore
+                targets.append(tuple(item.data(Qt.UserRole))) # type: ignore
+        return targets
+
+    def clickRun(self):
+        targets = self.getCheckedTargets()
+        if len(targets) < 1:
+            QMessageBox.warning(self, "Warning", "Please check at least one model")
+            return
+
+        examples, prompts, temperature = self.collect_request()
+        self.initPanes(targets)
+
+        self.pushButtonRun.setEnabled(False)
+        self.request = self.system.call_llm(targets=targets, examples=examples, prompts=prompts, temperature=temperature,
+                                            callback=lambda index, text, reason: self.replyReceived.emit(index, text, reason),
+                                            complete_callback=lambda index, stats: self.targetCompleted.emit(index, stats))
+
+    def initPanes(self, targets):
+        # remove the panes of the last run
+        for pane in self.panes:
+            pane.setParent(None)
+            pane.deleteLater()
+        self.panes = []
+        self.targets = targets
+        self.remain = len(targets)
+
+        for supply, model in targets:
+            pane = QPlainTextEdit(self.splitterPanes)
+            pane.setReadOnly(True)
+            pane.setPlaceholderText("{} / {}".format(supply, model))
+            self.splitterPanes.addWidget(pane)
+            self.panes.append(pane)
+
+        self.tableWidgetStats.setRowCount(len(targets))
+        for row, (supply, model) in enumerate(targets):
+            self.setStatsRow(row, [supply, model, "", "", "", "", "", ""])
+
+    def setStatsRow(self, row, values):
+        for column, value in enumerate(values):
+            self.tableWidgetStats.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def onReplyReceived(self, index, text, reason):
+        if index >= len(self.panes):
+            return
+        pane = self.panes[index]
+        if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+            pane.setPlainText(text)
+            return
+        text_cursor = QtGui.QTextCursor(pane.document())
+        text_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        text_cursor.insertText(text)
+
+    def onTargetCompleted(self, index, stats):
+        first_token = stats['first_token_latency']
+        self.setStatsRow(index, [
+            stats['supply'],
+            stats['model'],
+            "{:.2f}".format(stats['latency']),
+            "" if first_token is None else "{:.2f}".format(first_token),
+            stats['prompt_tokens'],
+            stats['completion_tokens'],
+            "{:.4f}".format(stats['cost']),
+            stats['error'],
+        ])
+
+        self.remain -= 1
+        if self.remain <= 0:
+            self.pushButtonRun.setEnabled(True)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: show the usage and cost of the chat requests recorded in the usage ledger
+
+import time
+
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QComboBox,
+                               QTableWidget, QTableWidgetItem, QAbstractItemView)
+
+
+def fill_table(table, rows, start_row=0):
+    table.setRowCount(start_row + len(rows))
+    for row, values in enumerate(rows, start_row):
+        for column, value in enumerate(values):
+            table.setItem(row, column, QTableWidgetItem(value))
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return "{:.2f}s".format(seconds)
+
+
+class CostHistoryDialog(QDialog):
+    '''
+    CostHistoryDialog lists the recorded requests from the newest one, a page is loaded at a time
+    '''
+    PAGE_SIZE = 200
+    HEADER_LABELS = ["Time", "Supply", "Model", "Status", "Prompt Tokens", "Completion Tokens", "Latency", "First Token", "Cost"]
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.system = parent.system
+        self.loaded = 0
+
+        self.setWindowTitle("Cost History")
+        self.resize(1000, 600)
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+        self.tableWidgetHistory = QTableWidget(0, len(self.HEADER_LABELS), self)
+        self.tableWidgetHistory.setHorizontalHeaderLabels(self.HEADER_LABELS)
+        self.tableWidgetHistory.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.tableWidgetHistory, 1)
+
+        button_layout = QHBoxLayout()
+        self.labelCount = QLabel(self)
+        button_layout.addWidget(self.labelCount, 1)
+        self.pushButtonRefresh = QPushButton("Refresh", self)
+        self.pushButtonRefresh.clicked.connect(self.refresh)
+        button_layout.addWidget(self.pushButtonRefresh)
+        self.pushButtonMore = QPushButton("Load More", self)
+        self.pushButtonMore.clicked.connect(self.clickLoadMore)
+        button_layout.addWidget(self.pushButtonMore)
+        layout.addLayout(button_layout)
+
+    def refresh(self):
+        self.loaded = 0
+        self.tableWidgetHistory.setRowCount(0)
+        self.clickLoadMore()
+
+    def clickLoadMore(self):
+        entries = self.system.InterfaceGetUsageHistory(self.loaded, self.PAGE_SIZE)
+        rows = []
+        for entry in entries:
+            rows.append([
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])),
+                entry['supply'], entry['model'], entry['status'],
+                str(entry['prompt_tokens']), str(entry['completion_tokens']),
+                format_seconds(entry['latency']), format_seconds(entry['first_token_latency']),
+                "${:.4f}".format(entry['cost']),
+            ])
+        fill_table(self.tableWidgetHistory, rows, self.loaded)
+        self.loaded += len(entries)
+        # the last page is loaded
+        self.pushButtonMore.setEnabled(len(entries) == self.PAGE_SIZE)
+        self.labelCount.setText("{} requests are shown".format(self.loaded))
+
+
+class CostStatisticsDialog(QDialog):
+    '''
+    CostStatisticsDialog shows the total cost, and the cost of every model and every day, they are read from the rollups
+    '''
+    PERIODS = [("All", 0), ("Last 30 days", 30), ("Last 7 days", 7), ("Today", 1)]
+    MODEL_LABELS = ["Supply", "Model", "Requests", "Cached", "Failed", "Prompt Tokens", "Completion Tokens",
+                    "Avg Latency", "Avg First Token", "Cost"]
+    DAY_LABELS = ["Day", "Requests", "Cached", "Failed", "Prompt Tokens", "Completion Tokens", "Cost"]
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.system = parent.system
+
+        self.setWindowTitle("Total Cost Statistics")
+        self.resize(1000, 700)
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        period_layout = QHBoxLayout()
+        self.comboBoxPeriod = QComboBox(self)
+        for name, _ in self.PERIODS:
+            self.comboBoxPeriod.addItem(name)
+        self.comboBoxPeriod.currentIndexChanged.connect(lambda index: self.refresh())
+        period_layout.addWidget(self.comboBoxPeriod)
+        self.labelTotal = QLabel(self)
+        period_layout.addWidget(self.labelTotal, 1)
+        self.pushButtonRefresh = QPushButton("Refresh", self)
+        self.pushButtonRefresh.clicked.connect(self.refresh)
+        period_layout.addWidget(self.pushButtonRefresh)
+        layout.addLayout(period_layout)
+
+        self.tableWidgetModels = QTableWidget(0, len(self.MODEL_LABELS), self)
+        self.tableWidgetModels.setHorizontalHeaderLabels(self.MODEL_LABELS)
+        self.tableWidgetModels.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.tableWidgetModels, 1)
+
+        self.tableWidgetDays = QTableWidget(0, len(self.DAY_LABELS), self)
+        self.tableWidgetDays.setHorizontalHeaderLabels(self.DAY_LABELS)
+        self.tableWidgetDays.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.tableWidgetDays, 1)
+
+    def refresh(self):
+        days = self.PERIODS[max(self.comboBoxPeriod.currentIndex(), 0)][1]
+        statistics = self.system.InterfaceGetUsageStatistics(days)
+
+        total = statistics['total']
+        if total is None or not (total['requests'] or total['summaries'] or total['embeddings']):
+            self.labelTotal.setText("No request is recorded")
+        else:
+            # the summaries and the embeddings are paid too, they are in the tokens and the cost
+            self.labelTotal.setText("{} requests, {} cached, {} summaries, {} embeddings, {} prompt tokens, {} completion tokens, total cost ${:.4f}".format(
+                total['requests'], total['cached'], total['summaries'], total['embeddings'],
+                total['prompt_tokens'], total['completion_tokens'], total['cost']))
+
+        rows = []
+        for item in statistics['models']:
+            supply, model = item['key']
+            rows.append([supply, model, str(item['requests']), str(item['cached']), str(item['failed']),
+                         str(item['prompt_tokens']), str(item['completion_tokens']),
+                         format_seconds(item['average_latency']), format_seconds(item['average_first_token_latency']),
+                         "${:.4f}".format(item['cost'])])
+        fill_table(self.tableWidgetModels, rows)
+
+        rows = []
+        # the newest day first
+        for item in reversed(statistics['days']):
+            rows.append([item['key'][0], str(item['requests']), str(item['cached']), str(item['failed']),
+                         str(item['prompt_tokens']), str(item['completion_tokens']), "${:.4f}".format(item['cost'])])
+        fill_table(self.tableWidgetDays, rows)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: build the embedding index of the project root, and search the code chunks that are similar to a text
+
+import threading
+
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QProgressBar, QLabel, QLineEdit,
+                               QTableWidget, QTableWidgetItem, QMessageBox)
+from PySide6.QtCore import Signal
+
+
+class EmbeddingDialog(QDialog):
+    '''
+    EmbeddingDialog updates the project index in a worker thread, only the changed files are embedded again
+    '''
+    # the signals are emitted from the worker thread, the slots run in the gui thread
+    progressChanged = Signal(int, int, str)
+    indexUpdated = Signal(object, str)
+    searchCompleted = Signal(object, str)
+
+    RESULT_COLUMNS = ["Score", "File", "Symbol", "Lines"]
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.system = parent.system
+        self.update_thread = None
+        self.cancel_event = None
+        self.search_thread = None
+
+        self.setWindowTitle("Project Embeddings")
+        self.resize(900, 600)
+        self.initUI()
+
+        self.progressChanged.connect(self.onProgressChanged)
+        self.indexUpdated.connect(self.onIndexUpdated)
+        self.searchCompleted.connect(self.onSearchCompleted)
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+
+        self.labelProject = QLabel(self)
+        layout.addWidget(self.labelProject)
+        self.labelStatistics = QLabel(self)
+        layout.addWidget(self.labelStatistics)
+
+        update_layout = QHBoxLayout()
+        self.progressBar = QProgressBar(self)
+        update_layout.addWidget(self.progressBar, 1)
+        self.pushButtonUpdate = QPushButton("Update Index", self)
+        self.pushButtonUpdate.clicked.connect(self.clickUpdate)
+        update_layout.addWidget(self.pushButtonUpdate)
+        self.pushButtonCancel = QPushButton("Cancel", self)
+        self.pushButtonCancel.setEnabled(False)
+        self.pushButtonCancel.clicked.connect(self.clickCancel)
+        update_layout.addWidget(self.pushButtonCancel)
+        layout.addLayout(update_layout)
+
+        search_layout = QHBoxLayout()
+        self.lineEditQuery = QLineEdit(self)
+        self.lineEditQuery.setPlaceholderText("Search the code of the project")
+        self.lineEditQuery.returnPressed.connect(self.clickSearch)
+        search_layout.addWidget(self.lineEditQuery, 1)
+        self.pushButtonSearch = QPushButton("Search", self)
+        self.pushButtonSearch.clicked.connect(self.clickSearch)
+        search_layout.addWidget(self.pushButtonSearch)
+        layout.addLayout(search_layout)
+
+        self.tableWidgetResult = QTableWidget(0, len(self.RESULT_COLUMNS), self)
+        self.tableWidgetResult.setHorizontalHeaderLabels(self.RESULT_COLUMNS)
+        layout.addWidget(self.tableWidgetResult, 1)
+
+        self.initStatistics()
+
+    def initStatistics(self):
+        self.labelProject.setText("Project: {}".format(self.system.call_settings("InterfaceGetProjectRootDir")))
+        try:
+            files, chunks, _, dim = self.system.InterfaceGetProjectIndexStatistics()
+        except ImportError as e:
+            self.labelStatistics.setText(str(e))
+            self.pushButtonUpdate.setEnabled(False)
+            self.pushButtonSearch.setEnabled(False)
+            return
+        self.labelStatistics.setText("{} files, {} chunks, {} dimensions".format(files, chunks, dim))
+
+    def clickUpdate(self):
+        if self.update_thread is not None and self.update_thread.is_alive():
+            return
+
+        self.cancel_event = threading.Event()
+        self.pushButtonUpdate.setEnabled(False)
+        self.pushButtonCancel.setEnabled(True)
+        self.progressBar.setValue(0)
+        self.update_thread = threading.Thread(target=self.updateIndex, args=(self.cancel_event,), daemon=True)
+        self.update_thread.start()
+
+    def updateIndex(self, cancel_event):
+        # runs in the worker thread
+        progress = lambda done, total, message: self.progressChanged.emit(done, total, message)
+        try:
+            result = self.system.InterfaceUpdateProjectIndex(progress, cancel_event)
+        except Exception as e:
+            self.indexUpdated.emit(None, str(e))
+            return
+        self.indexUpdated.emit(result, "")
+
+    def clickCancel(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+
+    def onProgressChanged(self, done, total, message):
+        self.progressBar.setMaximum(max(total, 1))
+        self.progressBar.setValue(done)
+        self.progressBar.setFormat("%v / %m  " + message)
+
+    def onIndexUpdated(self, result, error):
+        self.pushButtonUpdate.setEnabled(True)
+        self.pushButtonCancel.setEnabled(False)
+        if error:
+            QMessageBox.warning(self, "Warning", "Update the index failed: {}".format(error))
+            return
+        self.initStatistics()
+        self.progressBar.setFormat("{} files changed, {} removed, {} chunks embedded in {:.1f}s".format(
+            result['changed'], result['removed'], result['chunks'], result['seconds']))
+
+    def clickSearch(self):
+        text = self.lineEditQuery.text()
+        if not text:
+            return
+        if self.search_thread is not None and self.search_thread.is_alive():
+            return
+
+        # the text is embedded by the supply, it's a network request
+        self.pushButtonSearch.setEnabled(False)
+        self.search_thread = threading.Thread(target=self.searchIndex, args=(text,), daemon=True)
+        self.search_thread.start()
+
+    def searchIndex(self, text):
+        # runs in the worker thread
+        try:
+            results = self.system.InterfaceSearchProjectIndex(text, 20)
+        except Exception as e:
+            self.searchCompleted.emit(None, str(e))
+            return
+        self.searchCompleted.emit(results, "")
+
+    def onSearchCompleted(self, results, error):
+        self.pushButtonSearch.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, "Warning", "Search failed: {}".format(error))
+            return
+
+        self.tableWidgetResult.setRowCount(len(results))
+        for row, (score, path, symbol, start_line, end_line) in enumerate(results):
+            values = ["{:.3f}".format(score), path, symbol, "{}-{}".format(start_line, end_line)]
+            for column, value in enumerate(values):
+                self.tableWidgetResult.setItem(row, column, QTableWidgetItem(value))
@@ -2,8 +2,9 @@
 # author: CasinoHe
 # Purpose: the dialog of example tab
 
-from PySide6.QtWidgets import QWidget, QFileDialog, QMessageBox
+from PySide6.QtWidgets import QWidget, QFileDialog, QMessageBox, QPushButton, QDialog
 from ui import example_tab_ui
+from dialog import symbol_dialog
 
 class ExampleTab(QWidget):
     '''
@@ -13,10 +14,20 @@ class ExampleTab(QWidget):
         super(ExampleTab, self).__init__(parent)
 
         self.system = parent.system
+        # the prompts decide which symbols of a long file are relevant
+        self.prompts_callback = getattr(parent, 'collectPrompts', None)
         # init ui
         self.ui = example_tab_ui.Ui_TabWidget()
         self.ui.setupUi(self)
         self.open_example_callback = callback
+        # (start line, end line) if only a part of the file is the example, the lines are 1-based and inclusive
+        self.line_range = None
+        # the whole file and its symbols, the example is built from the selected symbols,
+        # selected_symbols is None if the whole file is the example
+        self.file_content = None
+        self.analysis = None
+        self.selected_symbols = None
+        self.keep_signatures = True
         self.initUI()
 
     def initUI(self):
@@ -27,7 +38,14 @@ class ExampleTab(QWidget):
 
         # disable refresh button first, because there is no file selected
         self.ui.pushButtonRefresh.setEnabled(False)
-        
+
+        # choose the symbols of the file that are sent
+        self.pushButtonSymbols = QPushButton("Symbols", self.ui.groupBoxTabOperation)
+        self.pushButtonSymbols.setToolTip("Send only the chosen classes and functions of the file")
+        self.ui.horizontalLayout_3.addWidget(self.pushButtonSymbols)
+        self.pushButtonSymbols.clicked.connect(self.clickSymbols)
+        self.pushButtonSymbols.setEnabled(False)
+
     def clickOpenExampleFile(self):
         project_dir = self.system.call_settings("InterfaceGetProjectRootDir")
         filepath = QFileDialog.getOpenFileName(self, "Open Example File", project_dir, "Python Files (*.py);;All Files (*)")
@@ -38,16 +56,78 @@ class ExampleTab(QWidget):
         self.loadExampleFileDirectly(filepath[0])
 
     def loadExampleFileDirectly(self, file_path):
+        self.line_range = None
         # set file path to lineEdit
         self.ui.lineEditExample.setText(file_path)
-        # read file content to plainTextEdit and refresh it
+        # read file content, a long file is reduced to the symbols relevant to the prompts
         with open(file_path, "r", encoding='utf-8') as f:
-            self.ui.plainTextEdit.setPlainText(f.read())
+            self.loadExampleContent(file_path, f.read(), None)
 
         # enable refresh button
         self.ui.pushButtonRefresh.setEnabled(True)
         self.open_example_callback()
 
+    def loadExampleContent(self, file_path, content, selected_symbols):
+        self.file_content = content
+        self.analysis = self.system.InterfaceAnalyzeExample(file_path, content)
+        if selected_symbols is None:
+            selected_symbols = self.selectRelevantSymbols()
+        else:
+            # the symbols that are removed from the file are forgotten
+            names = set(symbol['name'] for symbol in self.analysis['symbols'])
+            selected_symbols = selected_symbols & names
+        self.applySymbols(selected_symbols)
+        self.pushButtonSymbols.setEnabled(True)
+
+    def selectRelevantSymbols(self):
+        # return None to send the whole file
+        slice_tokens = self.system.call_settings("InterfaceGetExampleSliceTokens")
+        if not slice_tokens or self.analysis['tokens'] <= slice_tokens or self.prompts_callback is None:
+            return None
+        prompts = self.prompts_callback()
+        if not any(prompt.get('content') or prompt.get('system') for prompt in prompts):
+            return None
+        return self.system.InterfaceSelectExampleSymbols(self.file_content, self.analysis, prompts, slice_tokens, self.keep_signatures)
+
+    def applySymbols(self, selected_symbols):
+        self.selected_symbols = selected_symbols
+        if selected_symbols is None:
+            self.ui.plainTextEdit.setPlainText(self.file_content)
+            self.pushButtonSymbols.setText("Symbols")
+            return
+        content = self.system.InterfaceSliceExample(self.file_content, self.analysis, selected_symbols, self.keep_signatures)
+        self.ui.plainTextEdit.setPlainText(content)
+        self.pushButtonSymbols.setText("Symbols ({}/{})".format(len(selected_symbols), len(self.analysis['symbols'])))
+
+    def clickSymbols(self):
+        if self.analysis is None:
+            return
+        prompts = self.prompts_callback() if self.prompts_callback is not None else []
+        dialog = symbol_dialog.SymbolDialog(self.system, self.file_content, self.analysis, self.selected_symbols,
+                                            self.keep_signatures, prompts, self)
+        if dialog.exec() != QDialog.Accepted:
+            return
+        self.keep_signatures = dialog.isKeepSignatures()
+        self.applySymbols(dialog.getSelectedSymbols())
+
+    def forgetSymbols(self):
+        # the content is not read from the file by symbols
+        self.file_content = None
+        self.analysis = None
+        self.selected_symbols = None
+        self.pushButtonSymbols.setText("Symbols")
+        self.pushButtonSymbols.setEnabled(False)
+
+    def loadExampleChunkDirectly(self, file_path, start_line, end_line, content, desc):
+        # the example is a part of the file, refresh reads the same lines again
+        self.forgetSymbols()
+        self.line_range = (start_line, end_line)
+        self.ui.lineEditExample.setText(file_path)
+        self.ui.plainTextEdit.setPlainText(content)
+        self.ui.plainTextEditExampleDesc.setPlainText(desc)
+        self.ui.pushButtonRefresh.setEnabled(True)
+        self.open_example_callback()
+
     def clickRefreshExample(self):
         if len(self.ui.lineEditExample.text()) <= 0:
             # use QmessageBox to display a warning
@@ -55,7 +135,12 @@ class ExampleTab(QWidget):
             return
         # read file content to plainTextEdit and refresh it
         with open(self.ui.lineEditExample.text(), "r", encoding='utf-8') as f:
-            self.ui.plainTextEdit.setPlainText(f.read())
+            if self.line_range is None:
+                # keep the chosen symbols of the file
+                self.loadExampleContent(self.ui.lineEditExample.text(), f.read(), self.selected_symbols)
+            else:
+                lines = f.readlines()
+                self.ui.plainTextEdit.setPlainText(''.join(lines[self.line_range[0] - 1:self.line_range[1]]))
 
     def getExampleContent(self):
         return self.ui.plainTextEdit.toPlainText()
@@ -64,6 +149,8 @@ class ExampleTab(QWidget):
         return self.ui.lineEditExample.text()
 
     def setExampleFile(self, filepath):
+        self.line_range = None
+        self.forgetSymbols()
         self.ui.lineEditExample.setText(filepath)
         self.ui.pushButtonRefresh.setEnabled(True)
 
@@ -82,8 +169,16 @@ class ExampleTab(QWidget):
     def setExampleResponse(self, response):
         self.ui.plainTextEditExampleResponse.setPlainText(response)
 
+    def connectContentChanged(self, callback):
+        # callback is called when any text that is sent to the llm is changed
+        self.ui.plainTextEdit.textChanged.connect(callback)
+        self.ui.plainTextEditExampleDesc.textChanged.connect(callback)
+        self.ui.plainTextEditExampleResponse.textChanged.connect(callback)
+
     def clear(self):
         # clear lineEdit and plainTextEdit
+        self.line_range = None
+        self.forgetSymbols()
         self.ui.lineEditExample.clear()
         self.ui.plainTextEdit.clear()
         self.ui.plainTextEditExampleDesc.clear()
\ No newline at end of file
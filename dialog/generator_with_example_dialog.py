@@ -4,15 +4,14 @@
 #    Create a GUI dialog to generate code, So it's easy to use
 
 # using PySide6 to create a GUI dialog
-from PySide6.QtWidgets import QDialog, QMessageBox, QFileDialog, QApplication
-from PySide6.QtCore import QTimer, Qt
-from PySide6 import QtGui
+from PySide6.QtWidgets import QDialog, QMessageBox, QFileDialog, QPushButton, QCheckBox, QSpinBox
+from PySide6.QtCore import Qt, Signal
 from ui import generate_dialog_ui
 import threading
 from dialog import example_tab
 from dialog import prompt_tab
-import copy
-from system.llm import llm_interface
+from dialog import token_meter
+from dialog import stream_sink
 
 
 class GeneratorWithExampleDialog(QDialog):
@@ -23,6 +22,16 @@ class GeneratorWithExampleDialog(QDialog):
         2. select prompt file
         3. select models, and set parameters, generate code
     '''
+    # emitted from the thread that fetches the models, the slot runs in the gui thread
+    modelsUpdated = Signal(str)
+    # emitted from the thread that searches the project index, (suggestions, error message)
+    examplesSuggested = Signal(object, str)
+    # emitted from the thread of the best of n request, the ranked candidates
+    candidatesRanked = Signal(object)
+
+    # how many examples are suggested from the project index
+    SUGGEST_EXAMPLE_COUNT = 3
+
     def __init__(self, parent):
         super().__init__(parent)
 
@@ -34,11 +43,15 @@ class GeneratorWithExampleDialog(QDialog):
 
         self.example_tabs = []
         self.prompt_tabs = []
-        self.result_content = []
-        self.result_update_timer = QTimer(self)
-        self.result_update_mutex = threading.Lock()
-        self.result_completed = False
-        self.last_chat_request = None
+        # the streamed reply is shown in the last prompt tab, pieces are coalesced into one edit per flush
+        self.result_sink = stream_sink.StreamSink(self.appendResult, self.clearResult, self.onGenerateResultCompleted, self)
+        self.result_callback = None
+        self.compare_models_dialog = None
+        # the handle of the running request in the scheduler, it can be cancelled
+        self.current_request = None
+        # estimate the token and cost while editing, without blocking the gui
+        self.token_meter = token_meter.TokenMeter(self.system, self)
+        self.token_meter.estimated.connect(self.onTokenEstimated)
         self.initUI()
         self.setModal(True)
 
@@ -60,6 +73,7 @@ class GeneratorWithExampleDialog(QDialog):
         open_example_callback = lambda: self.onSelectedExampleFile()
         # then, add example tabs
         self.example_tabs.append(example_tab.ExampleTab(open_example_callback, self))
+        self.example_tabs[0].connectContentChanged(self.onRequestContentChanged)
         self.ui.tabWidgetExamples.addTab(self.example_tabs[0], "Example {}".format(len(self.example_tabs)))
 
         # connect signals and slots
@@ -68,6 +82,12 @@ class GeneratorWithExampleDialog(QDialog):
         self.ui.pushButtonDeleteExample.clicked.connect(self.clickDeleteExampleTab)
         # connect clear example button
         self.ui.pushButtonClearExample.clicked.connect(self.clickClearExampleTab)
+        # fill the example tabs by the code of the project that is similar to the prompt
+        self.pushButtonSuggestExamples = QPushButton("Suggest Examples", self.ui.groupBoxExamples)
+        self.pushButtonSuggestExamples.setToolTip("Search the project index for the code most similar to the last prompt")
+        self.ui.horizontalLayout_15.addWidget(self.pushButtonSuggestExamples)
+        self.pushButtonSuggestExamples.clicked.connect(self.clickSuggestExamples)
+        self.examplesSuggested.connect(self.onExamplesSuggested)
 
         # disable new example button first, because there is no file selected
         self.ui.pushButtonNewExample.setEnabled(False)
@@ -90,6 +110,7 @@ class GeneratorWithExampleDialog(QDialog):
         # lambda callback function to call onSelectedExampleFile
         open_example_callback = lambda: self.onSelectedExampleFile()
         self.example_tabs.append(example_tab.ExampleTab(open_example_callback, self))
+        self.example_tabs[-1].connectContentChanged(self.onRequestContentChanged)
         self.ui.tabWidgetExamples.addTab(self.example_tabs[-1], "Example {}".format(len(self.example_tabs)))
         # change tab to the new tab
         self.ui.tabWidgetExamples.setCurrentIndex(len(self.example_tabs) - 1)
@@ -106,10 +127,48 @@ class GeneratorWithExampleDialog(QDialog):
         tab_index = self.ui.tabWidgetExamples.currentIndex()
         self.ui.tabWidgetExamples.removeTab(tab_index)
         self.example_tabs.pop(tab_index)
+        self.onRequestContentChanged()
         # update tab index
         for i in range(len(self.example_tabs)):
             self.ui.tabWidgetExamples.setTabText(i, "Example {}".format(i + 1))
 
+    def clickSuggestExamples(self):
+        _, prompts = self._collectChatRequest()
+        if not prompts or not (prompts[-1]['content'] or prompts[-1]['system']):
+            QMessageBox.warning(self, "Warning", "Please input the prompt first")
+            return
+        self.pushButtonSuggestExamples.setEnabled(False)
+        # embedding the prompt is a network request, don't block the gui
+        thread = threading.Thread(target=self.suggestExamples, args=(prompts,), daemon=True)
+        thread.start()
+
+    def suggestExamples(self, prompts):
+        # runs in the worker thread
+        try:
+            suggestions = self.system.InterfaceSuggestExamples(prompts, self.SUGGEST_EXAMPLE_COUNT)
+        except Exception as e:
+            self.examplesSuggested.emit(None, str(e))
+            return
+        self.examplesSuggested.emit(suggestions, "")
+
+    def onExamplesSuggested(self, suggestions, error):
+        self.pushButtonSuggestExamples.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, "Warning", "Suggest examples failed: {}".format(error))
+            return
+        if not suggestions:
+            QMessageBox.information(self, "Information", "No similar code is found, please update the project index first")
+            return
+
+        for suggestion in suggestions:
+            # reuse the first tab if it's empty, otherwise every suggestion gets a new tab
+            if len(self.example_tabs) > 1 or self.example_tabs[0].getExampleContent():
+                self.clickAddExampleTab()
+            desc = "{} lines {}-{}".format(suggestion['symbol'], suggestion['start_line'], suggestion['end_line'])
+            self.example_tabs[-1].loadExampleChunkDirectly(suggestion['file'], suggestion['start_line'], suggestion['end_line'],
+                                                           suggestion['content'], desc)
+        self.ui.tabWidgetExamples.setCurrentIndex(len(self.example_tabs) - 1)
+
     def onSelectedExampleFile(self):
         # enable new example button
         self.ui.pushButtonNewExample.setEnabled(True)
@@ -121,6 +180,7 @@ class GeneratorWithExampleDialog(QDialog):
 
         # create new tab
         self.prompt_tabs.append(prompt_tab.PromptTab(self))
+        self.prompt_tabs[0].connectContentChanged(self.onRequestContentChanged)
         self.ui.tabWidgetPrompt.addTab(self.prompt_tabs[0], "Prompt {}".format(len(self.prompt_tabs)))
 
         # check the height of group box, if height is less than 350, set it to 350
@@ -141,6 +201,7 @@ class GeneratorWithExampleDialog(QDialog):
             QMessageBox.warning(self, "Warning", "Please input the prompt content first")
             return
         self.prompt_tabs.append(prompt_tab.PromptTab(self))
+        self.prompt_tabs[-1].connectContentChanged(self.onRequestContentChanged)
         self.ui.tabWidgetPrompt.addTab(self.prompt_tabs[-1], "Prompt {}".format(len(self.prompt_tabs)))
         # change tab to the new tab
         self.ui.tabWidgetPrompt.setCurrentIndex(len(self.prompt_tabs) - 1)
@@ -154,6 +215,7 @@ class GeneratorWithExampleDialog(QDialog):
         tab_index = self.ui.tabWidgetPrompt.currentIndex()
         self.ui.tabWidgetPrompt.removeTab(tab_index)
         self.prompt_tabs.pop(tab_index)
+        self.onRequestContentChanged()
         # update tab index
         for i in range(len(self.prompt_tabs)):
             self.ui.tabWidgetPrompt.setTabText(i, "Prompt {}".format(i + 1))
@@ -174,12 +236,43 @@ class GeneratorWithExampleDialog(QDialog):
         self.ui.pushButtonSaveQueryInfo.clicked.connect(self.clickSaveInfo)
         # connect load info button
         self.ui.pushButtonLoadQueryInfo.clicked.connect(self.clickLoadInfo)
+        # compare several models with the same request
+        self.pushButtonCompareModels = QPushButton("Compare Models", self.ui.groupBoxOutPut)
+        self.ui.horizontalLayout_4.addWidget(self.pushButtonCompareModels)
+        self.pushButtonCompareModels.clicked.connect(self.clickCompareModels)
+        # cancel the request that is waiting or running in the scheduler
+        self.pushButtonCancelGenerate = QPushButton("Cancel", self.ui.groupBoxOutPut)
+        self.pushButtonCancelGenerate.setEnabled(False)
+        self.ui.horizontalLayout_4.insertWidget(self.ui.horizontalLayout_4.indexOf(self.ui.pushButtonGenerateResult) + 1, self.pushButtonCancelGenerate)
+        self.pushButtonCancelGenerate.clicked.connect(self.clickCancelGenerate)
+        # only send the most relevant examples, or parts of them, within the token budget
+        self.checkBoxPackExamples = QCheckBox("Pack Examples", self.ui.groupBoxOutPut)
+        self.checkBoxPackExamples.setToolTip("Send the most relevant examples within the token budget, the tab titles show what is sent")
+        self.ui.horizontalLayout_4.addWidget(self.checkBoxPackExamples)
+        self.checkBoxPackExamples.toggled.connect(lambda checked: self.onRequestContentChanged())
+        # generate several candidates and show the best one, a higher temperature makes them different
+        self.spinBoxCandidates = QSpinBox(self.ui.groupBoxOutPut)
+        self.spinBoxCandidates.setPrefix("Best of ")
+        self.spinBoxCandidates.setRange(1, 8)
+        self.spinBoxCandidates.setValue(self.system.call_settings("InterfaceGetBestOfCount"))
+        self.spinBoxCandidates.setToolTip("Generate several candidates, validate their code and show the best one first, "
+                                          "use a temperature like 0.7 to make them different")
+        self.ui.horizontalLayout_4.addWidget(self.spinBoxCandidates)
+        self.spinBoxCandidates.valueChanged.connect(lambda value: self.system.call_settings("InterfaceSetBestOfCount", value))
+        self.candidatesRanked.connect(self.onCandidatesRanked)
         # connect supply name combo box change
         self.ui.comboBoxSupplyName.currentIndexChanged.connect(self.changeSupplyName)
         # connect supply name combo box when user click it
         self.ui.comboBoxSupplyName.activated.connect(self.clickSupplyName)
         # connect model name combo box when user click it
         self.ui.comboBoxModel.activated.connect(self.clickModelComboBox)
+        # the price and the encoding depend on the model
+        self.ui.comboBoxModel.currentIndexChanged.connect(lambda index: self.onRequestContentChanged())
+
+        # the models are served from cache first, and updated when they are fetched in the background
+        self.modelsUpdated.connect(self.onModelsUpdated)
+        self.models_listener = lambda supply_name: self.modelsUpdated.emit(supply_name)
+        self.system.InterfaceAddModelsListener(self.models_listener)
 
         self.initModelComboBox()
 
@@ -191,24 +284,14 @@ class GeneratorWithExampleDialog(QDialog):
         # get model list from llm interface
         model_dict = self.system.InterfaceGetAllModels()
 
-        # # initialize the timer
-        self.timer = None
-
-        # # because we need to access web interface to get model list, so we need a asynchroneous function
+        # the models may be still fetching, onModelsUpdated will fill the combobox when they are ready
         if not model_dict:
-            # if we cannot get model list, we use a timer to check the model list
-            self.timer = QTimer(self)
-            self.timer.timeout.connect(self.initModelComboBox)
-            self.timer.start(1000)
             # invalid the combobox
             self.ui.comboBoxModel.setEnabled(False)
             return
         else:
             # enable the combobox
             self.ui.comboBoxModel.setEnabled(True)
-            if self.timer:
-                # stop the timer
-                self.timer.stop()
 
         # get model list
         supplys = list(model_dict.keys())
@@ -226,6 +309,25 @@ class GeneratorWithExampleDialog(QDialog):
 
         self.ui.comboBoxSupplyName.addItems(supplys)
     
+    def onModelsUpdated(self, supply_name):
+        # the combobox is empty, fill it
+        if self.ui.comboBoxSupplyName.count() == 0:
+            self.initModelComboBox()
+            return
+
+        # a new supply is ready
+        if self.ui.comboBoxSupplyName.findText(supply_name) == -1:
+            self.ui.comboBoxSupplyName.addItem(supply_name)
+            return
+
+        # the models of current supply are revalidated, refresh them and keep the selection
+        if supply_name == self.ui.comboBoxSupplyName.currentText():
+            current_model = self.ui.comboBoxModel.currentText()
+            self.changeSupplyName(self.ui.comboBoxSupplyName.currentIndex())
+            model_index = self.ui.comboBoxModel.findText(current_model)
+            if model_index != -1:
+                self.ui.comboBoxModel.setCurrentIndex(model_index)
+
     def clickModelComboBox(self):
         # if there is no model's name in models combo box, request the model's name from llm interface
         if self.ui.comboBoxModel.count() > 0:
@@ -449,13 +551,7 @@ class GeneratorWithExampleDialog(QDialog):
         # set the prompt tab data
         last_prompt_tab.setPromptResponse(result_info)
 
-    def clickGenerateResult(self):
-        # get parameters
-        # get model
-        model = self.ui.comboBoxModel.currentText()
-        # get temperature
-        temperature = self.ui.doubleSpinBoxTemperature.value()
-
+    def _collectChatRequest(self):
         # get examples's content
         examples = []
         # if there is only 1 example tab, and the content is empty, then we don't need to send request
@@ -480,10 +576,78 @@ class GeneratorWithExampleDialog(QDialog):
             }
             prompts.append(element)
 
+        return examples, prompts
+
+    def collectPrompts(self):
+        # the example tabs choose the symbols of a long file by the prompts
+        _, prompts = self._collectChatRequest()
+        return prompts
+
+    def _collectPackedRequest(self, supply_name, model):
+        # the examples that are really sent, they are packed into the token budget if it's checked
+        examples, prompts = self._collectChatRequest()
+        report = None
+        if self.checkBoxPackExamples.isChecked() and examples:
+            examples, report = self.system.InterfacePackExamples(supply_name, model, examples, prompts)
+        self.showPackedExamples(report)
+        return examples, prompts
+
+    def showPackedExamples(self, report):
+        # show what is sent of every example in its tab title
+        for i in range(len(self.example_tabs)):
+            title = "Example {}".format(i + 1)
+            if report and i < len(report):
+                if not report[i]['included']:
+                    title += " (skipped)"
+                elif report[i]['fraction'] < 1.0:
+                    title += " ({:.0%})".format(report[i]['fraction'])
+            self.ui.tabWidgetExamples.setTabText(i, title)
+
+    def _collectEstimateRequest(self):
+        # only the tabs are read in the gui thread, the token meter packs the examples in its worker thread
+        supply_name = self.ui.comboBoxSupplyName.currentText()
+        model = self.ui.comboBoxModel.currentText()
+        examples, prompts = self._collectChatRequest()
+        return supply_name, model, examples, prompts, self.checkBoxPackExamples.isChecked()
+
+    def onRequestContentChanged(self):
+        # the tabs are not ready when the dialog is initializing
+        if not self.example_tabs or not self.prompt_tabs:
+            return
+        self.token_meter.request(self._collectEstimateRequest)
+
+    def onTokenEstimated(self, generation, estimate_token, prompt_cost, complete_cost, report):
+        # the content is changed again, a newer estimation is coming
+        if not self.token_meter.isLatest(generation):
+            return
+        self.showPackedExamples(report)
+        self.ui.lineEditEstimateCost.setText("$" + str(prompt_cost + complete_cost))
+        self.ui.lineEditTokenAmount.setText(str(estimate_token))
+
+    def clickGenerateResult(self):
+        # get parameters
+        # get model
+        model = self.ui.comboBoxModel.currentText()
+        # get temperature
+        temperature = self.ui.doubleSpinBoxTemperature.value()
+
         supply_name = self.ui.comboBoxSupplyName.currentText()
+        examples, prompts = self._collectPackedRequest(supply_name, model)
+
         estimate_token, prompt_cost, complete_cost = self.system.call_llm(supply_name, "InterfaceGetEstimateCost", model=model, examples=examples, prompts=prompts)
         # use confirm message box to confirm the cost
         confirm_message = "This request will cost {} tokens, prompt cost is ${}, estimate of complete cost base on the token amount of prompt is ${}, continue?".format(estimate_token, prompt_cost, complete_cost)
+        # the old turns of a long chat are dropped to fit the context window of the model
+        context_report = self.system.call_llm(supply_name, "InterfaceGetContextReport", model=model, examples=examples, prompts=prompts)
+        if context_report and context_report['saved'] > 0:
+            confirm_message = "{} tokens of the old conversation are dropped or truncated to fit the context window. ".format(context_report['saved']) + confirm_message
+        if context_report and context_report.get('overflow', 0) > 0:
+            QMessageBox.warning(self, "Warning", "The examples and the prompt are {} tokens over the context budget {}, remove some examples or shorten the prompt.".format(
+                context_report['overflow'], context_report['budget']))
+            return
+        count = self.spinBoxCandidates.value()
+        if count > 1:
+            confirm_message = "{} candidates are generated, the cost is up to {} times of one request. ".format(count, count) + confirm_message
         reply = QMessageBox.question(self, "Confirm", confirm_message, QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.No:
             return
@@ -494,20 +658,45 @@ class GeneratorWithExampleDialog(QDialog):
         # init generate result environment
         self.initGenerateResult()
 
-        # we need a lambda function to call onGenerateResultAppend
+        if count > 1:
+            # the candidates are shown when all of them are validated and ranked
+            self.result_sink.stop()
+            self.result_callback = None
+            self.prompt_tabs[-1].showGeneratingCandidates(count)
+            complete_callback = lambda candidates: self.candidatesRanked.emit(candidates)
+            self.current_request = self.system.call_llm_best_of(supply_name, model, examples, prompts, temperature, count,
+                                                                complete_callback=complete_callback)
+            self.pushButtonCancelGenerate.setEnabled(True)
+            return
+
+        # the callback is called in the worker thread, the reply is shown by the sink in the gui thread
         callback = lambda result, reason = None: self.onGenerateResultAppend(result, reason)
 
-        current_request = {
-            "examples": examples,
-            "prompts": prompts,
-        }
-        new_chat = self.isNewChat(self.last_chat_request, current_request)
+        # the request continues a former conversation if its history is the same as the session
+        session = self.system.InterfaceMatchSession(examples, prompts)
 
-        # send request to llm interface
-        self.system.call_llm(supply_name, "InterfaceChatRequest", model=model, temperature=temperature,
-                             examples=examples, prompts=prompts, new_chat=new_chat, callback=callback)
+        # send request to llm interface, it's queued in the scheduler
+        self.current_request = self.system.call_llm(supply_name, "InterfaceChatRequest", model=model, temperature=temperature,
+                                                    examples=examples, prompts=prompts, new_chat=session.new_chat,
+                                                    session=session, callback=callback)
+        if self.current_request is not None:
+            self.pushButtonCancelGenerate.setEnabled(True)
 
-        self.last_chat_request = current_request
+    def clickCompareModels(self):
+        from dialog import compare_models_dialog
+
+        if self.compare_models_dialog is None:
+            collect_request = lambda: self._collectChatRequest() + (self.ui.doubleSpinBoxTemperature.value(),)
+            self.compare_models_dialog = compare_models_dialog.CompareModelsDialog(self, collect_request)
+        else:
+            self.compare_models_dialog.initModelList()
+        self.compare_models_dialog.show()
+
+    def clickCancelGenerate(self):
+        if self.current_request is None:
+            return
+        self.current_request.cancel()
+        self.pushButtonCancelGenerate.setEnabled(False)
 
     def onGenerateResult(self, result):
         # find the last prompt tab
@@ -516,33 +705,24 @@ class GeneratorWithExampleDialog(QDialog):
         last_prompt_tab.setPromptResponse(result)
 
     def onGenerateResultAppend(self, result, reason):
-        # if result is empty, we call onGenerateResultCompleted
-        if not result:
-            self.result_update_mutex.acquire()
-            self.result_completed = True
-            self.result_update_mutex.release()
-            return
+        # runs in the worker thread, never touch the widgets here
+        if self.result_callback is not None:
+            self.result_callback(result, reason)
 
-        self.result_update_mutex.acquire()
-        if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
-            self.result_content = []
-            # find the last prompt tab
-            last_prompt_tab = self.prompt_tabs[-1]
-            last_prompt_tab.clearPromptResponse()
+    def onCandidatesRanked(self, candidates):
+        self.prompt_tabs[-1].setCandidates(candidates)
+        self.onGenerateResultCompleted(validate=False)
 
-        # to avoid the race condition, we use a timer to update the result
-        self.result_content.append(result)
-        self.result_update_mutex.release()
-
-    def onGenerateResultCompleted(self):
+    def onGenerateResultCompleted(self, validate=True):
         # enable generate button
         self.ui.pushButtonGenerateResult.setEnabled(True)
         self.ui.pushButtonDeletePrompt.setEnabled(True)
         self.ui.pushButtonClearPrompt.setEnabled(True)
         self.ui.pushButtonNewPrompt.setEnabled(True)
-        self.result_update_timer.stop()
-        self.result_update_timer.deleteLater()
-        self.result_content = []
+        self.pushButtonCancelGenerate.setEnabled(False)
+        self.current_request = None
+        self.result_callback = None
+        self.prompt_tabs[-1].finishGenerateResult(validate)
 
     def appendResult(self, result):
         # find the last prompt tab
@@ -550,6 +730,10 @@ class GeneratorWithExampleDialog(QDialog):
         # show result in prompt tab's response
         last_prompt_tab.appendPromptResponse(result)
 
+    def clearResult(self):
+        # the reply is replaced by a new one
+        self.prompt_tabs[-1].clearPromptResponse()
+
     def initGenerateResult(self):
         # find the last prompt tab
         last_prompt_tab = self.prompt_tabs[-1]
@@ -559,73 +743,9 @@ class GeneratorWithExampleDialog(QDialog):
         self.ui.pushButtonDeletePrompt.setEnabled(False)
         self.ui.pushButtonClearPrompt.setEnabled(False)
         self.ui.pushButtonNewPrompt.setEnabled(False)
-        self.result_content = []
-        self.result_completed = False
-        self.result_update_mutex = threading.Lock()
-        self.result_update_timer = QTimer(self)
-        self.result_update_timer.timeout.connect(self.onUpdateResultTimeout)
-        self.result_update_timer.start(100)
-
-    def onUpdateResultTimeout(self):
-        # if result content is not empty, output to result text edit
-        self.result_update_mutex.acquire()
-        result_content = []
-        if self.result_content:
-            result_content = copy.deepcopy(self.result_content)
-            self.result_content = []
-        self.result_update_mutex.release()
-
-        for content in result_content:
-            self.appendResult(content)
-        if self.result_completed:
-            self.result_update_mutex.acquire()
-            for content in self.result_content:
-                self.appendResult(content)
-            self.onGenerateResultCompleted()
-            self.result_update_mutex.release()
+        self.result_callback = self.result_sink.start()
 
     def loadExampleFileDirectly(self, file_path):
         # get example tab
         example_tab = self.example_tabs[-1]
-        example_tab.loadExampleFileDirectly(file_path)
-
-    def isNewChat(self, last_chat_request, current_chat_request):
-
-        # if the last chat request is empty, then it is not continouse chat
-        if not last_chat_request:
-            return True
-
-        # if the current chat request is empty, then it is not continouse chat
-        if not current_chat_request:
-            return True
-
-        # if the last chat request and current chat request are not the same, then it is not continouse chat
-        if len(last_chat_request["examples"]) != len(current_chat_request["examples"]):
-            return True
-
-        # compare the last chat request and current chat request
-        for index in range(len(last_chat_request["examples"])):
-            example = last_chat_request["examples"][index]
-            example2 = current_chat_request["examples"][index]
-
-            if example['desc'] != example2['desc']:
-                return True
-            if example['content'] != example2['content']:
-                return True
-            if example['response'] != example2['response']:
-                return True
-
-        if len(last_chat_request["prompts"]) + 1 != len(current_chat_request["prompts"]):
-            return True
-
-        for index in range(len(last_chat_request["prompts"])):
-            prompt = last_chat_request["prompts"][index]
-            prompt2 = current_chat_request["prompts"][index]
-
-            if prompt['system'] != prompt2['system']:
-                return True
-            if prompt['content'] != prompt2['content']:
-                return True
-
-        # if the last chat request and current chat request are the same, then it is continouse chat
-        return False
\ No newline at end of file
+        example_tab.loadExampleFileDirectly(file_path)
\ No newline at end of file
@@ -20,6 +20,9 @@ class ProductiveAIGCToolWindows(QMainWindow):
         self.ui.setupUi(self)
         self.setting_panel = None
         self.gen_code_panel = None
+        self.embedding_panel = None
+        self.cost_history_panel = None
+        self.cost_statistics_panel = None
         self.system = system_manager
         self.result_path = ""
         self.project_path = ""
@@ -120,14 +123,15 @@ class ProductiveAIGCToolWindows(QMainWindow):
         
     def clickEmbeddings(self):
         '''
-        clickEmbeddings will show a dialog to set the parameters of AIGC
+        clickEmbeddings will show a dialog to build the embedding index of the project
         '''
-        # import dialog.embedding_dialog
+        import dialog.embedding_dialog
 
-        # if self.setting_panel is None:
-        #     self.setting_panel = dialog.embedding_dialog.EmbeddingDialog(self)
-        # self.setting_panel.show()
-        pass
+        if self.embedding_panel is None:
+            self.embedding_panel = dialog.embedding_dialog.EmbeddingDialog(self)
+        else:
+            self.embedding_panel.initStatistics()
+        self.embedding_panel.show()
 
     def initResultDirectoryView(self):
         result_path = self.system.call_settings("InterfaceGetResultJsonDir")
@@ -242,7 +246,25 @@ class ProductiveAIGCToolWindows(QMainWindow):
         self.gen_code_panel.show()
 
     def clickCostHistory(self):
-        pass
+        '''
+        clickCostHistory will show the usage and cost of every chat request
+        '''
+        import dialog.cost_dialog
+
+        if self.cost_history_panel is None:
+            self.cost_history_panel = dialog.cost_dialog.CostHistoryDialog(self)
+        else:
+            self.cost_history_panel.refresh()
+        self.cost_history_panel.show()
 
     def clickCostStatistics(self):
-        pass
\ No newline at end of file
+        '''
+        clickCostStatistics will show the total cost of every model and every day
+        '''
+        import dialog.cost_dialog
+
+        if self.cost_statistics_panel is None:
+            self.cost_statistics_panel = dialog.cost_dialog.CostStatisticsDialog(self)
+        else:
+            self.cost_statistics_panel.refresh()
+        self.cost_statistics_panel.show()
\ No newline at end of file
@@ -2,17 +2,39 @@
 # author: CasinoHe
 # Purpose: the dialog of prompt tab
 
-from PySide6.QtWidgets import QWidget, QFileDialog, QMessageBox, QApplication
+from PySide6.QtWidgets import QWidget, QFileDialog, QMessageBox, QApplication, QPushButton, QMenu, QLabel, QTextEdit
+from PySide6.QtCore import Signal
 from PySide6 import QtGui
+import threading
 from ui import prompt_tab_ui
+from dialog import response_buffer
+from dialog import code_highlighter
+from system import code_fence
 
 class PromptTab(QWidget):
+    # emitted from the thread that validates the code blocks, (generation, code blocks, validation results)
+    validationFinished = Signal(int, object, object)
+
     def __init__(self, parent):
         super().__init__(parent)
 
         # init ui
         self.ui = prompt_tab_ui.Ui_Form()
         self.ui.setupUi(self)
+        # the cursor that appends the streamed response
+        self.response_cursor = None
+        # the response is kept once in the buffer, the text edit only shows it
+        self.response_buffer = response_buffer.ResponseBuffer(self.ui.plainTextEditResponse.toPlainText)
+        # True while the buffer changes the text edit, the other changes are made by the user
+        self.updating_response = False
+        # the code blocks of the streamed response are found while it's streamed,
+        # they are parsed again from the whole response after it's set or edited
+        self.code_parser = code_fence.CodeFenceParser()
+        self.code_blocks_stale = False
+        # the results of a former response are dropped
+        self.validation_generation = 0
+        # the ranked candidates of a best of n request, the shown one is the response
+        self.candidates = []
 
         self.initUI()
 
@@ -29,6 +51,31 @@ class PromptTab(QWidget):
         self.ui.pushButtonCopyResult.clicked.connect(self.clickCopyResult)
         # connect save file button
         self.ui.pushButtonSaveToFile.clicked.connect(self.clickSaveResultToFile)
+        # the buffer reads the text edit again only after the user edits it
+        self.ui.plainTextEditResponse.document().contentsChange.connect(self.onResponseContentsChange)
+        self.code_highlighter = code_highlighter.CodeHighlighter(self.ui.plainTextEditResponse.document())
+
+        # copy a code block of the response without the markdown around it
+        self.pushButtonCopyCode = QPushButton("Copy Code", self.ui.groupBoxResponse)
+        self.menuCodeBlocks = QMenu(self.pushButtonCopyCode)
+        self.menuCodeBlocks.aboutToShow.connect(self.initCodeBlockMenu)
+        self.pushButtonCopyCode.setMenu(self.menuCodeBlocks)
+        self.ui.horizontalLayout_6.insertWidget(self.ui.horizontalLayout_6.indexOf(self.ui.pushButtonCopyResult) + 1, self.pushButtonCopyCode)
+
+        # the code blocks are validated when the response is completed, the failed lines are marked in the response
+        self.labelValidation = QLabel(self.ui.groupBoxResponse)
+        self.labelValidation.setWordWrap(True)
+        self.labelValidation.hide()
+        self.ui.verticalLayout_3.insertWidget(self.ui.verticalLayout_3.indexOf(self.ui.plainTextEditResponse) + 1, self.labelValidation)
+        self.validationFinished.connect(self.onValidationFinished)
+
+        # switch to another candidate of a best of n request, the best one is shown first
+        self.pushButtonCandidates = QPushButton("Candidates", self.ui.groupBoxResponse)
+        self.menuCandidates = QMenu(self.pushButtonCandidates)
+        self.menuCandidates.aboutToShow.connect(self.initCandidateMenu)
+        self.pushButtonCandidates.setMenu(self.menuCandidates)
+        self.pushButtonCandidates.hide()
+        self.ui.horizontalLayout_6.insertWidget(self.ui.horizontalLayout_6.indexOf(self.pushButtonCopyCode) + 1, self.pushButtonCandidates)
 
     def clickSavePrompt(self):
         result_dir = self.system.call_settings("InterfaceGetResultJsonDir")
@@ -42,7 +89,7 @@ class PromptTab(QWidget):
         # get prompt content
         prompt = self.ui.plainTextEditPrompt.toPlainText()
         context = self.ui.lineEditPromptSystem.text()
-        response = self.ui.plainTextEditResponse.toPlainText()
+        response = self.response_buffer.get_text()
 
         # save prompt to file
         result = self.system.call_database("InterfaceSavePrompt", prompt, context, response, prompt_file)
@@ -62,13 +109,19 @@ class PromptTab(QWidget):
             prompt, system, response = self.system.call_database("InterfaceLoadPrompt", prompt_file)
             self.ui.plainTextEditPrompt.setPlainText(prompt)
             self.ui.lineEditPromptSystem.setText(system)
-            self.ui.plainTextEditResponse.setPlainText(response)
+            self.setPromptResponse(response)
 
     def clear(self):
         self.ui.lineEditPromptFilePath.clear()
         self.ui.plainTextEditPrompt.clear()
         self.ui.lineEditPromptSystem.clear()
-        self.ui.plainTextEditResponse.clear()
+        self.clearPromptResponse()
+
+    def connectContentChanged(self, callback):
+        # callback is called when any text that is sent to the llm is changed
+        self.ui.plainTextEditPrompt.textChanged.connect(callback)
+        self.ui.lineEditPromptSystem.textChanged.connect(lambda text: callback())
+        self.ui.plainTextEditResponse.textChanged.connect(callback)
 
     def getPromptFile(self):
         return self.ui.lineEditPromptFilePath.text()
@@ -80,7 +133,8 @@ class PromptTab(QWidget):
         return self.ui.lineEditPromptSystem.text()
     
     def getPromptResponse(self):
-        return self.ui.plainTextEditResponse.toPlainText()
+        # the text is joined once until the response is changed, it's not copied from the document
+        return self.response_buffer.get_text()
 
     def setPromptContent(self, content):
         self.ui.plainTextEditPrompt.setPlainText(content)
@@ -89,16 +143,77 @@ class PromptTab(QWidget):
         self.ui.lineEditPromptSystem.setText(system)
 
     def setPromptResponse(self, response):
+        self.updating_response = True
         self.ui.plainTextEditResponse.setPlainText(response)
+        self.updating_response = False
+        self.response_buffer.set_text(response)
+        self.markCodeBlocksStale()
     
     def clearPromptResponse(self):
+        self.updating_response = True
         self.ui.plainTextEditResponse.clear()
+        self.updating_response = False
+        self.response_buffer.clear()
+        self.code_parser.reset()
+        self.code_blocks_stale = False
+        self.updateCodeBlockButton()
+        self.clearValidation()
+
+    def onResponseContentsChange(self, position, chars_removed, chars_added):
+        if not self.updating_response:
+            self.response_buffer.invalidate()
+            self.markCodeBlocksStale()
+
+    def markCodeBlocksStale(self):
+        self.code_blocks_stale = True
+        self.pushButtonCopyCode.setText("Copy Code")
+        # the lines of the results are out of date
+        self.clearValidation()
+
+    def getCodeBlocks(self):
+        if self.code_blocks_stale:
+            self.code_parser.reset()
+            self.code_parser.feed(self.response_buffer.get_text())
+            self.code_parser.finish()
+            self.code_blocks_stale = False
+        return self.code_parser.blocks
+
+    def updateCodeBlockButton(self):
+        count = len(self.code_parser.blocks)
+        self.pushButtonCopyCode.setText("Copy Code ({})".format(count) if count else "Copy Code")
+
+    def initCodeBlockMenu(self):
+        self.menuCodeBlocks.clear()
+        blocks = self.getCodeBlocks()
+        self.updateCodeBlockButton()
+        if not blocks:
+            self.menuCodeBlocks.addAction("No code block").setEnabled(False)
+            return
+        for block in blocks:
+            action = self.menuCodeBlocks.addAction(block.get_title())
+            action.triggered.connect(lambda checked=False, code=block.code: self.copyCode(code))
+        self.menuCodeBlocks.addSeparator()
+        self.menuCodeBlocks.addAction("Validate Code").triggered.connect(self.validateCodeBlocks)
+
+    def copyCode(self, code):
+        QApplication.clipboard().setText(code)
 
     def appendPromptResponse(self, response):
-        # append result in plainTextEditResult without newline
-        text_cursor = QtGui.QTextCursor(self.ui.plainTextEditResponse.document())
-        text_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
-        text_cursor.insertText(response)
+        # the buffer reads back the text the user edited before the piece is inserted, otherwise the piece is doubled
+        self.response_buffer.append(response)
+        # append result in plainTextEditResult without newline, the cursor is reused by the pieces of a stream
+        if self.response_cursor is None:
+            self.response_cursor = QtGui.QTextCursor(self.ui.plainTextEditResponse.document())
+        self.response_cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        self.updating_response = True
+        # one edit block is one layout update
+        self.response_cursor.beginEditBlock()
+        self.response_cursor.insertText(response)
+        self.response_cursor.endEditBlock()
+        self.updating_response = False
+        # a code block can be copied as soon as its closing fence arrives
+        if not self.code_blocks_stale and self.code_parser.feed(response):
+            self.updateCodeBlockButton()
 
     def setPromptFile(self, filepath):
         self.ui.lineEditPromptFilePath.setText(filepath)
@@ -107,20 +222,20 @@ class PromptTab(QWidget):
         self.ui.plainTextEditResponse.setFocus()
 
     def isEmpty(self):
-        if self.ui.plainTextEditPrompt.toPlainText() == "" or self.ui.plainTextEditResponse.toPlainText() == "":
+        if self.ui.plainTextEditPrompt.document().isEmpty() or self.response_buffer.is_empty():
             return True
         else:
             return False
 
     def isPromptEmpty(self):
-        if self.ui.plainTextEditPrompt.toPlainText() == "":
+        if self.ui.plainTextEditPrompt.document().isEmpty():
             return True
         else:
             return False
 
     def clickCopyResult(self):
         # copy the text in plainTextEditResult to clipboard
-        text = self.ui.plainTextEditResponse.toPlainText()
+        text = self.response_buffer.get_text()
         if text:
             # call system clipboard
             clipboard = QApplication.clipboard()
@@ -131,12 +246,134 @@ class PromptTab(QWidget):
             QMessageBox.warning(self, "Copy Result", "No result to copy!")
 
     def initGenerateResult(self):
-        self.ui.plainTextEditResponse.clear()
+        self.clearPromptResponse()
+        self.clearCandidates()
+        # a long stream would fill the undo stack with its pieces
+        self.ui.plainTextEditResponse.setUndoRedoEnabled(False)
+
+    def finishGenerateResult(self, validate=True):
+        self.ui.plainTextEditResponse.setUndoRedoEnabled(True)
+        # the last block may not be closed
+        if not self.code_blocks_stale and self.code_parser.finish():
+            self.updateCodeBlockButton()
+        # the candidates of a best of n request are validated already
+        enabled = self.system.call_settings("InterfaceGetValidationOptions")[0]
+        if validate and enabled:
+            self.validateCodeBlocks()
+
+    def validateCodeBlocks(self):
+        blocks = list(self.getCodeBlocks())
+        if not blocks:
+            return
+        self.clearValidation()
+        self.labelValidation.setText("Validating {} code blocks...".format(len(blocks)))
+        self.labelValidation.show()
+        # the checks run in the process pool of the system, the thread only waits for them
+        thread = threading.Thread(target=self.validate, args=(self.validation_generation, blocks), daemon=True)
+        thread.start()
+
+    def validate(self, generation, blocks):
+        # runs in the worker thread
+        try:
+            results = self.system.InterfaceValidateCode([(block.language, block.code) for block in blocks])
+        except Exception as e:
+            print("validate code blocks failed: {}".format(e))
+            results = None
+        self.validationFinished.emit(generation, blocks, results)
+
+    def onValidationFinished(self, generation, blocks, results):
+        if generation != self.validation_generation:
+            return
+        if results is None:
+            self.labelValidation.setText("Validation failed")
+            return
+        self.showValidation(blocks, results)
+
+    def showValidation(self, blocks, results, title=''):
+        lines = [title] if title else []
+        tooltips = []
+        selections = []
+        document = self.ui.plainTextEditResponse.document()
+        failed_format = QtGui.QTextCharFormat()
+        failed_format.setBackground(QtGui.QColor('#ffd0d0'))
+        failed_format.setProperty(QtGui.QTextFormat.FullWidthSelection, True)
+        for block in blocks:
+            block_results = [result for result in results if result.block_index == block.index]
+            failed = [result for result in block_results if not result.is_passed()]
+            stages = ", ".join("{} {}".format(result.stage, result.status) for result in block_results)
+            lines.append("{} {}: {}".format("\u2716" if failed else "\u2714", block.get_title(), stages))
+            for result in failed:
+                tooltips.append("{} {}:\n{}".format(block.get_title(), result.stage, result.message))
+                if result.line is None or not 0 < result.line < block.end_line - block.start_line:
+                    continue
+                # the code of the block starts at the line after the opening fence
+                text_block = document.findBlockByNumber(block.start_line + result.line)
+                if not text_block.isValid():
+                    continue
+                selection = QTextEdit.ExtraSelection()
+                selection.format = failed_format
+                selection.cursor = QtGui.QTextCursor(text_block)
+                selections.append(selection)
+        self.labelValidation.setText("\n".join(lines))
+        self.labelValidation.setToolTip("\n\n".join(tooltips))
+        self.labelValidation.show()
+        self.ui.plainTextEditResponse.setExtraSelections(selections)
+
+    def showGeneratingCandidates(self, count):
+        self.labelValidation.setText("Generating {} candidates, the best one is shown when they are validated...".format(count))
+        self.labelValidation.show()
+
+    def setCandidates(self, candidates):
+        '''
+        show the ranked candidates of a best of n request, the best one is the response
+        '''
+        self.candidates = candidates
+        self.pushButtonCandidates.setText("Candidates ({})".format(len(candidates)))
+        self.pushButtonCandidates.setVisible(len(candidates) > 1)
+        if candidates:
+            self.showCandidate(0)
+
+    def showCandidate(self, rank):
+        candidate = self.candidates[rank]
+        self.setPromptResponse(candidate['text'] or candidate['error'])
+        # the blocks are parsed from the same text, the code parser doesn't parse them again
+        self.code_parser.reset()
+        self.code_parser.blocks = list(candidate['blocks'])
+        self.code_blocks_stale = False
+        self.updateCodeBlockButton()
+        title = "Candidate {} of {}, rank {}".format(candidate['index'] + 1, len(self.candidates), rank + 1)
+        if candidate['error']:
+            title += ", failed: {}".format(candidate['error'])
+        self.showValidation(candidate['blocks'], candidate['results'], title)
+
+    def initCandidateMenu(self):
+        self.menuCandidates.clear()
+        for rank, candidate in enumerate(self.candidates):
+            if candidate['error']:
+                summary = "failed"
+            elif candidate['blocks']:
+                summary = "{} of {} checks failed".format(candidate['failed'], len(candidate['results'])) if candidate['failed'] else "passed"
+            else:
+                summary = "no code"
+            text = "{}. Candidate {}: {}, {} chars".format(rank + 1, candidate['index'] + 1, summary, len(candidate['text']))
+            if candidate['score']:
+                text += ", score {:.2f}".format(candidate['score'])
+            self.menuCandidates.addAction(text).triggered.connect(lambda checked=False, rank=rank: self.showCandidate(rank))
+
+    def clearCandidates(self):
+        self.candidates = []
+        self.pushButtonCandidates.hide()
+
+    def clearValidation(self):
+        self.validation_generation += 1
+        self.labelValidation.clear()
+        self.labelValidation.setToolTip("")
+        self.labelValidation.hide()
+        self.ui.plainTextEditResponse.setExtraSelections([])
 
     def clickSaveResultToFile(self):
         # get result content
-        result = self.ui.plainTextEditResponse.toPlainText()
-        if not result:
+        if self.response_buffer.is_empty():
             QMessageBox.warning(self, "Warning", "No result to save")
             return
 
@@ -150,7 +387,8 @@ class PromptTab(QWidget):
 
         # save result to file
         with open(result_file, "w", encoding="utf-8") as f:
-            if f.write(result) <= 0:
+            # the chunks are written one by one, the whole response is not joined
+            if self.response_buffer.write_to(f) <= 0:
                 QMessageBox.warning(self, "Warning", "Save result file failed")
             else:
                 QMessageBox.information(
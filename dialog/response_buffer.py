@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: keep the text of a response once, outside the text edit
+#   the streamed pieces are kept in a chunk list, they are joined only when the whole text is needed,
+#   and the joined text is kept until the response is changed, so packing, saving and matching the session
+#   never copy the document of the text edit again
+
+
+class ResponseBuffer(object):
+    '''
+    ResponseBuffer is the model of a response, the text edit only shows it
+    read_text() reads the text from the text edit, it's called only after the user edits the response
+    '''
+
+    def __init__(self, read_text):
+        super().__init__()
+        self.read_text = read_text
+        self.chunks = []
+        self.length = 0
+        # the joined text, None if the chunks are changed after the join
+        self.text = ''
+        # the user edited the text edit, the chunks are out of date
+        self.edited = False
+
+    def append(self, text):
+        if self.edited:
+            self.sync()
+        self.chunks.append(text)
+        self.length += len(text)
+        self.text = None
+
+    def set_text(self, text):
+        self.chunks = [text] if text else []
+        self.length = len(text)
+        self.text = text
+        self.edited = False
+
+    def clear(self):
+        self.set_text('')
+
+    def invalidate(self):
+        # called when the user edits the response, the text is read again when it's needed
+        self.edited = True
+        self.text = None
+
+    def sync(self):
+        self.set_text(self.read_text())
+
+    def get_text(self):
+        '''
+        return the whole response, it's joined once until the response is changed
+        '''
+        if self.edited:
+            self.sync()
+        if self.text is None:
+            self.text = ''.join(self.chunks)
+            # keep one chunk, the next join only joins the new pieces
+            self.chunks = [self.text] if self.text else []
+        return self.text
+
+    def get_length(self):
+        if self.edited:
+            self.sync()
+        return self.length
+
+    def is_empty(self):
+        return self.get_length() == 0
+
+    def write_to(self, file):
+        '''
+        write the response to the opened file chunk by chunk, return the characters written
+        '''
+        if self.edited:
+            self.sync()
+        for chunk in self.chunks:
+            file.write(chunk)
+        return self.length
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: move the streamed reply from the worker thread to the gui thread
+#   the worker thread only appends the pieces to a deque and wakes the gui thread once,
+#   the gui thread drains all the pending pieces and applies them as one edit of the document,
+#   the flush interval adapts to how long an edit takes, so a long reply never blocks the gui
+
+import collections
+import time
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from system.llm import llm_interface
+
+
+class StreamSink(QObject):
+    '''
+    StreamSink collects the reply pieces of a request from any thread, and shows them in the gui thread
+    append(text) adds text to the end of the reply, reset() clears the reply, completed() is called at the end,
+    they are all called in the gui thread
+    '''
+    # emitted from the worker thread when the first piece is pending, the slot runs in the gui thread
+    piecesArrived = Signal()
+
+    # a flush waits one frame at least, and 200 ms at most when the document is huge
+    MIN_INTERVAL_MS = 16
+    MAX_INTERVAL_MS = 200
+    # the edits take at most 1 / LOAD_FACTOR of the time of the gui thread
+    LOAD_FACTOR = 4
+
+    def __init__(self, append, reset, completed, parent):
+        super().__init__(parent)
+        self.append = append
+        self.reset = reset
+        self.completed = completed
+
+        # deque.append and deque.popleft are atomic, the worker thread never waits for the gui thread
+        self.pieces = collections.deque()
+        self.scheduled = False
+        # the pieces of a former request are dropped
+        self.generation = 0
+        self.interval = self.MIN_INTERVAL_MS
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+        self.piecesArrived.connect(self.onPiecesArrived)
+
+    def start(self):
+        '''
+        start a new reply, return the callback(text, reason=None) of the request, it can be called in any thread
+        '''
+        self.generation += 1
+        self.pieces.clear()
+        self.scheduled = False
+        self.interval = self.MIN_INTERVAL_MS
+        generation = self.generation
+        return lambda text, reason=None: self.push(generation, text, reason)
+
+    def push(self, generation, text, reason=None):
+        # runs in the worker thread
+        self.pieces.append((generation, text, reason))
+        if not self.scheduled:
+            self.scheduled = True
+            self.piecesArrived.emit()
+
+    def onPiecesArrived(self):
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.interval)
+
+    def flush(self):
+        # the pieces pushed after this line wake the gui thread again
+        self.scheduled = False
+        begin = time.perf_counter()
+
+        texts = []
+        is_completed = False
+        while self.pieces:
+            generation, text, reason = self.pieces.popleft()
+            if generation != self.generation:
+                continue
+            # empty text means the request is completed
+            if not text:
+                is_completed = True
+                continue
+            if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                # the reply is replaced, the pending text before it is never shown
+                texts = []
+                self.reset()
+            texts.append(text)
+
+        if texts:
+            self.append(''.join(texts))
+
+        # a slow edit means a big document, update it less often
+        elapsed_ms = (time.perf_counter() - begin) * 1000
+        self.interval = int(min(self.MAX_INTERVAL_MS, max(self.MIN_INTERVAL_MS, elapsed_ms * self.LOAD_FACTOR)))
+
+        if is_completed:
+            self.generation += 1
+            self.completed()
+
+    def stop(self):
+        # the pending pieces are dropped
+        self.generation += 1
+        self.pieces.clear()
+        self.flush_timer.stop()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: choose the classes and functions of an example file that are sent
+
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QCheckBox,
+                               QTreeWidget, QTreeWidgetItem, QDialogButtonBox)
+from PySide6.QtCore import Qt
+from system.llm import token_counter
+from system.llm import example_slicer
+
+
+class SymbolDialog(QDialog):
+    '''
+    SymbolDialog lists the symbols of an example file with their tokens, the checked symbols are sent as a whole
+    '''
+    HEADER_LABELS = ["Symbol", "Kind", "Lines", "Tokens"]
+
+    def __init__(self, system, content, analysis, selected_symbols, keep_signatures, prompts, parent):
+        super().__init__(parent)
+        self.system = system
+        self.content = content
+        self.analysis = analysis
+        self.prompts = prompts
+        # name -> tree item
+        self.items = {}
+        # the whole file is sent if nothing is chosen yet
+        if selected_symbols is None:
+            selected_symbols = set(symbol['name'] for symbol in analysis['symbols'])
+
+        self.setWindowTitle("Example Symbols")
+        self.resize(700, 500)
+        self.initUI(selected_symbols, keep_signatures)
+        self.updateTokens()
+
+    def initUI(self, selected_symbols, keep_signatures):
+        layout = QVBoxLayout(self)
+
+        self.treeWidgetSymbols = QTreeWidget(self)
+        self.treeWidgetSymbols.setHeaderLabels(self.HEADER_LABELS)
+        parents = {}
+        for symbol in self.analysis['symbols']:
+            parent = parents.get(symbol['parent'], self.treeWidgetSymbols)
+            item = QTreeWidgetItem(parent, [symbol['name'], symbol['kind'],
+                                            "{}-{}".format(symbol['start_line'], symbol['end_line']), str(symbol['tokens'])])
+            item.setCheckState(0, Qt.Checked if symbol['name'] in selected_symbols else Qt.Unchecked)
+            self.items[symbol['name']] = item
+            if symbol['kind'] == 'class':
+                parents[symbol['name']] = item
+        self.treeWidgetSymbols.expandAll()
+        self.treeWidgetSymbols.resizeColumnToContents(0)
+        self.treeWidgetSymbols.itemChanged.connect(lambda item, column: self.updateTokens())
+        layout.addWidget(self.treeWidgetSymbols, 1)
+
+        option_layout = QHBoxLayout()
+        self.checkBoxKeepSignatures = QCheckBox("Keep signatures of the others", self)
+        self.checkBoxKeepSignatures.setChecked(keep_signatures)
+        self.checkBoxKeepSignatures.toggled.connect(lambda checked: self.updateTokens())
+        option_layout.addWidget(self.checkBoxKeepSignatures)
+        self.labelTokens = QLabel(self)
+        option_layout.addWidget(self.labelTokens, 1)
+        self.pushButtonAutoSelect = QPushButton("Auto Select", self)
+        self.pushButtonAutoSelect.setToolTip("Check the symbols most relevant to the prompts")
+        self.pushButtonAutoSelect.clicked.connect(self.clickAutoSelect)
+        self.pushButtonAutoSelect.setEnabled(any(prompt.get('content') or prompt.get('system') for prompt in self.prompts))
+        option_layout.addWidget(self.pushButtonAutoSelect)
+        self.pushButtonSelectAll = QPushButton("Whole File", self)
+        self.pushButtonSelectAll.clicked.connect(lambda: self.setSelectedSymbols(self.items.keys()))
+        option_layout.addWidget(self.pushButtonSelectAll)
+        layout.addLayout(option_layout)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def getSelectedSymbols(self):
+        # None means the whole file
+        selected = set(name for name, item in self.items.items() if item.checkState(0) == Qt.Checked)
+        if len(selected) == len(self.items):
+            return None
+        return selected
+
+    def setSelectedSymbols(self, names):
+        names = set(names)
+        self.treeWidgetSymbols.blockSignals(True)
+        for name, item in self.items.items():
+            item.setCheckState(0, Qt.Checked if name in names else Qt.Unchecked)
+        self.treeWidgetSymbols.blockSignals(False)
+        self.updateTokens()
+
+    def isKeepSignatures(self):
+        return self.checkBoxKeepSignatures.isChecked()
+
+    def clickAutoSelect(self):
+        selected = self.system.InterfaceSelectExampleSymbols(self.content, self.analysis, self.prompts, 0, self.isKeepSignatures())
+        self.setSelectedSymbols(selected)
+
+    def updateTokens(self):
+        selected = self.getSelectedSymbols()
+        if selected is None:
+            tokens = self.analysis['tokens']
+        else:
+            example = self.system.InterfaceSliceExample(self.content, self.analysis, selected, self.isKeepSignatures())
+            tokens = token_counter.TokenCounter().InterfaceCountText(example, example_slicer.ExampleSlicer.COUNT_MODEL)
+        self.labelTokens.setText("{} / {} tokens".format(tokens, self.analysis['tokens']))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# author: CasinoHe
+# Purpose: estimate the tokens and cost of the request while the user is editing
+#   counting tokens of huge examples is slow, so it's debounced and done in a worker thread,
+#   the token counter of the llm interface caches the count of every message, so only the edited one is encoded,
+#   the examples are packed into the token budget in the worker thread too, the report is sent with the estimate
+
+from PySide6.QtCore import QObject, QTimer, Signal
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenMeter(QObject):
+    '''
+    TokenMeter estimates the request in background, and emits estimated signal in the gui thread
+    '''
+    # generation, estimate token, prompt cost, complete cost, pack report of the examples or None
+    estimated = Signal(int, int, float, float, object)
+
+    def __init__(self, system, parent, debounce_ms=400):
+        super().__init__(parent)
+        self.system = system
+        self.generation = 0
+        self.pending_request = None
+
+        # only one estimation is running, the others wait for it and only the newest one matters
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='token-meter')
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.onDebounceTimeout)
+
+    def request(self, collect_request):
+        '''
+        collect_request returns (supply, model, examples, prompts, pack), it's called in the gui thread after the debounce,
+        the examples are packed into the token budget before the estimation if pack is True
+        '''
+        self.pending_request = collect_request
+        # restart the timer, so we only estimate when the user stops typing
+        self.debounce_timer.start()
+
+    def onDebounceTimeout(self):
+        if self.pending_request is None:
+            return
+
+        supply, model, examples, prompts, pack = self.pending_request()
+        self.pending_request = None
+        if not supply:
+            return
+
+        self.generation += 1
+        self.executor.submit(self.estimate, self.generation, supply, model, examples, prompts, pack)
+
+    def estimate(self, generation, supply, model, examples, prompts, pack=False):
+        # a newer request is waiting, skip this one
+        if generation != self.generation:
+            return
+
+        report = None
+        try:
+            if pack and examples:
+                examples, report = self.system.InterfacePackExamples(supply, model, examples, prompts)
+            result = self.system.call_llm(supply, "InterfaceGetEstimateCost", model=model, examples=examples, prompts=prompts)
+        except Exception as e:
+            # some models cannot be estimated, it should not break the editing
+            print("Estimate token failed: {}".format(e))
+            return
+
+        if not result:
+            return
+        estimate_token, prompt_cost, complete_cost = result
+        # the signal is queued to the gui thread
+        self.estimated.emit(generation, estimate_token, prompt_cost, complete_cost, report)
+
+    def isLatest(self, generation):
+        return generation == self.generation
+
+    def shutdown(self):
+        self.debounce_timer.stop()
+        self.executor.shutdown(wait=False)
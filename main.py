@@ -4,18 +4,31 @@
 #   1. prepare data in config.json, including example files, prompt file, openai api key
 #   2. main.py will read config.json and all examples, prompts, then send request to openai api
 
-from PySide6.QtWidgets import QApplication
-
-import dialog.main_windows
-import system.manager
+from system import startup_report
 import sys
 
 if __name__ == "__main__":
+    report = startup_report.StartupReport()
+
+    with report.measure_import("PySide6.QtWidgets"):
+        from PySide6.QtWidgets import QApplication
+    with report.measure_import("dialog.main_windows"):
+        import dialog.main_windows
+    with report.measure_import("system.manager"):
+        import system.manager
+
+    # create the application first, the llm providers are created in background
+    app = QApplication(sys.argv)
+
     # init the system
     manager = system.manager.MainManager()
 
-    app = QApplication(sys.argv)
     main_window = dialog.main_windows.ProductiveAIGCToolWindows(manager)
     main_window.show()
+    report.mark('main window shown')
+
+    # print the report when all the providers are ready, use --startup-report to enable it
+    if "--startup-report" in sys.argv:
+        manager.wait_providers_async(lambda: print(manager.InterfaceGetStartupReport()))
 
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(app.exec())
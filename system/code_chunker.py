@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Purpose: split source files into chunks at the boundaries of functions and classes
+#   python files are split by their ast, a big class is split into its methods,
+#   the other files are split at the unindented lines after a blank line or a closing brace,
+#   no chunk is longer than MAX_LINES lines
+
+import ast
+
+
+class CodeChunk(object):
+    '''
+    CodeChunk is a part of a file, the lines are 1-based and inclusive
+    '''
+
+    def __init__(self, symbol, start_line, end_line, text):
+        super().__init__()
+        self.symbol = symbol
+        self.start_line = start_line
+        self.end_line = end_line
+        self.text = text
+
+    def __repr__(self):
+        return "CodeChunk({}, {}-{})".format(self.symbol, self.start_line, self.end_line)
+
+
+MAX_LINES = 120
+MIN_LINES = 20
+
+
+def get_node_start(node):
+    # the decorators belong to the function or class
+    decorators = getattr(node, 'decorator_list', [])
+    if decorators:
+        return min(decorator.lineno for decorator in decorators)
+    return node.lineno
+
+
+def make_chunks(lines, symbol, start_line, end_line):
+    '''
+    make chunks of lines[start_line - 1:end_line], a long range is split into several chunks
+    '''
+    chunks = []
+    for begin in range(start_line, end_line + 1, MAX_LINES):
+        end = min(begin + MAX_LINES - 1, end_line)
+        text = ''.join(lines[begin - 1:end])
+        if not text.strip():
+            continue
+        name = symbol if begin == start_line else "{} (line {})".format(symbol, begin)
+        chunks.append(CodeChunk(name, begin, end, text))
+    return chunks
+
+
+def chunk_python(text):
+    '''
+    return the chunks of a python source, raise SyntaxError if it can't be parsed
+    '''
+    tree = ast.parse(text)
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    # the module level statements between the definitions, for example the imports
+    pending_start = None
+    pending_end = None
+
+    def flush_pending():
+        if pending_start is not None:
+            chunks.extend(make_chunks(lines, "<module>", pending_start, pending_end))
+
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if pending_start is None:
+                pending_start = node.lineno
+            pending_end = node.end_lineno
+            # keep the module chunk within the limit
+            if pending_end - pending_start + 1 >= MAX_LINES:
+                flush_pending()
+                pending_start = None
+            continue
+
+        flush_pending()
+        pending_start = None
+
+        start = get_node_start(node)
+        end = node.end_lineno
+        if isinstance(node, ast.ClassDef) and end - start + 1 > MAX_LINES:
+            # a big class is split into its header and its methods
+            methods = [item for item in node.body if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            header_end = get_node_start(methods[0]) - 1 if methods else end
+            chunks.extend(make_chunks(lines, node.name, start, header_end))
+            for index, method in enumerate(methods):
+                method_start = get_node_start(method)
+                method_end = get_node_start(methods[index + 1]) - 1 if index + 1 < len(methods) else end
+                chunks.extend(make_chunks(lines, "{}.{}".format(node.name, method.name), method_start, method_end))
+        else:
+            chunks.extend(make_chunks(lines, node.name, start, end))
+
+    flush_pending()
+    return chunks
+
+
+def chunk_text(text):
+    '''
+    split a source of any language by its blocks
+    '''
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    start = 1
+    previous = ''
+    for number, line in enumerate(lines, 1):
+        size = number - start
+        # a new block starts at an unindented line after a blank line or a closing brace
+        is_boundary = line[:1] not in (' ', '\t', '\n', '\r', '') and previous.strip() in ('', '}', '};', 'end')
+        if (is_boundary and size >= MIN_LINES) or size >= MAX_LINES:
+            chunks.extend(make_text_chunks(lines, start, number - 1))
+            start = number
+        previous = line
+    chunks.extend(make_text_chunks(lines, start, len(lines)))
+    return chunks
+
+
+def make_text_chunks(lines, start_line, end_line):
+    if end_line < start_line:
+        return []
+    # the first line that is not empty tells what the block is
+    symbol = ''
+    for line in lines[start_line - 1:end_line]:
+        if line.strip():
+            symbol = line.strip()[:80]
+            break
+    return make_chunks(lines, symbol, start_line, end_line)
+
+
+def chunk_source(file_path, text):
+    '''
+    return the chunks of the file content
+    '''
+    if file_path.endswith('.py'):
+        try:
+            return chunk_python(text)
+        except (SyntaxError, ValueError):
+            pass
+    return chunk_text(text)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Purpose: find the fenced code blocks of a markdown reply while it is streamed
+#   the parser is fed with the pieces of the reply, only the new text is scanned,
+#   a code block is completed the moment its closing fence line arrives
+
+import re
+
+
+class CodeBlock(object):
+    '''
+    CodeBlock is a fenced code block of the reply, the lines are 0-based lines of the reply, end_line is the closing fence
+    '''
+
+    def __init__(self, index, language, start_line, end_line, code):
+        super().__init__()
+        self.index = index
+        self.language = language
+        self.start_line = start_line
+        self.end_line = end_line
+        self.code = code
+
+    def get_title(self):
+        first_line = self.code.strip().split('\n', 1)[0][:60]
+        return "{}. {} {}".format(self.index + 1, self.language or 'code', first_line)
+
+    def __repr__(self):
+        return "CodeBlock({}, {}, {}-{})".format(self.index, self.language, self.start_line, self.end_line)
+
+
+# ``` or ~~~ of 3 characters or more, followed by the language
+FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})\s*([\w+#.-]*)')
+
+
+def match_fence(line):
+    '''
+    return (fence, language) if the line opens or closes a fence, otherwise None
+    '''
+    match = FENCE_PATTERN.match(line)
+    if match is None:
+        return None
+    # the info string of a backtick fence can't contain a backtick
+    if match.group(1)[0] == '`' and '`' in line[match.end(1):]:
+        return None
+    return match.group(1), match.group(2).lower()
+
+
+def is_closing_fence(line, fence):
+    stripped = line.strip()
+    return len(stripped) >= len(fence) and stripped == stripped[0] * len(stripped) and stripped[0] == fence[0] \
+        and len(line) - len(line.lstrip(' ')) <= 3
+
+
+class CodeFenceParser(object):
+    '''
+    CodeFenceParser scans the reply incrementally, feed() returns the code blocks completed by the new text
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        self.blocks = []
+        # the last line is not completed yet
+        self.partial_line = ''
+        self.line_number = 0
+        # the fence of the open block, None if it's not in a code block
+        self.fence = None
+        self.language = ''
+        self.block_start = 0
+        self.code_lines = []
+
+    def feed(self, text):
+        completed = []
+        lines = (self.partial_line + text).split('\n')
+        self.partial_line = lines.pop()
+        for line in lines:
+            block = self.feed_line(line)
+            if block is not None:
+                completed.append(block)
+        return completed
+
+    def feed_line(self, line):
+        line = line.rstrip('\r')
+        block = None
+        if self.fence is None:
+            fence = match_fence(line)
+            if fence is not None:
+                self.fence, self.language = fence
+                self.block_start = self.line_number
+                self.code_lines = []
+        elif is_closing_fence(line, self.fence):
+            block = CodeBlock(len(self.blocks), self.language, self.block_start, self.line_number, '\n'.join(self.code_lines) + '\n')
+            self.blocks.append(block)
+            self.fence = None
+        else:
+            self.code_lines.append(line)
+        self.line_number += 1
+        return block
+
+    def finish(self):
+        '''
+        the reply is completed, an unclosed block is completed at the end of the reply
+        '''
+        completed = []
+        if self.partial_line:
+            block = self.feed_line(self.partial_line)
+            self.partial_line = ''
+            if block is not None:
+                completed.append(block)
+        if self.fence is not None and self.code_lines:
+            block = CodeBlock(len(self.blocks), self.language, self.block_start, self.line_number, '\n'.join(self.code_lines) + '\n')
+            self.blocks.append(block)
+            self.fence = None
+            completed.append(block)
+        return completed
+
+    def is_in_block(self):
+        return self.fence is not None
+
+
+def parse_code_blocks(text):
+    '''
+    return all the code blocks of the text
+    '''
+    parser = CodeFenceParser()
+    parser.feed(text)
+    parser.finish()
+    return parser.blocks
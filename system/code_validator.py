@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Purpose: validate the code blocks of a generated reply
+#   every block is compiled, and checked by the lint command and the test command if they are set,
+#   the checks run in a process pool, so a huge block or a slow command never blocks the gui or the other checks,
+#   the commands are run with a timeout, the code is written to a temporary file that replaces {file} in the command
+
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+
+class ValidationResult(object):
+    '''
+    ValidationResult is the result of one check of a code block
+    status is 'passed', 'failed', 'skipped' or 'timeout', line is the 1-based line of the block that failed, or None
+    '''
+
+    def __init__(self, block_index, stage, status, message='', line=None, seconds=0.0):
+        super().__init__()
+        self.block_index = block_index
+        self.stage = stage
+        self.status = status
+        self.message = message
+        self.line = line
+        self.seconds = seconds
+
+    def is_passed(self):
+        return self.status in ('passed', 'skipped')
+
+    def __repr__(self):
+        return "ValidationResult({}, {}, {})".format(self.block_index, self.stage, self.status)
+
+
+# the suffix of the temporary file, the commands tell the language by it
+LANGUAGE_SUFFIXES = {
+    'python': '.py', 'py': '.py', 'lua': '.lua', 'c': '.c', 'cpp': '.cpp', 'c++': '.cpp', 'cs': '.cs', 'csharp': '.cs',
+    'java': '.java', 'javascript': '.js', 'js': '.js', 'typescript': '.ts', 'ts': '.ts', 'go': '.go', 'rust': '.rs',
+    'json': '.json', 'shell': '.sh', 'bash': '.sh', 'sh': '.sh', 'hlsl': '.hlsl', 'glsl': '.glsl',
+}
+# the output of the commands is cut to its end
+MAX_OUTPUT_CHARS = 4000
+# file:line:column: of the compilers and linters, or line N of the python tracebacks
+LINE_PATTERN = re.compile(r'<generated>(?::(\d+)(?::\d+)?:|", line (\d+))')
+
+
+def check_syntax(language, code):
+    '''
+    return (status, message, line), it runs in a worker process
+    '''
+    if language in ('python', 'py'):
+        try:
+            compile(code, '<generated>', 'exec')
+        except SyntaxError as e:
+            return 'failed', "{}: {}".format(type(e).__name__, e.msg), e.lineno
+        except ValueError as e:
+            return 'failed', str(e), None
+        return 'passed', '', None
+    if language == 'json':
+        import json
+        try:
+            json.loads(code)
+        except ValueError as e:
+            return 'failed', str(e), getattr(e, 'lineno', None)
+        return 'passed', '', None
+    return 'skipped', "no syntax check for '{}'".format(language or 'unknown'), None
+
+
+def run_command(command, language, code, timeout):
+    '''
+    run the command on the code, return (status, message, line), it runs in a worker process
+    '''
+    suffix = LANGUAGE_SUFFIXES.get(language, '.txt')
+    handle, file_path = tempfile.mkstemp(prefix='generated_', suffix=suffix)
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write(code)
+        # the file is quoted, the temporary directory may have spaces
+        command_line = command.replace('{file}', '"{}"'.format(file_path)) if '{file}' in command else '{} "{}"'.format(command, file_path)
+        try:
+            process = subprocess.run(command_line, shell=True, capture_output=True, text=True, timeout=timeout,
+                                     encoding='utf-8', errors='replace')
+        except subprocess.TimeoutExpired:
+            return 'timeout', "'{}' is not finished in {} seconds".format(command, timeout), None
+        output = (process.stdout + process.stderr).replace(file_path, '<generated>').strip()
+        output = output[-MAX_OUTPUT_CHARS:]
+        if process.returncode == 0:
+            return 'passed', output, None
+        match = LINE_PATTERN.search(output)
+        return 'failed', output or "exit code {}".format(process.returncode), int(match.group(1) or match.group(2)) if match else None
+    finally:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+class CodeValidator(object):
+    '''
+    CodeValidator checks the code blocks in a process pool, the pool is created when it's used first
+    '''
+
+    def __init__(self, max_workers=None):
+        super().__init__()
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.executor = None
+        self.mutex = threading.Lock()
+
+    def get_executor(self):
+        with self.mutex:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def validate(self, blocks, lint_command='', test_command='', timeout=30, callback=None):
+        '''
+        blocks is [(language, code)], return [ValidationResult] of all the checks of all the blocks
+        callback(result) is called when every check is completed, it's called in current thread
+        it blocks until all the checks are completed, call it in a worker thread
+        '''
+        executor = self.get_executor()
+        jobs = []
+        for index, (language, code) in enumerate(blocks):
+            jobs.append((index, 'syntax', executor.submit(check_syntax, language, code)))
+            if lint_command:
+                jobs.append((index, 'lint', executor.submit(run_command, lint_command, language, code, timeout)))
+            if test_command:
+                jobs.append((index, 'test', executor.submit(run_command, test_command, language, code, timeout)))
+
+        begin = time.perf_counter()
+        # the checks wait for a free worker, every round of the workers takes the timeout at most,
+        # the commands are killed by subprocess, a check out of the deadline is abandoned
+        rounds = (len(jobs) + self.max_workers - 1) // self.max_workers
+        deadline = begin + timeout * rounds + 5
+        results = []
+        for index, stage, future in jobs:
+            remain = max(deadline - time.perf_counter(), 0.1)
+            try:
+                status, message, line = future.result(timeout=remain)
+            except TimeoutError:
+                future.cancel()
+                status, message, line = 'timeout', "the check is not finished in {} seconds".format(timeout), None
+            except Exception as e:
+                status, message, line = 'failed', "the check failed: {}".format(e), None
+            result = ValidationResult(index, stage, status, message, line, time.perf_counter() - begin)
+            results.append(result)
+            if callback:
+                callback(result)
+        return results
+
+    def shutdown(self):
+        with self.mutex:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
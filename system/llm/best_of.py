@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Purpose: generate several candidates of the same request and pick the best one
+#   the candidates are requested in one request if the supply returns several choices, otherwise by parallel requests,
+#   the code blocks of all the candidates are validated concurrently when they are completed,
+#   and the candidates are ranked by the validation, the score of the scorer and their length
+
+import threading
+import time
+
+from system import code_fence
+from system.llm import llm_interface
+
+
+class BestOfRequest(object):
+    '''
+    BestOfRequest generates count candidates of one request and ranks them
+
+    callback is called as callback(index, text, reason) for every piece of candidates[index]
+    complete_callback is called as complete_callback(candidates) with the ranked candidates, the best one is the first,
+    every candidate is a dict of 'index', 'text', 'error', 'blocks', 'results', 'failed', 'score'
+    scorer(text, blocks, results) returns a number, the higher the better, it breaks the tie of the validation
+    all the callbacks are called in the worker threads
+    '''
+
+    def __init__(self, manager, supply, model, examples, prompts, temperature=0.7, count=3, scorer=None,
+                 callback=None, complete_callback=None):
+        super().__init__()
+        self.manager = manager
+        self.supply = supply
+        self.model = model
+        self.examples = examples
+        self.prompts = prompts
+        self.temperature = temperature
+        self.count = max(count, 1)
+        self.scorer = scorer
+        self.callback = callback
+        self.complete_callback = complete_callback
+
+        self.candidates = [{'index': index, 'text': '', 'error': '', 'blocks': [], 'results': [], 'failed': 0, 'score': 0.0}
+                           for index in range(self.count)]
+        self.chunks = [[] for _ in range(self.count)]
+        self.threads = []
+        self.requests = []
+        self.ranked = []
+        self.begin = 0.0
+        self.latency = 0.0
+        self.mutex = threading.Lock()
+        self.completed_event = threading.Event()
+        self.cancelled = False
+        self.remain = 0
+
+    def get_groups(self):
+        '''
+        return [(first index, size)], every group is one request
+        '''
+        try:
+            max_candidates = self.manager.call_llm(self.supply, "InterfaceGetMaxCandidates", self.model) or 1
+        except Exception as e:
+            print("Get the max candidates of {} failed: {}".format(self.supply, e))
+            max_candidates = 1
+        groups = []
+        index = 0
+        while index < self.count:
+            size = min(max_candidates, self.count - index)
+            groups.append((index, size))
+            index += size
+        return groups
+
+    def start(self):
+        self.begin = time.perf_counter()
+        groups = self.get_groups()
+        self.remain = len(groups)
+        for first, size in groups:
+            thread = threading.Thread(target=self.run_group, args=(first, size), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled = True
+        for request in list(self.requests):
+            request.cancel()
+
+    def wait(self, timeout=None):
+        return self.completed_event.wait(timeout)
+
+    def get_candidates(self):
+        return list(self.ranked)
+
+    def add_piece(self, index, text, reason=None):
+        if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+            self.candidates[index]['error'] = text
+        else:
+            if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                self.chunks[index].clear()
+            self.chunks[index].append(text)
+        if self.callback:
+            self.callback(index, text, reason)
+
+    def run_group(self, first, size):
+        errors = []
+
+        def on_reply(text, reason=None):
+            # empty text means the request is completed, it's handled after the blocking request returns
+            if not text:
+                return
+            if size == 1:
+                self.add_piece(first, text, reason)
+            elif reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                errors.append(text)
+
+        def on_candidate(index, text):
+            self.add_piece(first + index, text)
+
+        kwargs = {}
+        if size > 1:
+            kwargs = {'candidates': size, 'candidate_callback': on_candidate}
+        try:
+            # the candidates must be different, the cached reply is never used
+            request = self.manager.call_llm(self.supply, "InterfaceChatRequest", model=self.model, temperature=self.temperature,
+                                            examples=self.examples, prompts=self.prompts, new_chat=True, use_cache=False,
+                                            callback=on_reply, **kwargs)
+            if request is None:
+                errors.append("Cannot find valid api supply name {}".format(self.supply))
+            else:
+                self.requests.append(request)
+                request.wait()
+        except Exception as e:
+            # one failed request should not break the others
+            errors.append(str(e))
+
+        for index in range(first, first + size):
+            if errors and not self.candidates[index]['error']:
+                self.candidates[index]['error'] = errors[0]
+
+        self.mutex.acquire()
+        self.remain -= 1
+        is_last = self.remain == 0
+        self.mutex.release()
+        if is_last:
+            self.finish()
+
+    def finish(self):
+        # runs in the thread of the last completed request
+        for candidate, chunks in zip(self.candidates, self.chunks):
+            candidate['text'] = ''.join(chunks)
+            candidate['blocks'] = code_fence.parse_code_blocks(candidate['text']) if not candidate['error'] else []
+
+        if not self.cancelled:
+            try:
+                self.validate()
+            except Exception as e:
+                print("Validate the candidates failed: {}".format(e))
+        self.ranked = self.rank(self.candidates)
+        self.latency = time.perf_counter() - self.begin
+
+        if self.complete_callback:
+            self.complete_callback(self.get_candidates())
+        self.completed_event.set()
+
+    def validate(self):
+        '''
+        validate the code blocks of all the candidates in one batch, so all the checks run concurrently
+        '''
+        blocks = []
+        owners = []
+        for candidate in self.candidates:
+            for block in candidate['blocks']:
+                blocks.append((block.language, block.code))
+                owners.append((candidate, block.index))
+        if not blocks:
+            return
+
+        for result in self.manager.InterfaceValidateCode(blocks):
+            candidate, block_index = owners[result.block_index]
+            # the result tells the block of its candidate
+            result.block_index = block_index
+            candidate['results'].append(result)
+            if not result.is_passed():
+                candidate['failed'] += 1
+
+    def rank(self, candidates):
+        for candidate in candidates:
+            if self.scorer is None or candidate['error']:
+                continue
+            try:
+                candidate['score'] = float(self.scorer(candidate['text'], candidate['blocks'], candidate['results']))
+            except Exception as e:
+                print("Score the candidate {} failed: {}".format(candidate['index'], e))
+
+        # the failed requests are the last, then the fewer failed checks, the reply with code, the higher score,
+        # and the shorter reply is the better one
+        def rank_key(candidate):
+            is_failed = bool(candidate['error']) or not candidate['text'].strip()
+            return (is_failed, candidate['failed'], not candidate['blocks'], -candidate['score'], len(candidate['text']))
+        return sorted(candidates, key=rank_key)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Purpose: fit the chat messages into the context window of the model
+#   the system message and the examples are pinned, the current prompt is always sent,
+#   the oldest turns of the conversation are truncated, dropped, or summarized into one message
+#   until the messages fit the token budget, and the saved tokens are reported,
+#   the prompt is never truncated below MIN_PROMPT_TOKENS, the request that still can't fit is reported as overflow
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from system.llm import token_counter
+
+
+class ContextBudget(object):
+    '''
+    ContextBudget knows the context window of the models, and trims the history of a request to the budget
+    budget is the max prompt tokens, 0 means the context window minus completion_reserve
+    '''
+
+    # the longest matched prefix decides the context window
+    CONTEXT_WINDOWS = {
+        'gpt-3.5-turbo-16k': 16384,
+        'gpt-3.5-turbo': 4096,
+        'gpt-4-32k': 32768,
+        'gpt-4': 8192,
+        'text-davinci-003': 4097,
+        'text-davinci-002': 4097,
+        'code-davinci-002': 8001,
+    }
+    DEFAULT_CONTEXT_WINDOW = 4096
+
+    # the model whose message format is used to count the models the counter doesn't know
+    DEFAULT_COUNT_MODEL = 'gpt-3.5-turbo'
+
+    SUMMARY_PREFIX = "This is the summary of our earlier conversation: "
+
+    # the prompt truncated shorter than this is useless, the request should not be sent
+    MIN_PROMPT_TOKENS = 256
+
+    def __init__(self, budget=0, completion_reserve=1024, summarize=False):
+        super().__init__()
+        self.budget = budget
+        self.completion_reserve = completion_reserve
+        self.summarize = summarize
+        self.mutex = threading.Lock()
+        # the hash of the summarized messages -> summary, so a long conversation is not summarized again every turn
+        self.summaries = OrderedDict()
+
+    def set_options(self, budget=None, completion_reserve=None, summarize=None):
+        if budget is not None:
+            self.budget = budget
+        if completion_reserve is not None:
+            self.completion_reserve = completion_reserve
+        if summarize is not None:
+            self.summarize = summarize
+
+    def get_context_window(self, model):
+        for name in sorted(self.CONTEXT_WINDOWS, key=len, reverse=True):
+            if model.startswith(name):
+                return self.CONTEXT_WINDOWS[name]
+        return self.DEFAULT_CONTEXT_WINDOW
+
+    def get_budget(self, model):
+        limit = max(self.get_context_window(model) - self.completion_reserve, 0)
+        if self.budget > 0:
+            return min(self.budget, limit)
+        return limit
+
+    def get_count_model(self, model):
+        counter = token_counter.TokenCounter()
+        if counter.MODEL_ALIASES.get(model, model) in counter.MESSAGE_TOKENS:
+            return model
+        return self.DEFAULT_COUNT_MODEL
+
+    def count_message(self, message, model):
+        # the 3 tokens that prime the reply are counted once for the request, not for every message
+        return token_counter.TokenCounter().InterfaceCountMessages([message], model) - 3
+
+    def truncate_text(self, text, tokens, model):
+        '''
+        keep the head and the tail of the text within the tokens, the middle is replaced by a mark
+        '''
+        encoding = token_counter.TokenCounter().get_encoding(model)
+        encoded = encoding.encode(text)
+        if len(encoded) <= tokens:
+            return text
+        mark = "\n...(truncated)...\n"
+        keep = max(tokens - len(encoding.encode(mark)), 0)
+        head = keep // 2
+        tail = keep - head
+        return encoding.decode(encoded[:head]) + mark + (encoding.decode(encoded[-tail:]) if tail else '')
+
+    def get_summary(self, messages, summarizer, max_tokens):
+        key = hashlib.sha256(repr([(m['role'], m['content']) for m in messages]).encode('utf-8')).hexdigest()
+        self.mutex.acquire()
+        summary = self.summaries.get(key)
+        self.mutex.release()
+        if summary is not None:
+            return summary
+
+        summary = summarizer(messages, max_tokens)
+        if not summary:
+            return None
+        self.mutex.acquire()
+        self.summaries[key] = summary
+        while len(self.summaries) > 64:
+            self.summaries.popitem(last=False)
+        self.mutex.release()
+        return summary
+
+    def fit(self, messages, model, pinned, summarizer=None):
+        '''
+        messages[:pinned] are pinned, messages[-1] is the current prompt
+        summarizer(messages, max_tokens) returns the summary of the messages, it's only used if summarize is enabled
+        return (messages, report), report is {'budget', 'original', 'sent', 'saved', 'dropped', 'truncated', 'summarized', 'overflow'}
+        overflow is the tokens still over the budget, the caller should not send the request if it's not 0
+        '''
+        count_model = self.get_count_model(model)
+        budget = self.get_budget(model)
+        counts = [self.count_message(message, count_model) for message in messages]
+        original = sum(counts) + 3
+        report = {'budget': budget, 'original': original, 'sent': original, 'saved': 0,
+                  'dropped': 0, 'truncated': 0, 'summarized': False, 'overflow': 0}
+        if original <= budget:
+            return messages, report
+        if len(messages) <= pinned:
+            # no prompt, nothing can be trimmed
+            report['overflow'] = original - budget
+            return messages, report
+
+        head = list(messages[:pinned])
+        current = dict(messages[-1])
+        history = [dict(message) for message in messages[pinned:-1]]
+        history_counts = counts[pinned:-1]
+        excess = original - budget
+
+        # leave room for the summary of the dropped turns
+        summary_tokens = min(256, budget // 8) if self.summarize and summarizer else 0
+        # the prefix and the separators of the summary message
+        summary_reserve = summary_tokens + 24 if summary_tokens else 0
+        excess += summary_reserve
+
+        # the history is [user, assistant, user, assistant ...], a turn is a user message and its reply
+        dropped = []
+        while history and excess > 0:
+            turn_size = 2 if len(history) > 1 and history[1]['role'] == 'assistant' else 1
+            turn_tokens = sum(history_counts[:turn_size])
+            longest = max(range(turn_size), key=lambda index: history_counts[index])
+            # only a little is needed, truncate the longest message of the turn instead of dropping it
+            if excess < history_counts[longest] // 2:
+                keep = history_counts[longest] - excess - 8
+                content = self.truncate_text(history[longest]['content'], keep, count_model)
+                new_count = self.count_message({'role': history[longest]['role'], 'content': content}, count_model)
+                if new_count < history_counts[longest]:
+                    history[longest]['content'] = content
+                    excess -= history_counts[longest] - new_count
+                    history_counts[longest] = new_count
+                    report['truncated'] += 1
+                    continue
+            dropped.extend(history[:turn_size])
+            del history[:turn_size]
+            del history_counts[:turn_size]
+            excess -= turn_tokens
+            report['dropped'] += turn_size
+
+        if summary_tokens:
+            excess -= summary_reserve
+            summary = self.get_summary(dropped, summarizer, summary_tokens) if dropped else None
+            if summary:
+                summary_message = {'role': 'user', 'content': self.SUMMARY_PREFIX + summary}
+                summary_count = self.count_message(summary_message, count_model)
+                if summary_count <= summary_reserve:
+                    history.insert(0, summary_message)
+                    history_counts.insert(0, summary_count)
+                    excess += summary_count
+                    report['summarized'] = True
+
+        # the pinned messages and the prompt are too long, the prompt is the only one we can truncate,
+        # but only if the rest of it is still a useful prompt
+        if excess > 0:
+            # the role and the separators of the message are counted too, keep some room for them
+            keep = counts[-1] - excess - 8
+            if keep >= self.MIN_PROMPT_TOKENS:
+                current['content'] = self.truncate_text(current['content'], keep, count_model)
+                report['truncated'] += 1
+
+        result = head + history + [current]
+        report['sent'] = sum(self.count_message(message, count_model) for message in result) + 3
+        report['saved'] = original - report['sent']
+        report['overflow'] = max(report['sent'] - budget, 0)
+        return result, report
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Purpose: choose the examples that are sent with the prompts within a token budget
+#   every example can be skipped, sent as a whole, or truncated to a part of it,
+#   the relevance of an example to the prompts is the cosine of their identifiers,
+#   the most relevant combination within the budget is chosen by a multiple choice knapsack
+
+import collections
+import math
+import re
+import threading
+
+from system.llm import token_counter
+
+
+class ExamplePacker(object):
+    '''
+    ExamplePacker packs the examples into a token budget
+    '''
+
+    # the parts of an example that can be sent, a truncated example keeps its first lines
+    TRUNCATION_LEVELS = (1.0, 0.5, 0.25)
+    # every example is worth a little, so an unrelated example is still sent if there is room
+    MIN_RELEVANCE = 0.05
+    # the knapsack works on buckets of tokens, so it's fast with a huge budget
+    MAX_BUCKETS = 2000
+
+    WORD_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]{2,}')
+
+    COUNT_MODEL = 'gpt-3.5-turbo'
+
+    # the truncated contents are shared by all the packers, packing again while editing only truncates the edited example
+    TRUNCATION_MEMO_SIZE = 256
+    truncation_memo = collections.OrderedDict()
+    truncation_mutex = threading.Lock()
+
+    def __init__(self, model=None):
+        super().__init__()
+        self.model = model or self.COUNT_MODEL
+
+    @classmethod
+    def get_words(cls, text):
+        words = collections.Counter()
+        for word in cls.WORD_PATTERN.findall(text or ''):
+            word = word.lower()
+            words[word] += 1
+            # snake_case names are related to their parts
+            if '_' in word:
+                words.update(part for part in word.split('_') if len(part) > 2)
+        return words
+
+    @staticmethod
+    def cosine(words, other_words):
+        if not words or not other_words:
+            return 0.0
+        dot = sum(count * other_words.get(word, 0) for word, count in words.items())
+        norm = math.sqrt(sum(count * count for count in words.values())) * math.sqrt(sum(count * count for count in other_words.values()))
+        return dot / norm if norm else 0.0
+
+    def get_relevance(self, example, prompt_words):
+        words = self.get_words(example.get('desc', '')) + self.get_words(example.get('content', ''))
+        return max(self.cosine(words, prompt_words), self.MIN_RELEVANCE)
+
+    def count_tokens(self, text):
+        return token_counter.TokenCounter().InterfaceCountText(text, self.model)
+
+    def truncate_content(self, content, fraction):
+        '''
+        keep the first lines of the content within the fraction of its tokens
+        '''
+        if fraction >= 1.0:
+            return content
+        key = (token_counter.TokenCounter.content_hash(content), fraction, self.model)
+        with self.truncation_mutex:
+            text = self.truncation_memo.get(key)
+            if text is not None:
+                self.truncation_memo.move_to_end(key)
+                return text
+
+        encoding = token_counter.TokenCounter().get_encoding(self.model)
+        encoded = encoding.encode(content)
+        text = encoding.decode(encoded[:int(len(encoded) * fraction)])
+        # cut at the end of a line, so a statement is not broken in the middle
+        line_end = text.rfind('\n')
+        if line_end > 0:
+            text = text[:line_end + 1]
+
+        with self.truncation_mutex:
+            self.truncation_memo[key] = text
+            if len(self.truncation_memo) > self.TRUNCATION_MEMO_SIZE:
+                self.truncation_memo.popitem(last=False)
+        return text
+
+    def get_options(self, example, relevance):
+        '''
+        return [(fraction, tokens, value)] of every way to send the example
+        '''
+        fixed_tokens = self.count_tokens(example.get('desc', '')) + self.count_tokens(example.get('response', ''))
+        content_tokens = self.count_tokens(example.get('content', ''))
+        options = []
+        for fraction in self.TRUNCATION_LEVELS:
+            # a shorter part is worth less, but the first lines usually tell the most
+            tokens = fixed_tokens + int(math.ceil(content_tokens * fraction))
+            options.append((fraction, tokens, relevance * math.sqrt(fraction)))
+            if content_tokens == 0:
+                break
+        return options
+
+    def solve(self, groups, budget):
+        '''
+        groups[i] is the options of example i, return the chosen option index of every example, -1 means skipped
+        '''
+        scale = max(1, int(math.ceil(budget / self.MAX_BUCKETS)))
+        capacity = budget // scale
+        best = [0.0] * (capacity + 1)
+        choices = []
+        for options in groups:
+            # the weight is rounded up, the chosen examples never exceed the budget
+            weights = [int(math.ceil(tokens / scale)) for _, tokens, _ in options]
+            new_best = list(best)
+            choice = [-1] * (capacity + 1)
+            for size in range(capacity + 1):
+                for index, (_, _, value) in enumerate(options):
+                    weight = weights[index]
+                    if weight <= size and best[size - weight] + value > new_best[size]:
+                        new_best[size] = best[size - weight] + value
+                        choice[size] = index
+            best = new_best
+            choices.append(choice)
+
+        # walk back from the full budget to find the chosen options
+        result = [-1] * len(groups)
+        size = capacity
+        for group_index in range(len(groups) - 1, -1, -1):
+            index = choices[group_index][size]
+            result[group_index] = index
+            if index >= 0:
+                size -= int(math.ceil(groups[group_index][index][1] / scale))
+        return result
+
+    def pack(self, examples, prompts, budget):
+        '''
+        return (packed examples, report), report[i] is {'index', 'relevance', 'tokens', 'fraction', 'included'} of examples[i]
+        '''
+        prompt_words = collections.Counter()
+        for prompt in prompts or []:
+            prompt_words.update(self.get_words(prompt.get('content', '')))
+
+        relevances = [self.get_relevance(example, prompt_words) for example in examples]
+        groups = [self.get_options(example, relevance) for example, relevance in zip(examples, relevances)]
+        chosen = self.solve(groups, max(budget, 0))
+
+        packed = []
+        report = []
+        for index, example in enumerate(examples):
+            option = chosen[index]
+            item = {'index': index, 'relevance': relevances[index], 'tokens': 0, 'fraction': 0.0, 'included': option >= 0}
+            if option >= 0:
+                fraction, tokens, _ = groups[index][option]
+                item['tokens'] = tokens
+                item['fraction'] = fraction
+                packed_example = dict(example)
+                packed_example['content'] = self.truncate_content(example.get('content', ''), fraction)
+                packed.append(packed_example)
+            report.append(item)
+        return packed, report
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Purpose: send only the relevant symbols of an example file instead of the whole file
+#   a python file is parsed into its imports, classes, methods and functions,
+#   the other files are split into blocks by code_chunker and their import lines are found by patterns,
+#   the kept symbols are sent as a whole, the others are reduced to their signatures or removed,
+#   the analysis of a file is cached by its content hash in memory and on disk, so opening it again is instant
+
+import ast
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+
+from system import code_chunker
+from system.llm import example_packer
+from system.llm import token_counter
+
+
+class ExampleSlicer(object):
+    '''
+    ExampleSlicer analyzes the symbols of an example file, and builds the example from the chosen symbols
+    the analysis is a dict that can be saved as json:
+        {'hash', 'language', 'imports': [[start line, end line]], 'symbols': [symbol]}
+    a symbol is {'name', 'kind', 'parent', 'start_line', 'end_line', 'signature_end', 'tokens', 'signature_tokens'},
+    the lines are 1-based and inclusive, kind is 'class', 'function', 'method' or 'block'
+    '''
+
+    # increase it when the analysis is changed, the old cache files are ignored
+    VERSION = 1
+    COUNT_MODEL = 'gpt-3.5-turbo'
+    MAX_MEMORY_ENTRIES = 64
+    # a symbol less relevant than this is not chosen automatically
+    MIN_RELEVANCE = 0.05
+
+    IMPORT_PATTERN = re.compile(r'^\s*(#include|#import|import\b|using\b|require\b|from\b.*\bimport\b|local\s+\w+\s*=\s*require\b|use\b)')
+
+    def __init__(self, cache_dir):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.memory = collections.OrderedDict()
+        self.mutex = threading.Lock()
+
+    @classmethod
+    def get_hash(cls, file_path, text):
+        # the language is told by the extension, so it's a part of the key
+        language = 'python' if file_path.endswith('.py') else 'text'
+        data = "{}\n{}\n{}".format(cls.VERSION, language, text)
+        return hashlib.sha1(data.encode('utf-8', errors='replace')).hexdigest()
+
+    def get_cache_file(self, file_hash):
+        return os.path.join(self.cache_dir, file_hash[:2], file_hash + '.json')
+
+    def load(self, file_hash):
+        with self.mutex:
+            analysis = self.memory.get(file_hash)
+            if analysis is not None:
+                self.memory.move_to_end(file_hash)
+                return analysis
+        try:
+            with open(self.get_cache_file(file_hash), 'r', encoding='utf-8') as f:
+                analysis = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.remember(file_hash, analysis)
+        return analysis
+
+    def remember(self, file_hash, analysis):
+        with self.mutex:
+            self.memory[file_hash] = analysis
+            self.memory.move_to_end(file_hash)
+            while len(self.memory) > self.MAX_MEMORY_ENTRIES:
+                self.memory.popitem(last=False)
+
+    def save(self, file_hash, analysis):
+        self.remember(file_hash, analysis)
+        cache_file = self.get_cache_file(file_hash)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            temp_file = cache_file + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(analysis, f)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            print("save the example analysis failed: {}".format(e))
+
+    def count_tokens(self, text):
+        return token_counter.TokenCounter().InterfaceCountText(text, self.COUNT_MODEL)
+
+    @staticmethod
+    def get_signature_end(node):
+        '''
+        the signature of a function or class is its decorators, its header and its docstring
+        '''
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], 'value', None), ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            return body[0].end_lineno
+        if body and body[0].lineno > node.lineno:
+            return body[0].lineno - 1
+        return node.lineno
+
+    def analyze_python(self, text):
+        tree = ast.parse(text)
+        imports = []
+        symbols = []
+        # the module statements between the definitions are kept as blocks
+        block_start = None
+        block_end = None
+
+        def flush_block():
+            if block_start is not None:
+                symbols.append(self.make_symbol("<module line {}>".format(block_start), 'block', None, block_start, block_end, block_start))
+
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                imports.append([node.lineno, node.end_lineno])
+                continue
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if block_start is None:
+                    block_start = node.lineno
+                block_end = node.end_lineno
+                continue
+            flush_block()
+            block_start = None
+
+            start = code_chunker.get_node_start(node)
+            if isinstance(node, ast.ClassDef):
+                methods = [item for item in node.body if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))]
+                # the header of a class keeps its attributes before the first method
+                signature_end = code_chunker.get_node_start(methods[0]) - 1 if methods else self.get_signature_end(node)
+                symbols.append(self.make_symbol(node.name, 'class', None, start, node.end_lineno, signature_end))
+                for item in methods:
+                    symbols.append(self.make_symbol("{}.{}".format(node.name, item.name), 'method', node.name,
+                                                    code_chunker.get_node_start(item), item.end_lineno, self.get_signature_end(item)))
+            else:
+                symbols.append(self.make_symbol(node.name, 'function', None, start, node.end_lineno, self.get_signature_end(node)))
+        flush_block()
+        return imports, symbols
+
+    def analyze_text(self, text):
+        lines = text.splitlines(keepends=True)
+        imports = []
+        for number, line in enumerate(lines, 1):
+            if self.IMPORT_PATTERN.match(line):
+                imports.append([number, number])
+        import_lines = set(number for number, _ in imports)
+
+        symbols = []
+        for chunk in code_chunker.chunk_text(text):
+            # the import lines at the beginning of the file are sent with the imports
+            start = chunk.start_line
+            while start <= chunk.end_line and (start in import_lines or not lines[start - 1].strip()):
+                start += 1
+            if start > chunk.end_line:
+                continue
+            symbols.append(self.make_symbol(chunk.symbol or "<line {}>".format(start), 'block', None, start, chunk.end_line, start))
+        return imports, symbols
+
+    @staticmethod
+    def make_symbol(name, kind, parent, start_line, end_line, signature_end):
+        return {'name': name, 'kind': kind, 'parent': parent, 'start_line': start_line, 'end_line': end_line,
+                'signature_end': min(signature_end, end_line), 'tokens': 0, 'signature_tokens': 0}
+
+    def analyze(self, file_path, text):
+        '''
+        return the analysis of the file content, it's cached by the content hash
+        '''
+        file_hash = self.get_hash(file_path, text)
+        analysis = self.load(file_hash)
+        if analysis is not None:
+            return analysis
+
+        language = 'text'
+        if file_path.endswith('.py'):
+            try:
+                imports, symbols = self.analyze_python(text)
+                language = 'python'
+            except (SyntaxError, ValueError):
+                imports, symbols = self.analyze_text(text)
+        else:
+            imports, symbols = self.analyze_text(text)
+
+        # the same name may be defined twice, the names must be unique to be chosen
+        names = collections.Counter()
+        lines = text.splitlines(keepends=True)
+        for symbol in symbols:
+            names[symbol['name']] += 1
+            if names[symbol['name']] > 1:
+                symbol['name'] = "{} (line {})".format(symbol['name'], symbol['start_line'])
+            symbol['tokens'] = self.count_tokens(''.join(lines[symbol['start_line'] - 1:symbol['end_line']]))
+            symbol['signature_tokens'] = self.count_tokens(''.join(lines[symbol['start_line'] - 1:symbol['signature_end']]))
+
+        analysis = {'hash': file_hash, 'language': language, 'imports': imports, 'symbols': symbols,
+                    'tokens': self.count_tokens(text)}
+        self.save(file_hash, analysis)
+        return analysis
+
+    @staticmethod
+    def get_ellipsis(line):
+        # the body of a removed function, indented under its header
+        indent = line[:len(line) - len(line.lstrip())]
+        return indent + "    ...\n"
+
+    def build(self, text, analysis, selected, keep_signatures=True):
+        '''
+        return the example that keeps the imports and the selected symbols,
+        the other functions and classes are reduced to their signatures if keep_signatures is set
+        '''
+        lines = text.splitlines(keepends=True)
+        # a line without the line end breaks the next part
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        selected = set(selected)
+        # the imports are sent together at the beginning
+        parts = [''.join(''.join(lines[start - 1:end]) for start, end in analysis['imports'])]
+
+        def get_lines(start, end):
+            # the blank lines at the end of a signature are removed
+            while end > start and not lines[end - 1].strip():
+                end -= 1
+            return ''.join(lines[start - 1:end])
+
+        def get_signature(symbol):
+            text = get_lines(symbol['start_line'], symbol['signature_end'])
+            if symbol['signature_end'] < symbol['end_line']:
+                text += self.get_ellipsis(lines[symbol['start_line'] - 1])
+            return text
+
+        methods = collections.defaultdict(list)
+        for symbol in analysis['symbols']:
+            if symbol['parent']:
+                methods[symbol['parent']].append(symbol)
+
+        for symbol in analysis['symbols']:
+            if symbol['parent']:
+                continue
+            if symbol['name'] in selected:
+                parts.append(get_lines(symbol['start_line'], symbol['end_line']))
+            elif symbol['kind'] == 'class':
+                chosen_methods = [method for method in methods[symbol['name']] if method['name'] in selected]
+                if not chosen_methods and not keep_signatures:
+                    continue
+                part = get_lines(symbol['start_line'], symbol['signature_end'])
+                for method in methods[symbol['name']]:
+                    if method['name'] in selected:
+                        part += get_lines(method['start_line'], method['end_line'])
+                    elif keep_signatures:
+                        part += get_signature(method)
+                parts.append(part)
+            elif symbol['kind'] == 'function' and keep_signatures:
+                parts.append(get_signature(symbol))
+        return '\n'.join(part.rstrip('\n') + '\n' for part in parts if part.strip())
+
+    def get_units(self, analysis):
+        # the symbols that can be chosen, a class with methods is chosen by its methods
+        parents = set(symbol['parent'] for symbol in analysis['symbols'] if symbol['parent'])
+        return [symbol for symbol in analysis['symbols'] if symbol['name'] not in parents]
+
+    def select(self, text, analysis, prompts, budget, keep_signatures=True):
+        '''
+        choose the symbols most relevant to the prompts, the built example is within the token budget
+        '''
+        packer = example_packer.ExamplePacker()
+        prompt_words = collections.Counter()
+        for prompt in prompts or []:
+            prompt_words.update(packer.get_words(prompt.get('system', '')))
+            prompt_words.update(packer.get_words(prompt.get('content', '')))
+
+        lines = text.splitlines(keepends=True)
+        units = self.get_units(analysis)
+        scored = []
+        for symbol in units:
+            words = packer.get_words(symbol['name']) + packer.get_words(''.join(lines[symbol['start_line'] - 1:symbol['end_line']]))
+            scored.append((packer.cosine(words, prompt_words), symbol))
+        scored.sort(key=lambda item: -item[0])
+
+        # the imports and the signatures are always sent, every chosen symbol adds its body
+        used = self.count_tokens(self.build(text, analysis, (), keep_signatures))
+        selected = set()
+        for relevance, symbol in scored:
+            if relevance < self.MIN_RELEVANCE:
+                break
+            cost = symbol['tokens'] - (symbol['signature_tokens'] if keep_signatures and symbol['kind'] != 'block' else 0)
+            if used + cost > budget:
+                continue
+            selected.add(symbol['name'])
+            used += cost
+        return selected
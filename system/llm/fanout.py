@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Purpose: send the same examples and prompts to several (supply, model) pairs at the same time
+#   every target runs in its own thread, its reply is streamed to the callback with the index of the target,
+#   and the latency, tokens and cost of every target are collected so they can be compared side by side
+
+import threading
+import time
+
+from system.llm import llm_interface
+
+
+class FanOutRequest(object):
+    '''
+    FanOutRequest runs one request against several models concurrently
+
+    callback is called as callback(index, text, reason) for every piece of the reply of targets[index]
+    complete_callback is called as complete_callback(index, stats) when targets[index] is completed
+    all the callbacks are called in the worker threads
+    '''
+
+    def __init__(self, manager, targets, examples, prompts, temperature=0.0, callback=None, complete_callback=None):
+        super().__init__()
+        self.manager = manager
+        self.targets = list(targets)
+        self.examples = examples
+        self.prompts = prompts
+        self.temperature = temperature
+        self.callback = callback
+        self.complete_callback = complete_callback
+
+        self.threads = []
+        self.requests = []
+        self.stats = [None] * len(self.targets)
+        self.mutex = threading.Lock()
+        self.completed_event = threading.Event()
+        self.remain = len(self.targets)
+
+    def start(self):
+        if not self.targets:
+            self.completed_event.set()
+            return self
+
+        for index in range(len(self.targets)):
+            thread = threading.Thread(target=self.run_target, args=(index,), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+        return self
+
+    def cancel(self):
+        for request in list(self.requests):
+            request.cancel()
+
+    def wait(self, timeout=None):
+        return self.completed_event.wait(timeout)
+
+    def get_stats(self):
+        return list(self.stats)
+
+    def run_target(self, index):
+        supply, model = self.targets[index]
+        stats = {
+            'supply': supply,
+            'model': model,
+            'latency': 0.0,
+            'first_token_latency': None,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'cost': 0.0,
+            'error': '',
+        }
+        chunks = []
+        begin = time.perf_counter()
+
+        def on_reply(text, reason=None):
+            # empty text means the request is completed, it's handled after the blocking request returns
+            if not text:
+                return
+            if stats['first_token_latency'] is None:
+                stats['first_token_latency'] = time.perf_counter() - begin
+            if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                chunks.clear()
+            if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                stats['error'] = text
+            else:
+                chunks.append(text)
+            if self.callback:
+                self.callback(index, text, reason)
+
+        try:
+            estimate = self.manager.call_llm(supply, "InterfaceGetEstimateCost", model=model, examples=self.examples, prompts=self.prompts)
+            if estimate:
+                stats['prompt_tokens'] = estimate[0]
+
+            # the request is queued in the scheduler of the manager, it keeps the supply within its quota,
+            # the models are compared by their real latency and cost, the cached reply is never used
+            request = self.manager.call_llm(supply, "InterfaceChatRequest", model=model, temperature=self.temperature,
+                                            examples=self.examples, prompts=self.prompts, new_chat=True, use_cache=False,
+                                            callback=on_reply)
+            if request is None:
+                stats['error'] = "Cannot find valid api supply name {}".format(supply)
+            else:
+                self.requests.append(request)
+                request.wait()
+
+            response = ''.join(chunks)
+            stats['completion_tokens'] = self.manager.call_llm(supply, "InterfaceCountTokens", response, model) or 0
+            prompt_price, complete_price = self.manager.call_llm(supply, "InterfaceGetPrice", model) or (0, 0)
+            stats['cost'] = (stats['prompt_tokens'] * prompt_price + stats['completion_tokens'] * complete_price) / 1000
+        except Exception as e:
+            # one failed model should not break the others
+            stats['error'] = str(e)
+
+        stats['latency'] = time.perf_counter() - begin
+        self.stats[index] = stats
+        if self.complete_callback:
+            self.complete_callback(index, stats)
+
+        self.mutex.acquire()
+        self.remain -= 1
+        if self.remain == 0:
+            self.completed_event.set()
+        self.mutex.release()
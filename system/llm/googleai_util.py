@@ -3,14 +3,21 @@
 #   a class to access google's aigc api
 
 from system.llm import llm_interface
+from system.llm import token_counter
 import google.generativeai as palm
 import threading
+import time
 
 class GoogleAIUtil(llm_interface.LLMInterface):
 
-    def __init__(self, palm_api_key):
+    def __init__(self, palm_api_key, model_cache=None, models_callback=None, usage_recorder=None):
         super().__init__()
         self.palm_api_key = palm_api_key
+        # model_cache is a ModelCatalogCache, models_callback is called when the model list is updated
+        self.model_cache = model_cache
+        self.models_callback = models_callback
+        # usage_recorder(supply, model, status, prompt_tokens, completion_tokens, latency) records the embeddings
+        self.usage_recorder = usage_recorder
 
         self.update_palm_api_key()
 
@@ -21,7 +28,7 @@ class GoogleAIUtil(llm_interface.LLMInterface):
         self.generate_message_models = []
         self.model_name_list = []
         self.chat_request_thread = None
-        self.reply = None
+        self.request_name_thread = None
         self._get_valid_models()
     
     def update_palm_api_key(self):
@@ -42,18 +49,43 @@ class GoogleAIUtil(llm_interface.LLMInterface):
 
         self.model_init = True
 
+        # serve the cached models immediately, and revalidate them in a thread when they are stale
+        if self.model_cache:
+            cached_models, is_fresh = self.model_cache.InterfaceGetModels(self.InterfaceGetSupplyName(), self.palm_api_key)
+            if cached_models:
+                self._set_models(cached_models)
+                if not is_fresh:
+                    self.request_name_thread = threading.Thread(target=self._fetch_models, daemon=True)
+                    self.request_name_thread.start()
+                return
+
+        # without cache, we have to wait for the models, otherwise the supply is not valid
+        self._fetch_models()
+
+    def _fetch_models(self):
         try:
             # there maybe some errors when we fetching the model
             # for example, the api cannot be accessed outside the US
             model_list = palm.list_models()
+            # only keep the information we need, so it can be saved to the cache
+            models = [{'name': model.name, 'methods': list(model.supported_generation_methods)} for model in model_list]
         except Exception as e:
             return
-        self.model_list = model_list
+
+        if self.model_cache:
+            self.model_cache.InterfaceSaveModels(self.InterfaceGetSupplyName(), self.palm_api_key, models)
+        self._set_models(models)
+
+    def _set_models(self, models):
+        self.model_list = models
         # save the models name to self.model_name_list
-        self.generate_text_models= [model.name for model in self.model_list if 'generateText' in model.supported_generation_methods]
-        self.embedding_models = [model.name for model in self.model_list if 'embedText' in model.supported_generation_methods]
-        self.generate_message_models = [model.name for model in self.model_list if 'generateMessage' in model.supported_generation_methods]
-        self.model_name_list = [model.name for model in self.model_list]
+        self.generate_text_models= [model['name'] for model in models if 'generateText' in model['methods']]
+        self.embedding_models = [model['name'] for model in models if 'embedText' in model['methods']]
+        self.generate_message_models = [model['name'] for model in models if 'generateMessage' in model['methods']]
+        self.model_name_list = [model['name'] for model in models]
+
+        if self.models_callback:
+            self.models_callback(self.InterfaceGetSupplyName())
 
     def InterfaceGetAllModelNames(self):
         # get the models name
@@ -78,8 +110,56 @@ class GoogleAIUtil(llm_interface.LLMInterface):
     def __del__(self):
         self.chat_request_thread = None
 
+    # dollars per 1000 tokens, [prompt, completion]
+    # the PaLM API is free of charge in its public preview, so the usage is recorded with its tokens but costs $0
+    PRICES = {
+        'models/chat-bison-001': [0.0, 0.0],
+        'models/text-bison-001': [0.0, 0.0],
+        'models/embedding-gecko-001': [0.0, 0.0],
+    }
+
+    def InterfaceGetPrice(self, model):
+        if model not in self.PRICES:
+            return 0.0, 0.0
+        return self.PRICES[model][0], self.PRICES[model][1]
+
+    def InterfaceCountTokens(self, text, model):
+        # palm counts the tokens by a request, it's approximated by the openai encoding locally,
+        # so the requests are not doubled and it can be called in the GUI thread
+        return token_counter.TokenCounter().InterfaceCountText(text, model)
+
     def InterfaceGetEstimateCost(self, **kwargs):
-        return 0, 0, 0
+        model = kwargs.get('model', '')
+        prompts = kwargs.get('prompts', [])
+        examples = kwargs.get('examples', [])
+
+        # every example and prompt is sent as one message, the context is sent with them
+        texts = [self._getContext(prompts)] if prompts else []
+        texts.extend((example['desc'] or '') + example['content'] for example in examples or [])
+        texts.extend(prompt['content'] for prompt in prompts or [])
+        estimate_token = sum(self.InterfaceCountTokens(text, model) for text in texts)
+
+        prompt_cost, complete_cost = self.InterfaceGetPrice(model)
+        return estimate_token, estimate_token * prompt_cost / 1000, estimate_token * complete_cost / 1000
+
+    def InterfaceEmbeddingRequest(self, **kwargs):
+        '''
+        return the embedding vectors of the texts in the same order, it runs in current thread
+        '''
+        texts = kwargs.get('texts', [])
+        model = kwargs.get('model', None)
+        if not model:
+            model = self.embedding_models[0] if self.embedding_models else 'models/embedding-gecko-001'
+
+        # palm embeds one text every request
+        embeddings = []
+        for text in texts:
+            begin = time.perf_counter()
+            embeddings.append(palm.generate_embeddings(model=model, text=text)['embedding'])
+            if self.usage_recorder:
+                self.usage_recorder(self.InterfaceGetSupplyName(), model, 'embedding', self.InterfaceCountTokens(text, model), 0,
+                                    time.perf_counter() - begin)
+        return embeddings
 
     def make_ordinal(self, n):
         n = int(n)
@@ -90,6 +170,21 @@ class GoogleAIUtil(llm_interface.LLMInterface):
         return str(n) + suffix
 
     def InterfaceChatRequest(self, **kwargs):
+        callback = kwargs.get('callback', None)
+
+        # if chat is running, wait for it
+        if self.chat_request_thread and self.chat_request_thread.is_alive():
+            if callback:
+                callback("Chat is running, please wait.", self.ReasonCode.FAILED)
+            return
+
+        self.chat_request_thread = threading.Thread(target=self.InterfaceChatRequestBlocking, kwargs=kwargs)
+        self.chat_request_thread.start()
+
+    def InterfaceChatRequestBlocking(self, **kwargs):
+        '''
+        send the request and send the replies to the callback in current thread
+        '''
         # there are many parameters in the request, we need to check them
         # if some parameters are not set, we need to set them
         model_name = kwargs.get('model', '')  # Google Palm doesn't need model when access the chat api
@@ -98,12 +193,8 @@ class GoogleAIUtil(llm_interface.LLMInterface):
         examples = kwargs.get('examples', [])
         callback = kwargs.get('callback', None)
         new_chat = kwargs.get('new_chat', True)
-
-        # if chat is running, wait for it
-        if self.chat_request_thread and self.chat_request_thread.is_alive():
-            if callback:
-                callback("Chat is running, please wait.", self.ReasonCode.FAILED)
-            return
+        # the session keeps the messages of the conversation, palm is stateless, they are sent with the new message
+        session = kwargs.get('session', None)
 
         if not prompts:
             if callback:
@@ -112,49 +203,62 @@ class GoogleAIUtil(llm_interface.LLMInterface):
 
         # if starts new conversation, clear the reply, and find the last prompt
         context = self._getContext(prompts)
-        model = palm.get_model(model_name)
 
-        if new_chat:
-            self.reply = None
+        handle = None
+        if not new_chat and session is not None:
+            handle = session.get_handle(self.InterfaceGetSupplyName())
+        if handle is None:
+            # the conversation is unknown, for example it's continued by another supply, start it again
+            messages = []
         else:
+            messages = handle['messages']
             examples = []
             prompt = prompts[-1]
             prompts = [prompt]
 
-        def get_response(self, model, context, temperature, examples, prompts, callback):
-            index = 1
-
-            for example in examples:
-                order = self.make_ordinal(index)
-
-                if example['desc']:
-                    message = '''This is {} example, the description is: {}, the example is: """{}""", please read it.'''.format(order, example['desc'], example["content"])
-                else:
-                    message = '''This is {} example, please read it: '''.format(order) + example["content"]
-                index += 1
-
-                if self.reply:
-                    self.reply.reply(message)
-                else:
-                    self.reply = palm.chat(context=context, messages=message, temperature=temperature)
-                callback(self.reply.last, self.ReasonCode.NEW_REPLY) # type: ignore
-            
-            for prompt in prompts:
-                message = prompt["content"] # type: ignore
-                if self.reply:
-                    self.reply = self.reply.reply(message)
-                else:
-                    self.reply = palm.chat(context=context, messages=message, temperature=temperature)
-
-                if self.reply.last is None:
-                    callback("Sorry, I can't understand you. The reply is None.", self.ReasonCode.FAILED)
-                else:
-                    callback(self.reply.last, self.ReasonCode.NEW_REPLY) # type: ignore
-
-            callback("") # type: ignore
-
-        self.chat_request_thread = threading.Thread(target=get_response, args=(self, model, context, temperature, examples, prompts, callback))
-        self.chat_request_thread.start()
+        try:
+            model = palm.get_model(model_name)
+            # the reply is kept locally, so the requests running at the same time don't break each other
+            reply = self.get_response(messages, model, context, temperature, examples, prompts, callback)
+        except Exception as e:
+            callback("Google request failed: {}".format(e), self.ReasonCode.FAILED)
+        else:
+            if session is not None and reply is not None:
+                session.set_handle(self.InterfaceGetSupplyName(), {'messages': [message['content'] for message in reply.messages]})
+        callback("") # type: ignore
+
+    def send_message(self, reply, messages, context, temperature, message):
+        if reply:
+            return reply.reply(message)
+        # the authors of the messages are alternated by palm
+        return palm.chat(context=context, messages=messages + [message], temperature=temperature)
+
+    def get_response(self, messages, model, context, temperature, examples, prompts, callback):
+        index = 1
+        reply = None
+
+        for example in examples:
+            order = self.make_ordinal(index)
+
+            if example['desc']:
+                message = '''This is {} example, the description is: {}, the example is: """{}""", please read it.'''.format(order, example['desc'], example["content"])
+            else:
+                message = '''This is {} example, please read it: '''.format(order) + example["content"]
+            index += 1
+
+            reply = self.send_message(reply, messages, context, temperature, message)
+            callback(reply.last, self.ReasonCode.NEW_REPLY) # type: ignore
+        
+        for prompt in prompts:
+            message = prompt["content"] # type: ignore
+            reply = self.send_message(reply, messages, context, temperature, message)
+
+            if reply.last is None:
+                callback("Sorry, I can't understand you. The reply is None.", self.ReasonCode.FAILED)
+            else:
+                callback(reply.last, self.ReasonCode.NEW_REPLY) # type: ignore
+
+        return reply
 
     def _getContext(self, prompts):
         for prompt in prompts:
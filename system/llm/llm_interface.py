@@ -7,6 +7,8 @@ class LLMInterface(object):
         SUCCESS = 0
         FAILED = 1
         NEW_REPLY = 2
+        # the text should be appended to the current reply
+        APPEND = 3
 
     def __init__(self):
         pass
@@ -20,11 +22,35 @@ class LLMInterface(object):
     def InterfaceChatRequest(self, **kwargs):
         raise NotImplementedError
 
+    def InterfaceChatRequestBlocking(self, **kwargs):
+        # the same as InterfaceChatRequest, but runs in current thread and returns when the request is completed
+        raise NotImplementedError
+
     def InterfaceEmbeddingRequest(self, **kwargs):
         raise NotImplementedError
 
     def InterfaceGetEstimateCost(self, **kwargs):
         raise NotImplementedError
 
+    def InterfaceGetContextReport(self, **kwargs):
+        # how the messages are fitted into the context window, None if the interface doesn't trim the context
+        return None
+
+    def InterfaceGetPrice(self, model):
+        # dollars per 1000 tokens, (prompt, completion)
+        return 0, 0
+
+    def InterfaceCountTokens(self, text, model):
+        return 0
+
+    def InterfaceGetMaxCandidates(self, model):
+        # how many candidates one request can return, see the candidates argument of the chat request,
+        # 1 means the candidates are requested by parallel requests
+        return 1
+
     def InterfaceIsValid(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def InterfaceShutdown(self):
+        # called when the interface is replaced, stop the threads or connections it holds
+        pass
\ No newline at end of file
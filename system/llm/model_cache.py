@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Purpose: cache the model catalog of every llm provider on disk
+#   listing the models needs to access the internet, it's slow and the result rarely changes,
+#   so we save it next to config.json and serve it immediately at startup,
+#   the providers revalidate it in the background when it is older than the ttl
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ModelCatalogCache(object):
+    '''
+    ModelCatalogCache is a singleton class, it saves the model catalog per provider and per api key
+    '''
+    _instance = None
+
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, cache_file, ttl=DEFAULT_TTL):
+        super().__init__()
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.mutex = threading.Lock()
+        self.catalog = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            # a broken cache file is the same as no cache
+            return
+
+        if isinstance(catalog, dict):
+            self.catalog = catalog
+
+    def save(self):
+        # write to a temporary file first, so a crash never leaves a half written cache
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.catalog, f, ensure_ascii=False, indent=4)
+        os.replace(temp_file, self.cache_file)
+
+    def set_ttl(self, ttl):
+        self.ttl = ttl
+
+    @staticmethod
+    def fingerprint(api_key):
+        '''
+        never save the api key itself, only a short hash of it
+        '''
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def _entry_key(self, provider, api_key):
+        return '{}:{}'.format(provider, self.fingerprint(api_key))
+
+    def get(self, provider, api_key):
+        '''
+        return (models, is_fresh), models is None if there is no cache
+        '''
+        if not api_key:
+            return None, False
+
+        self.mutex.acquire()
+        entry = self.catalog.get(self._entry_key(provider, api_key))
+        self.mutex.release()
+
+        if not entry:
+            return None, False
+
+        is_fresh = time.time() - entry.get('time', 0) < self.ttl
+        return entry.get('models'), is_fresh
+
+    def put(self, provider, api_key, models):
+        if not api_key:
+            return
+
+        self.mutex.acquire()
+        self.catalog[self._entry_key(provider, api_key)] = {
+            'time': time.time(),
+            'models': models,
+        }
+        try:
+            self.save()
+        except OSError as e:
+            print("Save model catalog cache failed: {}".format(e))
+        self.mutex.release()
+
+    def InterfaceGetModels(self, provider, api_key):
+        return self.get(provider, api_key)
+
+    def InterfaceSaveModels(self, provider, api_key, models):
+        return self.put(provider, api_key, models)
@@ -3,14 +3,27 @@
 #   a class to access openai's api
 
 from system.llm import llm_interface
+from system.llm import token_counter
 import openai
 import threading
+import time
 
 
 class OpenAIUtil(llm_interface.LLMInterface):
-    def __init__(self, openai_key):
+    # the n parameter of a chat request
+    MAX_CANDIDATES = 8
+
+    def __init__(self, openai_key, model_cache=None, models_callback=None, context_budget=None, usage_recorder=None):
         super().__init__()
         self.open_ai_key = openai_key
+        # model_cache is a ModelCatalogCache, models_callback is called when the model list is updated
+        self.model_cache = model_cache
+        self.models_callback = models_callback
+        # context_budget is a ContextBudget, it fits the messages into the context window of the model
+        self.context_budget = context_budget
+        # usage_recorder(supply, model, status, prompt_tokens, completion_tokens, latency) records the requests
+        # that are not chat requests, like the summaries and the embeddings
+        self.usage_recorder = usage_recorder
 
         self.request_name_thread = None
         self.request_chat_thread = None
@@ -33,6 +46,10 @@ class OpenAIUtil(llm_interface.LLMInterface):
     def InterfaceGetSupplyName(self):
         return "OpenAI"
 
+    def InterfaceGetMaxCandidates(self, model):
+        # the choices of one request share the prompt tokens
+        return self.MAX_CANDIDATES
+
     def _get_valid_models(self):
         # if we have got the models, we don't need to get them again
         if self.model_init:
@@ -40,6 +57,14 @@ class OpenAIUtil(llm_interface.LLMInterface):
 
         self.model_init = True
 
+        # serve the cached models immediately, and only revalidate them when they are stale
+        if self.model_cache:
+            cached_models, is_fresh = self.model_cache.InterfaceGetModels(self.InterfaceGetSupplyName(), self.open_ai_key)
+            if cached_models:
+                self._set_model_names(cached_models)
+                if is_fresh:
+                    return
+
         # get the valid models from openai
         # because the access of internet is slow, so we use a thread to get the models
         # and we use a signal to notify the main thread that the models are ready
@@ -49,20 +74,29 @@ class OpenAIUtil(llm_interface.LLMInterface):
                 model_list = openai.Engine.list()
             except Exception as e:
                 return
-            self.mutex.acquire()
-            self.model_list = model_list
-            # save the models name to self.model_name_list
-            self.model_name_list = [model['id'] for model in model_list['data']] # type: ignore
-            # put the 'gpt-3.5-turbo' the first element in the list
-            if 'gpt-3.5-turbo' in self.model_name_list:
-                self.model_name_list.remove('gpt-3.5-turbo')
-                self.model_name_list.insert(0, 'gpt-3.5-turbo')
-            self.mutex.release()
+            model_names = [model['id'] for model in model_list['data']] # type: ignore
+            if self.model_cache:
+                self.model_cache.InterfaceSaveModels(self.InterfaceGetSupplyName(), self.open_ai_key, model_names)
+            self._set_model_names(model_names)
         
         # start a thread to get the models
-        self.request_name_thread = threading.Thread(target=get_models, args=(self,))
+        self.request_name_thread = threading.Thread(target=get_models, args=(self,), daemon=True)
         self.request_name_thread.start()
 
+    def _set_model_names(self, model_names):
+        self.mutex.acquire()
+        self.model_list = model_names
+        # save the models name to self.model_name_list
+        self.model_name_list = list(model_names)
+        # put the 'gpt-3.5-turbo' the first element in the list
+        if 'gpt-3.5-turbo' in self.model_name_list:
+            self.model_name_list.remove('gpt-3.5-turbo')
+            self.model_name_list.insert(0, 'gpt-3.5-turbo')
+        self.mutex.release()
+
+        if self.models_callback:
+            self.models_callback(self.InterfaceGetSupplyName())
+
     def InterfaceGetAllModelNames(self):
         # get the models name
         # if the model list is empty, we need to get the models first
@@ -84,6 +118,22 @@ class OpenAIUtil(llm_interface.LLMInterface):
         self.model_init = False
 
     def InterfaceChatRequest(self, **kwargs):
+        callback = kwargs.get('callback', None)
+
+        if self.request_chat_thread and self.request_chat_thread.is_alive():
+            if callback is not None:
+                callback("The previous request is not completed, please wait.")
+                callback("")
+
+        # use the stream to get the response
+        # we cannot occupy the main thread for a long time, otherwise the gui or other logic which requires the main thread will be blocked
+        self.request_chat_thread = threading.Thread(target=self.InterfaceChatRequestBlocking, kwargs=kwargs)
+        self.request_chat_thread.start()
+
+    def InterfaceChatRequestBlocking(self, **kwargs):
+        '''
+        send the request and stream the response to the callback in current thread
+        '''
         # there are many parameters in the request, we need to check them
         # if some parameters are not set, we need to set them
         model = kwargs.get('model', 'gpt-3.5-turbo')
@@ -91,11 +141,12 @@ class OpenAIUtil(llm_interface.LLMInterface):
         prompts = kwargs.get('prompts', '')
         examples = kwargs.get('examples', [])
         callback = kwargs.get('callback', None)
-
-        if self.request_chat_thread and self.request_chat_thread.is_alive():
-            if callback is not None:
-                callback("The previous request is not completed, please wait.")
-                callback("")
+        # set by the request scheduler when the request is cancelled
+        cancel_event = kwargs.get('cancel_event', None)
+        # several replies of the same request, the callback gets the pieces of all of them,
+        # candidate_callback(index, text) tells which reply a piece belongs to
+        candidates = min(max(kwargs.get('candidates', 1), 1), self.MAX_CANDIDATES)
+        candidate_callback = kwargs.get('candidate_callback', None)
 
         if not prompts:
             if callback:
@@ -103,46 +154,76 @@ class OpenAIUtil(llm_interface.LLMInterface):
                 callback("")
             return None
 
-        messages = self._build_message(prompts, examples)
+        try:
+            messages, report = self._build_budget_message(prompts, examples, model, summarize=True)
+            if report['saved'] > 0:
+                print("context of {}: {} tokens are saved, {} messages dropped, {} truncated, summarized: {}".format(
+                    model, report['saved'], report['dropped'], report['truncated'], report['summarized']))
+            if report['overflow'] > 0:
+                # the examples and the prompt alone are over the budget, the request would fail or be cut off
+                if callback:
+                    callback("The examples and the prompt are {} tokens over the context budget {} of {}, remove some examples or shorten the prompt.".format(
+                        report['overflow'], report['budget'], model), self.ReasonCode.FAILED)
+                    callback("")
+                return None
+            self.get_response(model, temperature, messages, callback, cancel_event, kwargs.get('usage_callback', None),
+                              candidates, candidate_callback)
+        except Exception as e:
+            # the request must be completed, otherwise the caller waits forever
+            if callback:
+                callback("OpenAI request failed: {}".format(e), self.ReasonCode.FAILED)
+                callback("")
 
-        # use the stream to get the response
-        # we cannot occupy the main thread for a long time, otherwise the gui or other logic which requires the main thread will be blocked
-        def get_response(self, model, temperature, message, callback):
-            response = openai.ChatCompletion.create(
-                model = model,
-                temperature = temperature,
-                stream = True,
-                messages = message,
-                # top_p = 1,
-                # n = 1,
-                # max_tokens = 4096,
-                # presence_penalty = 0,
-                # frequency_penalty = 0,
-            )
-
-            for chunk in response:
-                if 'usage' in chunk:
-                    print ('usage is :', chunk['usage']) # type: ignore
-                # if the response is completed, we need to notify the main thread
-                if chunk['choices'][0]['finish_reason'] in ['stop', 'max_tokens', 'timeout', 'length', 'api_call_error']: # type: ignore
-                    print("response completed, the result is :{}".format(chunk['choices'][0]['finish_reason'])) # type: ignore
-                    callback('')
-                    return
+    def get_response(self, model, temperature, message, callback, cancel_event=None, usage_callback=None, n=1, candidate_callback=None):
+        response = openai.ChatCompletion.create(
+            model = model,
+            temperature = temperature,
+            stream = True,
+            messages = message,
+            n = n,
+            # top_p = 1,
+            # max_tokens = 4096,
+            # presence_penalty = 0,
+            # frequency_penalty = 0,
+        )
+
+        # the indexes of the completed choices, the response is completed when all the n choices are completed
+        finished = set()
+        for chunk in response:
+            # stop reading the stream, the request is cancelled
+            if cancel_event is not None and cancel_event.is_set():
+                response.close() # type: ignore
+                return
+
+            # the tokens counted by openai, the usage ledger records them instead of the estimate
+            if chunk.get('usage') and usage_callback: # type: ignore
+                usage_callback(dict(chunk['usage'])) # type: ignore
+
+            for choice in chunk['choices']: # type: ignore
+                index = choice.get('index', 0)
+                # if the choice is completed, we need to notify the main thread when all the choices are completed
+                if choice['finish_reason'] in ['stop', 'max_tokens', 'timeout', 'length', 'api_call_error']:
+                    print("response {} completed, the result is :{}".format(index, choice['finish_reason']))
+                    finished.add(index)
+                    continue
 
-                chunk_message = chunk['choices'][0]['delta'].get('content', '') # type: ignore
+                chunk_message = choice['delta'].get('content', '')
 
                 # if the chunk is empty, we need to continue
                 if not chunk_message:
                     continue
 
+                if candidate_callback:
+                    candidate_callback(index, chunk_message)
                 if callback:
                     callback(chunk_message)
                 else:
                     print(chunk_message)
 
-        # start a thread to get the response
-        self.request_chat_thread = threading.Thread(target=get_response, args=(self, model, temperature, messages, callback))
-        self.request_chat_thread.start()
+            if len(finished) >= n:
+                if callback:
+                    callback('')
+                return
 
     # when delete the object, we need to stop all the threads
     def __del__(self):
@@ -193,67 +274,105 @@ class OpenAIUtil(llm_interface.LLMInterface):
                 messages.append({'role': 'assistant', 'content': prompt['response']}) # type: ignore
         return messages
 
+    def _build_budget_message(self, prompts, examples, model, summarize=False):
+        '''
+        build the messages, and fit them into the context budget of the model
+        return (messages, report), see ContextBudget.fit
+        '''
+        messages = self._build_message(prompts, examples)
+        if self.context_budget is None:
+            tokens = self.count_token(messages, model)
+            return messages, {'budget': 0, 'original': tokens, 'sent': tokens, 'saved': 0,
+                              'dropped': 0, 'truncated': 0, 'summarized': False, 'overflow': 0}
+
+        # the system message and the examples are pinned
+        pinned = 1 + sum(2 if example['response'] else 1 for example in examples or [])
+        summarizer = (lambda old_messages, max_tokens: self.summarize_messages(model, old_messages, max_tokens)) if summarize else None
+        return self.context_budget.fit(messages, model, pinned, summarizer)
+
+    def summarize_messages(self, model, messages, max_tokens):
+        '''
+        summarize the old turns of the conversation, it runs in current thread
+        '''
+        request = list(messages) + [{'role': 'user', 'content': "Summarize our conversation above briefly, keep the code names and decisions."}]
+        begin = time.perf_counter()
+        try:
+            response = openai.ChatCompletion.create(model=model, temperature=0.0, messages=request, max_tokens=max_tokens)
+        except Exception as e:
+            print("Summarize the conversation failed: {}".format(e))
+            # it's not a failed chat request, the failed summary costs nothing
+            self.record_usage(model, 'summary', 0, 0, time.perf_counter() - begin)
+            return None
+        usage = response.get('usage') or {} # type: ignore
+        self.record_usage(model, 'summary', usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), time.perf_counter() - begin)
+        return response['choices'][0]['message']['content'] # type: ignore
+
+    def record_usage(self, model, status, prompt_tokens, completion_tokens, latency):
+        if self.usage_recorder:
+            self.usage_recorder(self.InterfaceGetSupplyName(), model, status, prompt_tokens, completion_tokens, latency)
+
+    def InterfaceGetContextReport(self, **kwargs):
+        '''
+        return how the messages of the request are fitted into the context window, without summarizing
+        '''
+        model = kwargs.get('model', 'gpt-3.5-turbo')
+        _, report = self._build_budget_message(kwargs.get('prompts', []), kwargs.get('examples', []), model)
+        return report
+
+    EMBEDDING_MODEL = 'text-embedding-ada-002'
+
+    def InterfaceEmbeddingRequest(self, **kwargs):
+        '''
+        return the embedding vectors of the texts in the same order, it runs in current thread
+        '''
+        texts = kwargs.get('texts', [])
+        model = kwargs.get('model', None) or self.EMBEDDING_MODEL
+        if not texts:
+            return []
+
+        # all the texts are sent in one request
+        begin = time.perf_counter()
+        response = openai.Embedding.create(model=model, input=list(texts))
+        usage = response.get('usage') or {} # type: ignore
+        self.record_usage(model, 'embedding', usage.get('prompt_tokens', 0), 0, time.perf_counter() - begin)
+        data = sorted(response['data'], key=lambda item: item['index']) # type: ignore
+        return [item['embedding'] for item in data]
+
+    # dollars per 1000 tokens, (prompt, completion)
+    PRICES = {
+        'gpt-3.5-turbo': [0.002, 0.002],
+        'text-davinci-003': [0.002, 0.002],
+        'text-davinci-002': [0.002, 0.002],
+        'code-davinci-002': [0.002, 0.002],
+        'gpt-4': [0.03, 0.06],
+        'gpt-4-0314': [0.03, 0.06], 
+        'gpt-4-32k': [0.06, 0.12],
+        'gpt-4-32k-0314': [0.06, 0.12],
+        'text-embedding-ada-002': [0.0001, 0.0],
+    }
+
+    def InterfaceGetPrice(self, model):
+        if model not in self.PRICES:
+            return 0.002, 0.002
+        return self.PRICES[model][0], self.PRICES[model][1]
+
+    def InterfaceCountTokens(self, text, model):
+        return token_counter.TokenCounter().InterfaceCountText(text, model)
+
     def InterfaceGetEstimateCost(self, **kwargs):
         model = kwargs.get('model', 'gpt-3.5-turbo')
         prompts = kwargs.get('prompts', '')
         examples = kwargs.get('examples', [])
 
-        messages = self._build_message(prompts, examples)
-        estimate_token = self.count_token(messages, model)
-
-        price_dict = {
-            'gpt-3.5-turbo': [0.002, 0.002],
-            'text-davinci-003': [0.002, 0.002],
-            'text-davinci-002': [0.002, 0.002],
-            'code-davinci-002': [0.002, 0.002],
-            'gpt-4': [0.03, 0.06],
-            'gpt-4-0314': [0.03, 0.06], 
-            'gpt-4-32k': [0.06, 0.12],
-            'gpt-4-32k-0314': [0.06, 0.12],
-        }
-
-        prompt_cost = 0
-        complete_cost = 0
-
-        if model not in price_dict:
-            prompt_cost = 0.002
-            complete_cost = 0.002
-        else:
-            prompt_cost = price_dict[model][0]
-            complete_cost = price_dict[model][1]
+        # the messages that are really sent, the old turns may be dropped to fit the context window
+        _, report = self._build_budget_message(prompts, examples, model)
+        estimate_token = report['sent']
+
+        prompt_cost, complete_cost = self.InterfaceGetPrice(model)
 
         return estimate_token, estimate_token * prompt_cost / 1000, estimate_token * complete_cost / 1000
 
     def count_token(self, messages, model) -> int:
-        import tiktoken
         """Returns the number of tokens used by a list of messages."""
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            print("Warning: model not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
-
-        if model == "gpt-3.5-turbo":
-            # print("Warning: gpt-3.5-turbo may change over time. Returning num tokens assuming gpt-3.5-turbo-0301.")
-            return self.count_token(messages, model="gpt-3.5-turbo-0301")
-        elif model == "gpt-4" or model == "gpt-4-32k":
-            # print("Warning: gpt-4 may change over time. Returning num tokens assuming gpt-4-0314.")
-            return self.count_token(messages, model="gpt-4-0314")
-        elif model == "gpt-3.5-turbo-0301":
-            tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-            tokens_per_name = -1  # if there's a name, the role is omitted
-        elif model == "gpt-4-0314" or model == "gpt-4-32k-0314":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        else:
-            raise NotImplementedError(f"""count_token() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
-
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-        return num_tokens
\ No newline at end of file
+        # the encoders and the token count of unchanged messages are cached by the counter
+        return token_counter.TokenCounter().InterfaceCountMessages(messages, model)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Purpose: create the llm providers without blocking the startup
+#   the sdk of every provider is imported only when the provider is created,
+#   and the providers are created in a worker pool, because validating the key and listing the models
+#   need to access the internet
+
+from concurrent.futures import ThreadPoolExecutor
+import importlib
+import threading
+import time
+
+
+class ProviderRegistry(object):
+    '''
+    ProviderRegistry imports the llm modules lazily and creates the providers in a worker pool
+    '''
+
+    # provider: (sdk module, llm module, class name)
+    PROVIDERS = {
+        'openai_util': ('openai', 'system.llm.openai_util', 'OpenAIUtil'),
+        'googleai_util': ('google.generativeai', 'system.llm.googleai_util', 'GoogleAIUtil'),
+        'slackapp_util': ('slack_sdk', 'system.llm.slackapp_util', 'SlackAppUtil'),
+    }
+
+    def __init__(self, startup_report, max_workers=None):
+        super().__init__()
+        self.startup_report = startup_report
+        if max_workers is None:
+            max_workers = len(self.PROVIDERS)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider-init')
+        self.import_mutex = threading.Lock()
+        self.modules = {}
+        self.futures = {}
+
+    def import_module(self, module_name):
+        '''
+        import a module and record the time, the module is imported only once
+        '''
+        # import lock of python is per module, we use our own lock to avoid recording twice
+        self.import_mutex.acquire()
+        try:
+            if module_name not in self.modules:
+                with self.startup_report.measure_import(module_name):
+                    self.modules[module_name] = importlib.import_module(module_name)
+            return self.modules[module_name]
+        finally:
+            self.import_mutex.release()
+
+    def get_provider_class(self, provider):
+        sdk_module, llm_module, class_name = self.PROVIDERS[provider]
+        # import the sdk first, so its import time is recorded separately
+        self.import_module(sdk_module)
+        return getattr(self.import_module(llm_module), class_name)
+
+    def create_provider(self, provider, get_args, on_ready):
+        '''
+        create the provider in current thread
+        get_args returns (args, kwargs) of the provider class, it's called when the provider is really created,
+        so the latest settings are used
+        on_ready is called as on_ready(provider, util), util is None if the provider cannot be created
+        '''
+        begin = time.perf_counter()
+        util = None
+        try:
+            provider_class = self.get_provider_class(provider)
+            args, kwargs = get_args()
+            util = provider_class(*args, **kwargs)
+            status = 'ready' if util.InterfaceIsValid() else 'invalid'
+        except Exception as e:
+            # a provider without sdk or with a bad key should not break the others
+            status = 'failed: {}'.format(e)
+            print("Create llm provider {} failed: {}".format(provider, e))
+        self.startup_report.record_provider(provider, time.perf_counter() - begin, status)
+
+        on_ready(provider, util)
+        return util
+
+    def submit(self, provider, get_args, on_ready):
+        '''
+        create the provider in the worker pool, return a future of the provider
+        '''
+        future = self.executor.submit(self.create_provider, provider, get_args, on_ready)
+        self.futures[provider] = future
+        return future
+
+    def wait(self, timeout=None):
+        '''
+        wait until all submitted providers are created, used by the tools without gui
+        '''
+        for future in list(self.futures.values()):
+            future.result(timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
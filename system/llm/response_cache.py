@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Purpose: cache the responses of the llm by the exact request
+#   the key is the hash of (supply, model, temperature, new_chat, normalized examples and prompts),
+#   the recent responses are kept in memory, all the responses are saved on disk,
+#   the oldest used files are removed when the disk cache is bigger than its limit
+#   a cached response is replayed through the callback, the same as it is streamed by the llm
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache(object):
+    '''
+    ResponseCache is a two tiers cache of the llm responses, a LRU in memory and a directory on disk
+    a response is a list of (text, reason) that the llm sent to the callback
+    '''
+
+    def __init__(self, cache_dir, max_memory_entries=128, max_disk_bytes=256 * 1024 * 1024):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.mutex = threading.Lock()
+        self.memory = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.disk_bytes = sum(size for _, _, size in self.scan_disk())
+
+    @staticmethod
+    def normalize_text(text):
+        # the line endings and the trailing spaces don't change the meaning of the request
+        if not text:
+            return ''
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return '\n'.join(line.rstrip() for line in lines).strip()
+
+    @classmethod
+    def make_key(cls, supply, model, temperature, examples, prompts, new_chat=True):
+        '''
+        the content address of a request
+        '''
+        normalized_examples = [[cls.normalize_text(example.get(field, '')) for field in ('desc', 'content', 'response')]
+                               for example in examples or []]
+        normalized_prompts = [[cls.normalize_text(prompt.get(field, '')) for field in ('system', 'content', 'response')]
+                              for prompt in prompts or []]
+        request = [supply, model, round(float(temperature), 4), bool(new_chat), normalized_examples, normalized_prompts]
+        data = json.dumps(request, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def scan_disk(self):
+        '''
+        return [(last used time, file, size)] of all the cached files
+        '''
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                file = os.path.join(root, name)
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, file, stat.st_size))
+        return files
+
+    def get(self, key):
+        '''
+        return the chunks of the cached response, or None
+        '''
+        self.mutex.acquire()
+        try:
+            chunks = self.memory.get(key)
+            if chunks is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return chunks
+
+            file = self.get_file(key)
+            try:
+                with open(file, 'r', encoding='utf-8') as f:
+                    chunks = [tuple(chunk) for chunk in json.load(f)['chunks']]
+                # the modify time is the last used time, it decides which file is removed first
+                os.utime(file)
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+
+            self.put_memory(key, chunks)
+            self.hits += 1
+            return chunks
+        finally:
+            self.mutex.release()
+
+    def put_memory(self, key, chunks):
+        # called with the mutex acquired
+        self.memory[key] = chunks
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def put(self, key, chunks, request_info=None):
+        chunks = [tuple(chunk) for chunk in chunks]
+        self.mutex.acquire()
+        try:
+            self.put_memory(key, chunks)
+
+            file = self.get_file(key)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            old_size = os.path.getsize(file) if os.path.exists(file) else 0
+            data = {'time': time.time(), 'request': request_info or {}, 'chunks': chunks}
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            self.disk_bytes += os.path.getsize(file) - old_size
+            self.evict_disk()
+        except OSError as e:
+            print("Save response cache failed: {}".format(e))
+        finally:
+            self.mutex.release()
+
+    def evict_disk(self):
+        # called with the mutex acquired
+        if self.disk_bytes <= self.max_disk_bytes:
+            return
+
+        # remove the least recently used files until the cache is within 90% of the limit
+        target = self.max_disk_bytes * 0.9
+        for _, file, size in sorted(self.scan_disk()):
+            if self.disk_bytes <= target:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                continue
+            self.disk_bytes -= size
+            key = os.path.splitext(os.path.basename(file))[0]
+            self.memory.pop(key, None)
+
+    def set_limits(self, max_memory_entries=None, max_disk_bytes=None):
+        self.mutex.acquire()
+        if max_memory_entries is not None:
+            self.max_memory_entries = max_memory_entries
+        if max_disk_bytes is not None:
+            self.max_disk_bytes = max_disk_bytes
+        self.evict_disk()
+        self.mutex.release()
+
+    def get_statistics(self):
+        '''
+        return (hits, misses, entries in memory, bytes on disk)
+        '''
+        return self.hits, self.misses, len(self.memory), self.disk_bytes
+
+    def InterfaceGetStatistics(self):
+        return self.get_statistics()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Purpose: serve the response of a similar request from the cache
+#   the last prompt of a request is embedded, and compared with the prompts of the cached requests
+#   that have the same supply, model, temperature, examples and earlier prompts,
+#   the cached response is served when the cosine similarity is above the threshold
+#   the entries keep their rows of the embedding matrix, a new entry only writes its own row,
+#   and the entries are saved in batches, not on every request
+#   numpy is optional, the cache is disabled without it
+
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from system.llm import response_cache
+
+
+class SemanticCache(object):
+    '''
+    SemanticCache keeps the normalized embeddings of the cached prompts in one matrix,
+    a lookup is a matrix-vector product over the rows of the same context
+    the matrix grows by doubling, when it's full the row of the oldest entry is reused by the new entry,
+    the cache is saved every SAVE_BATCH entries or SAVE_INTERVAL seconds, and when the program exits
+    '''
+    SAVE_BATCH = 16
+    SAVE_INTERVAL = 60
+    INITIAL_ROWS = 64
+    # the context key is a sha256 hex digest
+    CONTEXT_DTYPE = '<U64'
+
+    def __init__(self, cache_file, threshold=0.95, max_entries=5000):
+        '''
+        cache_file is the metadata json, the embeddings are saved next to it in a .npz file,
+        both files have the version of the save, they are used only when the versions are the same
+        '''
+        super().__init__()
+        self.cache_file = cache_file
+        self.matrix_file = os.path.splitext(cache_file)[0] + '.npz'
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.mutex = threading.Lock()
+
+        # entries are in the order they are added, entry is {'row', 'context', 'prompt', 'chunks': [(text, reason)]},
+        # its embedding is matrix[row], and its context is contexts[row]
+        self.entries = collections.deque()
+        self.row_entries = {}
+        self.contexts = None
+        self.matrix = None
+        # the rows that are used, the rows after it are free
+        self.used_rows = 0
+
+        self.version = 0
+        self.unsaved = 0
+        self.last_save_time = time.time()
+
+        self.lookups = 0
+        self.hits = 0
+        # the similarity of every hit, used to tune the threshold
+        self.hit_similarities = []
+
+        if self.is_available():
+            self.load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def is_available():
+        return numpy is not None
+
+    @staticmethod
+    def make_context_key(supply, model, temperature, examples, prompts, new_chat=True):
+        '''
+        every thing of the request except the content of the last prompt
+        '''
+        prompts = list(prompts or [])
+        if prompts:
+            prompts[-1] = {'system': prompts[-1].get('system', '')}
+        return response_cache.ResponseCache.make_key(supply, model, temperature, examples, prompts, new_chat)
+
+    @staticmethod
+    def get_prompt_text(prompts):
+        if not prompts:
+            return ''
+        return response_cache.ResponseCache.normalize_text(prompts[-1].get('content', ''))
+
+    def load(self):
+        if not os.path.exists(self.cache_file) or not os.path.exists(self.matrix_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with numpy.load(self.matrix_file) as arrays:
+                matrix = arrays['matrix']
+                version = int(arrays['version'])
+            entries = data['entries']
+            rows = [entry['row'] for entry in entries]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print("Load semantic cache failed: {}".format(e))
+            return
+        # the files are replaced one by one, a crash between them leaves two versions, the rows can't be trusted
+        if data.get('version') != version or any(row < 0 or row >= len(matrix) for row in rows) or len(set(rows)) != len(rows):
+            print("The semantic cache is inconsistent, it's dropped")
+            return
+
+        self.matrix = matrix.astype(numpy.float32)
+        self.contexts = numpy.zeros(len(matrix), dtype=self.CONTEXT_DTYPE)
+        self.used_rows = len(matrix)
+        for entry in entries:
+            self.contexts[entry['row']] = entry['context']
+            self.entries.append(entry)
+            self.row_entries[entry['row']] = entry
+        self.version = version
+        self.trim()
+
+    def save(self):
+        # called with the mutex acquired, the json is replaced after the matrix, both have the same version
+        self.version += 1
+        temp_matrix_file = self.matrix_file + '.tmp.npz'
+        matrix = self.matrix[:self.used_rows] if self.matrix is not None else numpy.zeros((0, 0), dtype=numpy.float32)
+        numpy.savez(temp_matrix_file, matrix=matrix, version=numpy.int64(self.version))
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'entries': list(self.entries)}, f, ensure_ascii=False)
+        os.replace(temp_matrix_file, self.matrix_file)
+        os.replace(temp_file, self.cache_file)
+        self.unsaved = 0
+        self.last_save_time = time.time()
+
+    def flush(self):
+        '''
+        save the entries that are not saved yet
+        '''
+        self.mutex.acquire()
+        try:
+            if self.unsaved:
+                self.save()
+        except OSError as e:
+            print("Save semantic cache failed: {}".format(e))
+        finally:
+            self.mutex.release()
+
+    @staticmethod
+    def normalize(embedding):
+        vector = numpy.asarray(embedding, dtype=numpy.float32)
+        norm = numpy.linalg.norm(vector)
+        if norm == 0:
+            return vector
+        return vector / norm
+
+    def lookup(self, context_key, embedding):
+        '''
+        return (chunks, similarity) of the most similar cached prompt of the context,
+        chunks is None if the similarity is below the threshold
+        '''
+        query = self.normalize(embedding)
+        self.mutex.acquire()
+        try:
+            self.lookups += 1
+            if self.matrix is None or not self.entries:
+                return None, 0.0
+
+            # the free rows have empty contexts, they never match
+            rows = numpy.flatnonzero(self.contexts[:self.used_rows] == context_key)
+            # the embeddings of another embedding model can't be compared
+            if not len(rows) or self.matrix.shape[1] != query.shape[0]:
+                return None, 0.0
+
+            similarities = self.matrix[rows] @ query
+            best = int(numpy.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None, similarity
+
+            self.hits += 1
+            self.hit_similarities.append(similarity)
+            del self.hit_similarities[:-1000]
+            chunks = [tuple(chunk) for chunk in self.row_entries[int(rows[best])]['chunks']]
+            return chunks, similarity
+        finally:
+            self.mutex.release()
+
+    def clear_rows(self):
+        # called with the mutex acquired
+        self.entries.clear()
+        self.row_entries.clear()
+        self.contexts = None
+        self.matrix = None
+        self.used_rows = 0
+
+    def allocate_row(self, dim):
+        '''
+        return a free row, the matrix grows by doubling until it has max_entries rows,
+        then the row of the oldest entry is reused, called with the mutex acquired
+        '''
+        if self.matrix is None:
+            rows = min(self.INITIAL_ROWS, max(self.max_entries, 1))
+            self.matrix = numpy.zeros((rows, dim), dtype=numpy.float32)
+            self.contexts = numpy.zeros(rows, dtype=self.CONTEXT_DTYPE)
+
+        if self.used_rows < len(self.matrix):
+            self.used_rows += 1
+            return self.used_rows - 1
+
+        if len(self.matrix) < self.max_entries:
+            rows = min(len(self.matrix) * 2, self.max_entries)
+            matrix = numpy.zeros((rows, dim), dtype=numpy.float32)
+            matrix[:len(self.matrix)] = self.matrix
+            contexts = numpy.zeros(rows, dtype=self.CONTEXT_DTYPE)
+            contexts[:len(self.contexts)] = self.contexts
+            self.matrix, self.contexts = matrix, contexts
+            self.used_rows += 1
+            return self.used_rows - 1
+
+        oldest = self.entries.popleft()
+        del self.row_entries[oldest['row']]
+        return oldest['row']
+
+    def trim(self):
+        # drop the oldest entries if max_entries is decreased, their rows are left empty
+        while len(self.entries) > self.max_entries:
+            oldest = self.entries.popleft()
+            del self.row_entries[oldest['row']]
+            self.contexts[oldest['row']] = ''
+
+    def add(self, context_key, prompt, embedding, chunks):
+        vector = self.normalize(embedding)
+        self.mutex.acquire()
+        try:
+            if self.matrix is not None and self.matrix.shape[1] != vector.shape[0]:
+                # the embedding model is changed, the old embeddings are useless
+                self.clear_rows()
+
+            row = self.allocate_row(vector.shape[0])
+            entry = {'row': row, 'context': context_key, 'prompt': prompt, 'chunks': [list(chunk) for chunk in chunks]}
+            self.matrix[row] = vector
+            self.contexts[row] = context_key
+            self.entries.append(entry)
+            self.row_entries[row] = entry
+
+            # the whole cache is written by a save, save a batch of entries at once
+            self.unsaved += 1
+            if self.unsaved >= self.SAVE_BATCH or time.time() - self.last_save_time >= self.SAVE_INTERVAL:
+                self.save()
+        except OSError as e:
+            print("Save semantic cache failed: {}".format(e))
+        finally:
+            self.mutex.release()
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+    def get_statistics(self):
+        '''
+        return {'lookups', 'hits', 'hit_rate', 'similarities', 'entries'}
+        '''
+        self.mutex.acquire()
+        result = {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'similarities': list(self.hit_similarities),
+            'entries': len(self.entries),
+        }
+        self.mutex.release()
+        return result
+
+    def InterfaceGetStatistics(self):
+        return self.get_statistics()
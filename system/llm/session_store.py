@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# Purpose: keep the chat sessions, so a request that continues a former request is detected at once
+#   the history of a session is a chain of hashes, every turn (an example or a prompt) extends the chain,
+#   so a request continues a session if the head of its history without the last prompt is the head of the session,
+#   the providers keep their conversation handles (a slack thread, the palm messages) in the session by supply,
+#   the sessions are saved to disk, they survive a restart
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from system.llm import llm_interface
+
+
+class ChatSession(object):
+    '''
+    ChatSession is one conversation
+    head is the hash of the history that the session has completed,
+    base_head and pending_head are the heads before and after the running request
+    '''
+
+    def __init__(self, session_id=None, head='', handles=None, update_time=None):
+        super().__init__()
+        self.session_id = session_id or uuid.uuid4().hex
+        self.head = head
+        # {supply: {'head': the head the handle belongs to, 'data': the handle of the provider}}
+        self.handles = handles or {}
+        self.update_time = update_time or time.time()
+
+        self.new_chat = True
+        self.base_head = ''
+        self.pending_head = ''
+
+    def get_handle(self, supply):
+        '''
+        return the handle of the supply if it continues the history of the running request, otherwise None
+        '''
+        handle = self.handles.get(supply)
+        if handle is None or handle['head'] != self.base_head:
+            return None
+        return handle['data']
+
+    def set_handle(self, supply, data):
+        '''
+        called by the provider when the request succeeds, the handle continues the history of the request
+        '''
+        self.handles[supply] = {'head': self.pending_head, 'data': data}
+
+    def to_json(self):
+        return {'id': self.session_id, 'head': self.head, 'handles': self.handles, 'time': self.update_time}
+
+    @staticmethod
+    def from_json(data):
+        return ChatSession(data['id'], data['head'], data.get('handles', {}), data.get('time'))
+
+
+class SessionStore(object):
+    '''
+    SessionStore finds the session of a request by the head of its history in a dict
+    '''
+
+    def __init__(self, session_file, max_sessions=200):
+        super().__init__()
+        self.session_file = session_file
+        self.max_sessions = max_sessions
+        self.mutex = threading.Lock()
+        self.sessions = {}
+        # head -> session id
+        self.heads = {}
+        self.load()
+
+    @staticmethod
+    def hash_turn(*fields):
+        digest = hashlib.sha256()
+        for field in fields:
+            data = (field or '').encode('utf-8')
+            # the length keeps ('ab', 'c') and ('a', 'bc') different
+            digest.update(str(len(data)).encode('ascii') + b':' + data)
+        return digest.hexdigest()
+
+    @classmethod
+    def chain(cls, head, turn_hash):
+        return hashlib.sha256((head + turn_hash).encode('ascii')).hexdigest()
+
+    @classmethod
+    def get_heads(cls, examples, prompts):
+        '''
+        return (the head of the history without the last prompt, the head of the whole history)
+        '''
+        head = ''
+        for example in examples or []:
+            head = cls.chain(head, cls.hash_turn('example', example.get('desc', ''), example.get('content', ''), example.get('response', '')))
+        prompts = prompts or []
+        for prompt in prompts[:-1]:
+            head = cls.chain(head, cls.hash_turn('prompt', prompt.get('system', ''), prompt.get('content', '')))
+        base_head = head
+        if prompts:
+            head = cls.chain(head, cls.hash_turn('prompt', prompts[-1].get('system', ''), prompts[-1].get('content', '')))
+        return base_head, head
+
+    def load(self):
+        if not os.path.exists(self.session_file):
+            return
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                sessions = [ChatSession.from_json(data) for data in json.load(f)['sessions']]
+        except (OSError, ValueError, KeyError) as e:
+            print("Load chat sessions failed: {}".format(e))
+            return
+        for session in sessions:
+            self.sessions[session.session_id] = session
+            self.heads[session.head] = session.session_id
+
+    def save(self):
+        # called with the mutex acquired
+        data = {'sessions': [session.to_json() for session in self.sessions.values()]}
+        temp_file = self.session_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_file, self.session_file)
+        except OSError as e:
+            print("Save chat sessions failed: {}".format(e))
+
+    def match(self, examples, prompts):
+        '''
+        return the session that the request continues, or a new session
+        session.new_chat tells whether the request starts a new conversation
+        '''
+        base_head, head = self.get_heads(examples, prompts)
+        self.mutex.acquire()
+        session_id = self.heads.get(base_head) if base_head else None
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session = ChatSession()
+            session.new_chat = True
+        else:
+            session.new_chat = False
+        session.base_head = base_head
+        session.pending_head = head
+        self.mutex.release()
+        return session
+
+    def advance(self, session):
+        '''
+        the request of the session succeeds, the head of the session moves to the history of the request
+        '''
+        self.mutex.acquire()
+        if self.heads.get(session.head) == session.session_id:
+            del self.heads[session.head]
+        session.head = session.pending_head
+        session.update_time = time.time()
+        self.sessions[session.session_id] = session
+        self.heads[session.head] = session.session_id
+
+        # forget the oldest sessions
+        if len(self.sessions) > self.max_sessions:
+            for old in sorted(self.sessions.values(), key=lambda item: item.update_time)[:len(self.sessions) - self.max_sessions]:
+                self.sessions.pop(old.session_id)
+                if self.heads.get(old.head) == old.session_id:
+                    del self.heads[old.head]
+        self.save()
+        self.mutex.release()
+
+    def track(self, session, callback):
+        '''
+        wrap the callback of a request, the session advances when the request succeeds
+        '''
+        failed = []
+
+        def session_callback(text, reason=None):
+            if text and reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                failed.append(text)
+            elif not text and not failed:
+                self.advance(session)
+            if callback:
+                callback(text, reason)
+        return session_callback
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Purpose: receive the message events of slack, so we don't need to poll the threads to get claude's reply
+#   there are two ways to receive the events:
+#     1. socket mode, it needs an app-level token (xapp-...), no public url is required
+#     2. events api, slack posts the events to a http server, LocalEventServer is the server,
+#        it's also a stand-in of slack when testing, just post the signed events to it,
+#        every request must be signed by the signing secret of the slack app, the others are rejected
+#   all the events are put into SlackEventHub, the slack app waits the events of its thread from the hub
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+
+class SlackEventHub(object):
+    '''
+    SlackEventHub keeps the recent message events of every thread, and wakes up the waiters of the thread
+    the events are kept even if nobody is waiting, because claude may reply before we start waiting
+    '''
+
+    def __init__(self, max_events_per_thread=256, thread_expire_seconds=600):
+        super().__init__()
+        self.max_events_per_thread = max_events_per_thread
+        self.thread_expire_seconds = thread_expire_seconds
+        self.condition = threading.Condition()
+        # (channel, thread_ts) -> [deque of events, index of the first event in the deque, last active time]
+        self.threads = {}
+        self.connected = False
+
+    @staticmethod
+    def get_thread_key(event):
+        '''
+        get (channel, thread_ts) of a message event, return None if it's not a message in a thread
+        '''
+        if event.get('type') != 'message':
+            return None
+
+        # the edited message is in the 'message' field
+        if event.get('subtype') == 'message_changed':
+            message = event.get('message', {})
+        else:
+            message = event
+        thread_ts = message.get('thread_ts') or message.get('ts')
+        if not thread_ts:
+            return None
+        return event.get('channel'), thread_ts
+
+    @staticmethod
+    def get_message(event):
+        '''
+        normalize the new message event and the message changed event to a message dict
+        '''
+        if event.get('subtype') == 'message_changed':
+            return event.get('message', {})
+        return event
+
+    def publish(self, event):
+        key = self.get_thread_key(event)
+        if key is None:
+            return
+
+        self.condition.acquire()
+        now = time.time()
+        thread = self.threads.get(key)
+        if thread is None:
+            thread = [deque(maxlen=self.max_events_per_thread), 0, now]
+            self.threads[key] = thread
+        events = thread[0]
+        if len(events) == events.maxlen:
+            # the oldest event is dropped by the deque
+            thread[1] += 1
+        events.append(self.get_message(event))
+        thread[2] = now
+        self.expire_threads(now)
+        self.condition.notify_all()
+        self.condition.release()
+
+    def expire_threads(self, now):
+        # called with the condition acquired
+        expired = [key for key, thread in self.threads.items() if now - thread[2] > self.thread_expire_seconds]
+        for key in expired:
+            del self.threads[key]
+
+    def wait_messages(self, channel, thread_ts, cursor, timeout):
+        '''
+        wait the messages of the thread after cursor, cursor is 0 for the first call
+        return (messages, new cursor), messages is empty if timeout
+        '''
+        key = (channel, thread_ts)
+        deadline = time.time() + timeout
+
+        self.condition.acquire()
+        try:
+            while True:
+                thread = self.threads.get(key)
+                if thread is not None:
+                    events, first_index, _ = thread
+                    end_index = first_index + len(events)
+                    if end_index > cursor:
+                        start = max(cursor - first_index, 0)
+                        messages = list(events)[start:]
+                        return messages, end_index
+
+                remain = deadline - time.time()
+                if remain <= 0:
+                    return [], cursor
+                self.condition.wait(remain)
+        finally:
+            self.condition.release()
+
+    def set_connected(self, connected):
+        self.connected = connected
+
+    def is_connected(self):
+        return self.connected
+
+
+class SocketModeTransport(object):
+    '''
+    SocketModeTransport receives the events by slack socket mode, and publishes them to the hub
+    '''
+
+    def __init__(self, app_token, web_client, hub):
+        super().__init__()
+        self.hub = hub
+        self.client = None
+
+        # only import socket mode when it's used
+        from slack_sdk.socket_mode import SocketModeClient
+        self.client = SocketModeClient(app_token=app_token, web_client=web_client)
+        self.client.socket_mode_request_listeners.append(self.on_request)
+
+    def on_request(self, client, request):
+        from slack_sdk.socket_mode.response import SocketModeResponse
+
+        # acknowledge the request first, otherwise slack sends it again
+        client.send_socket_mode_response(SocketModeResponse(envelope_id=request.envelope_id))
+        if request.type == 'events_api':
+            self.hub.publish(request.payload.get('event', {}))
+
+    def start(self):
+        try:
+            self.client.connect()
+        except Exception as e:
+            print("Connect to slack socket mode failed: {}, fallback to polling.".format(e))
+            return False
+        self.hub.set_connected(True)
+        return True
+
+    def stop(self):
+        self.hub.set_connected(False)
+        if self.client:
+            self.client.close()
+
+
+def sign_request(signing_secret, timestamp, body):
+    '''
+    return the X-Slack-Signature of the request body, see the request verifying of slack
+    '''
+    base = b'v0:' + str(timestamp).encode('utf-8') + b':' + body
+    return 'v0=' + hmac.new(signing_secret.encode('utf-8'), base, hashlib.sha256).hexdigest()
+
+
+class LocalEventServer(object):
+    '''
+    LocalEventServer is a http server that receives the events api requests
+    slack can post the events to it, and the tests can post fake events signed by sign_request to it
+    the requests that are not signed by signing_secret, or signed too long ago, are rejected
+    '''
+    # slack rejects the requests older than 5 minutes, so a replayed request is useless
+    MAX_REQUEST_AGE = 5 * 60
+    # an event is far smaller than this, a bigger body is not read
+    MAX_BODY_BYTES = 1024 * 1024
+
+    def __init__(self, hub, signing_secret, host='127.0.0.1', port=0):
+        super().__init__()
+        self.hub = hub
+        self.signing_secret = signing_secret
+        self.address = (host, port)
+        # the port is bound by start(), a port in use falls back to polling
+        self.server = None
+        self.thread = None
+
+    def verify(self, timestamp, signature, body):
+        if not self.signing_secret or not timestamp or not signature:
+            return False
+        try:
+            age = abs(time.time() - int(timestamp))
+        except ValueError:
+            return False
+        if age > self.MAX_REQUEST_AGE:
+            return False
+        return hmac.compare_digest(sign_request(self.signing_secret, timestamp, body), signature)
+
+    def create_handler(self):
+        hub = self.hub
+        server = self
+
+        class EventHandler(BaseHTTPRequestHandler):
+            def reject(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    self.reject(400)
+                    return
+                if length < 0 or length > server.MAX_BODY_BYTES:
+                    self.reject(413)
+                    return
+                body = self.rfile.read(length)
+                if not server.verify(self.headers.get('X-Slack-Request-Timestamp'), self.headers.get('X-Slack-Signature'), body):
+                    self.reject(401)
+                    return
+                try:
+                    payload = json.loads(body or b'{}')
+                except ValueError:
+                    self.reject(400)
+                    return
+
+                body = b''
+                # slack verifies the url with a challenge when the events api is enabled
+                if payload.get('type') == 'url_verification':
+                    body = json.dumps({'challenge': payload.get('challenge', '')}).encode('utf-8')
+                elif payload.get('type') == 'event_callback':
+                    hub.publish(payload.get('event', {}))
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # don't print every request
+                pass
+
+        return EventHandler
+
+    def get_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        try:
+            self.server = ThreadingHTTPServer(self.address, self.create_handler())
+        except OSError as e:
+            print("Listen the slack events on {}:{} failed: {}, fallback to polling.".format(self.address[0], self.address[1], e))
+            return False
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.hub.set_connected(True)
+        return True
+
+    def stop(self):
+        self.hub.set_connected(False)
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
@@ -1,6 +1,7 @@
 # Purpose: It's hard to apply claude api, so we make a slack app to chat with Claude
 
 from system.llm import llm_interface
+from system.llm import slack_events
 import slack_sdk
 import threading
 import time
@@ -12,7 +13,14 @@ class SlackAppUtil(llm_interface.LLMInterface):
         WAITING = 1
         COMPLETED = 2
 
-    def __init__(self, token, claude_id, channel_id):
+    # seconds between two polls when there is no event transport, it grows when the reply is not changed
+    POLL_MIN_INTERVAL = 1.0
+    POLL_MAX_INTERVAL = 8.0
+    POLL_BACKOFF = 1.5
+    # when events are received, we only poll if no event arrives in this interval, in case an event is lost
+    EVENT_FALLBACK_INTERVAL = 10.0
+
+    def __init__(self, token, claude_id, channel_id, app_token="", events_port=0, events_host="127.0.0.1", signing_secret=""):
         super().__init__()
 
         self.channel_id = channel_id
@@ -23,9 +31,36 @@ class SlackAppUtil(llm_interface.LLMInterface):
 
         # initialize slack web client
         self.client = slack_sdk.WebClient(token=token)
-        self.reply = None
-        self.conversation_ts = None
+        # the message we sent and the thread of the conversation are kept by every request locally,
+        # so the requests running at the same time don't break each other
         self.chat_request_thread = None
+        # count the web api calls, so we know how many calls a reply costs
+        self.api_calls = 0
+
+        # claude's reply is pushed by the events if there is an event transport, otherwise we poll the thread
+        self.event_hub = slack_events.SlackEventHub()
+        self.event_transport = None
+        self.start_event_transport(app_token, events_port, events_host, signing_secret)
+
+    def start_event_transport(self, app_token, events_port, events_host, signing_secret):
+        if app_token:
+            self.event_transport = slack_events.SocketModeTransport(app_token, self.client, self.event_hub)
+        elif events_port:
+            # the events are claude's replies, an unsigned event could be anyone's text
+            if not signing_secret:
+                print("The slack signing secret is not set, the events api is disabled, fallback to polling.")
+                return
+            self.event_transport = slack_events.LocalEventServer(self.event_hub, signing_secret, host=events_host, port=events_port)
+        else:
+            return
+
+        if not self.event_transport.start():
+            self.event_transport = None
+
+    def InterfaceShutdown(self):
+        if self.event_transport:
+            self.event_transport.stop()
+            self.event_transport = None
 
     def find_conversation(self, channel_name):
         response = self.client.conversations_list()
@@ -43,56 +78,78 @@ class SlackAppUtil(llm_interface.LLMInterface):
         else:
             return response["messages"]  # type: ignore
 
-    def retreving_thread_replies(self, thread_ts, channel_id=None):
+    def retreving_thread_replies(self, thread_ts, channel_id=None, oldest=None):
         if not channel_id:
             channel_id = self.channel_id
-        response = self.client.conversations_replies(channel=channel_id, ts=thread_ts, include_all_metadata=True) # , oldest=str(self.last_timestamp), inclusive=True)
+        self.api_calls += 1
+        if oldest:
+            # only fetch the messages not older than oldest, instead of the whole thread
+            response = self.client.conversations_replies(channel=channel_id, ts=thread_ts, include_all_metadata=True, oldest=oldest, inclusive=True)
+        else:
+            response = self.client.conversations_replies(channel=channel_id, ts=thread_ts, include_all_metadata=True)
         if not response:
             return False
         else:
             return response["messages"]  # type: ignore
 
-    def get_last_message(self, thread_ts, channel_id=None):
-        status = SlackAppUtil.LastMessageStatus.WAITING
-        if not channel_id:
-            channel_id = self.channel_id
-        messages = self.retreving_thread_replies(thread_ts, channel_id)
-        if not messages:
-            return None, status
-
-        # find the message that sent previously
-        found = False
+    def get_claude_message_status(self, text):
+        '''
+        return the status of claude's message, or None if it is a notice that should be skipped
+        '''
+        if text.endswith("Typing…") or text.endswith("Typing…_"):
+            return SlackAppUtil.LastMessageStatus.TYPING
+        elif text.startswith("&gt; _*Please note:* Claude"):
+            '''
+            claude will send a notice like this, we need to skip it:
+
+            &gt; _*Please note:* Claude is not skilled at solving math problems._
+            &gt; _See the <https://console.anthropic.com/docs|Claude documentation> for more information._
+            '''
+            return None
+        else:
+            return SlackAppUtil.LastMessageStatus.COMPLETED
+
+    def find_claude_message(self, messages, sent_ts):
+        '''
+        find the newest message of claude after the message we sent at sent_ts in the pushed messages
+        return (text, status, ts), text is None if there is no message of claude
+        '''
+        sent_ts = float(sent_ts)
+        last_ts = 0.0
+        last_message_ts = None
         last_message = None
-        # reverse the list, and find the first message that claude sent
-        messages.reverse()
+        status = SlackAppUtil.LastMessageStatus.WAITING
         for message in messages:
-            # find the first message that claude sent
-            if message["user"] == self.claude_id:
-                last_message = message["text"]
-
-                if last_message.endswith("Typing…") or last_message.endswith("Typing…_"):
-                    status = SlackAppUtil.LastMessageStatus.TYPING
-                elif last_message.startswith("&gt; _*Please note:* Claude"):
-                    '''
-                    claude will send a notice like this, we need to skip it:
-
-                    &gt; _*Please note:* Claude is not skilled at solving math problems._
-                    &gt; _See the <https://console.anthropic.com/docs|Claude documentation> for more information._
-                    '''
-                    continue
-                else:
-                    status = SlackAppUtil.LastMessageStatus.COMPLETED
-            # we need find the first message as the same as the message previousely sent
-            elif message["text"] == self.reply["message"]["text"]: # type: ignore
-                found = True
-                break
-
-        if found:
-            return last_message, status
-        else:
-            return None, status
+            if message.get("user") != self.claude_id:
+                continue
+            message_ts = float(message.get("ts", 0))
+            if message_ts <= sent_ts or message_ts < last_ts:
+                continue
+            message_status = self.get_claude_message_status(message.get("text", ""))
+            if message_status is None:
+                continue
+            last_ts = message_ts
+            last_message_ts = message["ts"]
+            last_message = message["text"]
+            status = message_status
+        return last_message, status, last_message_ts
+
+    def get_last_message(self, thread_ts, sent_ts, channel_id=None, oldest=None):
+        '''
+        fetch the thread and find claude's reply, return (text, status, ts)
+        claude edits its message while typing, so oldest should be the ts of claude's message if we have seen it,
+        otherwise the ts of the message we sent, then only the messages we care about are fetched
+        '''
+        messages = self.retreving_thread_replies(thread_ts, channel_id, oldest)
+        if not messages:
+            return None, SlackAppUtil.LastMessageStatus.WAITING, None
+        return self.find_claude_message(messages, sent_ts)
 
     def post_message(self, message, threads_ts=None, channel_id=None):
+        '''
+        post the message to the thread, a new thread is started if threads_ts is None
+        return the posted message, None if it cannot be sent
+        '''
         if not channel_id:
             channel_id = self.channel_id
 
@@ -103,44 +160,108 @@ class SlackAppUtil(llm_interface.LLMInterface):
         interval = 5
         self.last_timestamp = int(time.time())
         while True:
-            self.reply = self.client.chat_postMessage(channel=channel_id, text=message, thread_ts=threads_ts)
-            if self.conversation_ts is None:
-                self.conversation_ts = self.reply["ts"]
+            self.api_calls += 1
+            reply = self.client.chat_postMessage(channel=channel_id, text=message, thread_ts=threads_ts)
 
-            if not self.reply or not self.reply['ts']:
+            if not reply or not reply['ts']:
                 # if no reply, send it again
                 time.sleep(interval)
                 timeout -= interval
                 if timeout <= 0:
-                    return False
+                    return None
             else:
                 # if reply, return
-                return True
+                return reply
+
+    def get_claude_reply(self, reply, conversation_ts, timeout=300):
+        '''
+        yield the text of claude's reply to the posted message reply in the thread conversation_ts every time it is changed,
+        until claude completes it
+        the reply is pushed by the event transport if it's connected, polling is only the fallback,
+        and the poll interval backs off while the reply is not changed
+        '''
+        deadline = time.time() + timeout
+        use_events = self.event_transport is not None and self.event_hub.is_connected()
+        base_interval = self.EVENT_FALLBACK_INTERVAL if use_events else self.POLL_MIN_INTERVAL
+        interval = base_interval
+        cursor = 0
+        last_reply = None
+        # the messages older than oldest_ts are never fetched again
+        sent_ts = reply["ts"]
+        oldest_ts = sent_ts
+        api_calls = self.api_calls
+
+        while time.time() < deadline:
+            if use_events:
+                messages, cursor = self.event_hub.wait_messages(self.channel_id, conversation_ts, cursor, interval)
+                if messages:
+                    last_message, status, message_ts = self.find_claude_message(messages, sent_ts)
+                    # the events are not from claude, for example, the message we sent
+                    if last_message is None:
+                        continue
+                else:
+                    # no event arrives in time, maybe it's lost, poll the thread
+                    last_message, status, message_ts = self.get_last_message(conversation_ts, sent_ts, oldest=oldest_ts)
+            else:
+                last_message, status, message_ts = self.get_last_message(conversation_ts, sent_ts, oldest=oldest_ts)
 
-    def get_claude_reply(self, interval=2):
-        # wait and get reply
-        timeout = 300
-        while True:
-            last_message, status = self.get_last_message(self.conversation_ts)
-            if status == SlackAppUtil.LastMessageStatus.TYPING:
-                time.sleep(interval)
-                timeout -= interval
-                if timeout <= 0:
-                    return "get claude reply timeout!"
-                yield last_message 
-            elif status == SlackAppUtil.LastMessageStatus.WAITING:
-                continue
-            elif status == SlackAppUtil.LastMessageStatus.COMPLETED:
+            if message_ts is not None:
+                oldest_ts = message_ts
+
+            if status == SlackAppUtil.LastMessageStatus.COMPLETED:
+                print("claude reply completed, {} slack api calls".format(self.api_calls - api_calls))
+                yield last_message
+                return
+
+            if last_message is not None and last_message != last_reply:
+                # claude is typing, check it again soon
+                last_reply = last_message
+                interval = base_interval
                 yield last_message
-                break
             else:
-                return "API Error. Get Claude reply failed!"
+                interval = min(interval * self.POLL_BACKOFF, max(self.POLL_MAX_INTERVAL, base_interval))
 
-    def start_conversation(self, message, channel_id=None):
-        if not self.reply:
-            return self.post_message(message, channel_id)
-        else:
-            return self.post_message(message, self.conversation_ts, channel_id)
+            if not use_events:
+                time.sleep(interval)
+
+        print("get claude reply timeout!")
+
+    def strip_typing(self, text):
+        '''
+        remove the typing mark of claude's message, the trailing spaces are also removed,
+        because they may be replaced by other text when claude types more
+        '''
+        for mark in ("_Typing…_", "Typing…"):
+            if text.endswith(mark):
+                text = text[:-len(mark)]
+                break
+        return text.rstrip()
+
+    def get_claude_reply_deltas(self, reply, conversation_ts):
+        '''
+        yield (text, reason) of claude's reply, only the appended text is yielded with APPEND,
+        the whole text is yielded with NEW_REPLY when a reply starts or claude rewrites the text
+        '''
+        emitted = None
+        for message in self.get_claude_reply(reply, conversation_ts):
+            text = self.strip_typing(message)
+            if not text:
+                continue
+            if emitted is None or not text.startswith(emitted):
+                yield text, self.ReasonCode.NEW_REPLY
+            elif len(text) > len(emitted):
+                yield text[len(emitted):], self.ReasonCode.APPEND
+            emitted = text
+
+    def start_conversation(self, message, conversation_ts, channel_id=None):
+        '''
+        post the message to the thread conversation_ts, or start a new thread if it's None
+        return (reply, conversation_ts), reply is None if the message cannot be sent
+        '''
+        reply = self.post_message(message, conversation_ts, channel_id)
+        if reply is not None and conversation_ts is None:
+            conversation_ts = reply["ts"]
+        return reply, conversation_ts
 
     def InterfaceGetSupplyName(self):
         return "Slack"
@@ -149,13 +270,7 @@ class SlackAppUtil(llm_interface.LLMInterface):
         return ["claude"]
 
     def InterfaceChatRequest(self, **kwargs):
-        # there are many parameters in the request, we need to check them
-        # if some parameters are not set, we need to set them
-        model_name = kwargs.get('model', '')  # Google Palm doesn't need model when access the chat api
-        prompts = kwargs.get('prompts', '')
-        examples = kwargs.get('examples', [])
         callback = kwargs.get('callback', None)
-        new_chat = kwargs.get('new_chat', True)
 
         # if chat is running, wait for it
         if self.chat_request_thread and self.chat_request_thread.is_alive():
@@ -163,6 +278,23 @@ class SlackAppUtil(llm_interface.LLMInterface):
                 callback("Chat is running, please wait.", self.ReasonCode.FAILED)
             return
 
+        self.chat_request_thread = threading.Thread(target=self.InterfaceChatRequestBlocking, kwargs=kwargs)
+        self.chat_request_thread.start()
+
+    def InterfaceChatRequestBlocking(self, **kwargs):
+        '''
+        send the messages to claude and send the replies to the callback in current thread
+        '''
+        # there are many parameters in the request, we need to check them
+        # if some parameters are not set, we need to set them
+        model_name = kwargs.get('model', '')  # Google Palm doesn't need model when access the chat api
+        prompts = kwargs.get('prompts', '')
+        examples = kwargs.get('examples', [])
+        callback = kwargs.get('callback', None)
+        new_chat = kwargs.get('new_chat', True)
+        # the session keeps the slack thread of the conversation
+        session = kwargs.get('session', None)
+
         if not prompts:
             if callback:
                 callback("No prompts, Generate exit.", self.ReasonCode.FAILED)
@@ -171,57 +303,74 @@ class SlackAppUtil(llm_interface.LLMInterface):
         # if starts new conversation, clear the reply, and find the last prompt
         context = self._getContext(prompts)
 
-        if new_chat:
-            self.reply = None
-            self.conversation_ts = None
+        handle = None
+        if not new_chat and session is not None:
+            handle = session.get_handle(self.InterfaceGetSupplyName())
+        if handle is not None and handle.get('channel_id') != self.channel_id:
+            handle = None
+
+        if handle is None:
+            # the thread is unknown, start a new thread with all the examples and prompts
+            conversation_ts = None
         else:
+            # only the new prompt is posted to the thread
+            conversation_ts = handle['conversation_ts']
             examples = []
             prompt = prompts[-1]
             prompts = [prompt]
 
-        def handle_reply(reply, call_func, error_message):
-            if reply:
-                # send message succeed, then get reply
-                for message in self.get_claude_reply():
-                    print("get reply: ", message)
-                    call_func(message, self.ReasonCode.NEW_REPLY)
-                return True
+        try:
+            conversation_ts = self.get_response(context, examples, prompts, conversation_ts, callback)
+        except Exception as e:
+            callback("Slack request failed: {}".format(e), self.ReasonCode.FAILED)
+        else:
+            if conversation_ts is not None and session is not None:
+                session.set_handle(self.InterfaceGetSupplyName(), {'conversation_ts': conversation_ts, 'channel_id': self.channel_id})
+        # the request must be completed, otherwise the caller waits forever
+        callback("") # type: ignore
+
+    def handle_reply(self, reply, conversation_ts, call_func, error_message):
+        if reply:
+            # send message succeed, then get reply, only the new text is sent to the callback
+            for text, reason in self.get_claude_reply_deltas(reply, conversation_ts):
+                call_func(text, reason)
+            return True
+        else:
+            call_func(error_message, self.ReasonCode.SUCCESS)
+            return False
+
+    def get_response(self, context, examples, prompts, conversation_ts, callback):
+        '''
+        post the messages to the thread conversation_ts, a new thread is started if it's None
+        return the ts of the thread, None if a message failed
+        '''
+        index = 1
+
+        # if the message is not sent, send it again
+        if conversation_ts is None:
+            reply, conversation_ts = self.start_conversation(context, conversation_ts)
+            if not self.handle_reply(reply, conversation_ts, callback, "Slack app error, Cannot send message to slack."):
+                return None
+        
+        for example in examples:
+            order = self.make_ordinal(index)
+
+            if example['desc']:
+                message = '''This is {} example, the description is: {}, the example is: """{}""", please read it.'''.format(order, example['desc'], example["content"])
             else:
-                call_func(error_message, self.ReasonCode.SUCCESS)
-                return False
-
-        def get_response(self, context, examples, prompts, callback):
-            index = 1
-
-            # if the message is not sent, send it again
-            if new_chat:
-                reply = self.start_conversation(context)
-                if not handle_reply(reply, callback, "Slack app error, Cannot send message to slack."):
-                    return
-            
-            for example in examples:
-                order = self.make_ordinal(index)
-
-                if example['desc']:
-                    message = '''This is {} example, the description is: {}, the example is: """{}""", please read it.'''.format(order, example['desc'], example["content"])
-                else:
-                    message = '''This is {} example, please read it: '''.format(order) + example["content"]
-                index += 1
-
-                reply = self.start_conversation(message)
-                if not handle_reply(reply, callback, "Sorry, I can't understand you. The reply is None."):
-                    return
-            
-            for prompt in prompts:
-                message = prompt["content"] # type: ignore
-                reply = self.start_conversation(message)
-                if not handle_reply(reply, callback, "Sorry, I can't understand you. The reply is None."):
-                    return
-
-            callback("") # type: ignore
-
-        self.chat_request_thread = threading.Thread(target=get_response, args=(self, context, examples, prompts, callback))
-        self.chat_request_thread.start()
+                message = '''This is {} example, please read it: '''.format(order) + example["content"]
+            index += 1
+
+            reply, conversation_ts = self.start_conversation(message, conversation_ts)
+            if not self.handle_reply(reply, conversation_ts, callback, "Sorry, I can't understand you. The reply is None."):
+                return None
+        
+        for prompt in prompts:
+            message = prompt["content"] # type: ignore
+            reply, conversation_ts = self.start_conversation(message, conversation_ts)
+            if not self.handle_reply(reply, conversation_ts, callback, "Sorry, I can't understand you. The reply is None."):
+                return None
+        return conversation_ts
 
     def _getContext(self, prompts):
         for prompt in prompts:
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Purpose: count the tokens of chat messages for openai models
+#   creating a tiktoken encoder is slow and the examples are usually huge and rarely changed,
+#   so the encoders are shared by the whole process, and the token count of every text is memorized
+#   by the hash of its content, only the changed text is encoded again
+
+from collections import OrderedDict
+import hashlib
+import threading
+
+
+class TokenCounter(object):
+    '''
+    TokenCounter is a singleton class, it caches the encoders and the token count of the texts
+    '''
+    _instance = None
+
+    # the model that decides how many extra tokens a message costs
+    MODEL_ALIASES = {
+        'gpt-3.5-turbo': 'gpt-3.5-turbo-0301',
+        'gpt-4': 'gpt-4-0314',
+        'gpt-4-32k': 'gpt-4-0314',
+    }
+
+    # model: (tokens_per_message, tokens_per_name)
+    MESSAGE_TOKENS = {
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        # if there's a name, the role is omitted
+        'gpt-3.5-turbo-0301': (4, -1),
+        'gpt-4-0314': (3, 1),
+        'gpt-4-32k-0314': (3, 1),
+    }
+
+    DEFAULT_ENCODING = 'cl100k_base'
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.initialized = False
+        return cls._instance
+
+    def __init__(self, max_memo_size=4096):
+        # the counter is shared, only init it once
+        if self.initialized:
+            return
+        super().__init__()
+        self.initialized = True
+
+        self.mutex = threading.Lock()
+        self.encoders = {}
+        self.max_memo_size = max_memo_size
+        # (encoding name, content hash) -> token count, least recently used is dropped first
+        self.memo = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def get_encoding(self, model):
+        '''
+        get the encoder of the model, every encoder is created only once
+        '''
+        self.mutex.acquire()
+        try:
+            encoding = self.encoders.get(model)
+            if encoding is not None:
+                return encoding
+
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                print("Warning: model not found. Using cl100k_base encoding.")
+                encoding = tiktoken.get_encoding(self.DEFAULT_ENCODING)
+            self.encoders[model] = encoding
+            return encoding
+        finally:
+            self.mutex.release()
+
+    @staticmethod
+    def content_hash(text):
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def count_text(self, text, model):
+        '''
+        count the tokens of a text, the text is encoded only when it is not memorized
+        '''
+        if not text:
+            return 0
+
+        encoding = self.get_encoding(model)
+        key = (encoding.name, self.content_hash(text))
+
+        self.mutex.acquire()
+        count = self.memo.get(key)
+        if count is not None:
+            self.memo.move_to_end(key)
+            self.memo_hits += 1
+        self.mutex.release()
+        if count is not None:
+            return count
+
+        # encode outside the lock, it's the slow part
+        count = len(encoding.encode(text))
+
+        self.mutex.acquire()
+        self.memo_misses += 1
+        self.memo[key] = count
+        if len(self.memo) > self.max_memo_size:
+            self.memo.popitem(last=False)
+        self.mutex.release()
+        return count
+
+    def count_messages(self, messages, model):
+        '''
+        Returns the number of tokens used by a list of messages.
+        '''
+        message_model = self.MODEL_ALIASES.get(model, model)
+        if message_model not in self.MESSAGE_TOKENS:
+            raise NotImplementedError(f"""count_token() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
+        tokens_per_message, tokens_per_name = self.MESSAGE_TOKENS[message_model]
+
+        num_tokens = 0
+        for message in messages:
+            num_tokens += tokens_per_message
+            for key, value in message.items():
+                num_tokens += self.count_text(value, message_model)
+                if key == "name":
+                    num_tokens += tokens_per_name
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        return num_tokens
+
+    def InterfaceCountText(self, text, model):
+        return self.count_text(text, model)
+
+    def InterfaceCountMessages(self, messages, model):
+        return self.count_messages(messages, model)
+
+    def InterfaceGetMemoStatistics(self):
+        '''
+        return (hits, misses, memorized texts)
+        '''
+        return self.memo_hits, self.memo_misses, len(self.memo)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Purpose: an append-only ledger of the usage and cost of every chat request
+#   every request is a row of the requests table, and the daily rollup of its (day, supply, model) is updated
+#   in the same transaction, so the statistics are read from the small rollup table
+#   no matter how many requests are recorded,
+#   the summaries and the embeddings the providers request by themselves are paid too, their tokens and cost are
+#   in the rollup, but they are counted apart from the chat requests and their latency is not in the averages
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class UsageLedger(object):
+    '''
+    UsageLedger records the provider, model, tokens, latency and cost of the chat requests
+    an entry is {'supply', 'model', 'prompt_tokens', 'completion_tokens', 'latency', 'first_token_latency', 'cost', 'status'},
+    status is one of STATUSES, 'summary' and 'embedding' are the requests of PROVIDER_STATUSES,
+    they are not chat requests, and they are counted by the summaries and embeddings of the rollup
+    '''
+
+    STATUSES = ('success', 'failed', 'cancelled', 'cached', 'summary', 'embedding')
+    PROVIDER_STATUSES = ('summary', 'embedding')
+    HISTORY_COLUMNS = ('id', 'time', 'supply', 'model', 'prompt_tokens', 'completion_tokens',
+                       'latency', 'first_token_latency', 'cost', 'status')
+    ROLLUP_COLUMNS = ('requests', 'prompt_tokens', 'completion_tokens', 'cost', 'latency', 'first_token_latency',
+                      'first_tokens', 'failed', 'cancelled', 'cached', 'summaries', 'embeddings')
+
+    def __init__(self, ledger_file):
+        super().__init__()
+        self.ledger_file = ledger_file
+        self.mutex = threading.Lock()
+        directory = os.path.dirname(ledger_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(ledger_file, check_same_thread=False)
+        # the readers are not blocked by the writer
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, supply TEXT, model TEXT,
+                prompt_tokens INTEGER, completion_tokens INTEGER, latency REAL, first_token_latency REAL,
+                cost REAL, status TEXT);
+            CREATE TABLE IF NOT EXISTS daily (
+                day TEXT, supply TEXT, model TEXT,
+                requests INTEGER DEFAULT 0, prompt_tokens INTEGER DEFAULT 0, completion_tokens INTEGER DEFAULT 0,
+                cost REAL DEFAULT 0, latency REAL DEFAULT 0, first_token_latency REAL DEFAULT 0, first_tokens INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0, cancelled INTEGER DEFAULT 0, cached INTEGER DEFAULT 0,
+                summaries INTEGER DEFAULT 0, embeddings INTEGER DEFAULT 0,
+                PRIMARY KEY (day, supply, model));
+        ''')
+        self.db.commit()
+        self.upgrade_rollups()
+
+    def upgrade_rollups(self):
+        '''
+        the old ledger counts the summaries and the embeddings as chat requests, add their columns and rebuild the rollups
+        '''
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(daily)').fetchall()]
+        if 'summaries' in columns and 'embeddings' in columns:
+            return
+        try:
+            self.db.execute('ALTER TABLE daily ADD COLUMN summaries INTEGER DEFAULT 0')
+            self.db.execute('ALTER TABLE daily ADD COLUMN embeddings INTEGER DEFAULT 0')
+            self.db.execute('DELETE FROM daily')
+            self.db.execute('''INSERT INTO daily SELECT date(time, 'unixepoch', 'localtime') AS day, supply, model,
+                               SUM(status NOT IN ('summary', 'embedding')), SUM(prompt_tokens), SUM(completion_tokens),
+                               SUM(cost), SUM(CASE WHEN status IN ('summary', 'embedding') THEN 0 ELSE latency END),
+                               SUM(COALESCE(first_token_latency, 0)), SUM(first_token_latency IS NOT NULL),
+                               SUM(status = 'failed'), SUM(status = 'cancelled'), SUM(status = 'cached'),
+                               SUM(status = 'summary'), SUM(status = 'embedding')
+                               FROM requests GROUP BY day, supply, model''')
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.rollback()
+            print("upgrade the usage ledger failed: {}".format(e))
+
+    def record(self, entry):
+        '''
+        append the entry and update its daily rollup
+        '''
+        now = entry.get('time') or time.time()
+        status = entry.get('status', 'success')
+        first_token_latency = entry.get('first_token_latency')
+        row = (now, entry.get('supply', ''), entry.get('model', ''), int(entry.get('prompt_tokens', 0)),
+               int(entry.get('completion_tokens', 0)), float(entry.get('latency', 0.0)), first_token_latency,
+               float(entry.get('cost', 0.0)), status)
+        day = time.strftime('%Y-%m-%d', time.localtime(now))
+        is_chat = status not in self.PROVIDER_STATUSES
+        rollup = (1 if is_chat else 0, row[3], row[4], row[7], row[5] if is_chat else 0.0,
+                  first_token_latency or 0.0, 1 if first_token_latency is not None else 0,
+                  1 if status == 'failed' else 0, 1 if status == 'cancelled' else 0, 1 if status == 'cached' else 0,
+                  1 if status == 'summary' else 0, 1 if status == 'embedding' else 0)
+
+        with self.mutex:
+            try:
+                self.db.execute('INSERT INTO requests (time, supply, model, prompt_tokens, completion_tokens, latency, '
+                                'first_token_latency, cost, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+                self.db.execute('INSERT OR IGNORE INTO daily (day, supply, model) VALUES (?, ?, ?)', (day, row[1], row[2]))
+                self.db.execute('''UPDATE daily SET requests = requests + ?, prompt_tokens = prompt_tokens + ?,
+                                   completion_tokens = completion_tokens + ?, cost = cost + ?, latency = latency + ?,
+                                   first_token_latency = first_token_latency + ?, first_tokens = first_tokens + ?,
+                                   failed = failed + ?, cancelled = cancelled + ?, cached = cached + ?,
+                                   summaries = summaries + ?, embeddings = embeddings + ?
+                                   WHERE day = ? AND supply = ? AND model = ?''', rollup + (day, row[1], row[2]))
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.db.rollback()
+                print("record the usage failed: {}".format(e))
+
+    def get_history(self, offset=0, limit=200, supply=None):
+        '''
+        return the entries from the newest one, every entry is a dict of HISTORY_COLUMNS
+        '''
+        sql = 'SELECT {} FROM requests'.format(', '.join(self.HISTORY_COLUMNS))
+        args = []
+        if supply:
+            sql += ' WHERE supply = ?'
+            args.append(supply)
+        sql += ' ORDER BY id DESC LIMIT ? OFFSET ?'
+        args.extend([limit, offset])
+        with self.mutex:
+            rows = self.db.execute(sql, args).fetchall()
+        return [dict(zip(self.HISTORY_COLUMNS, row)) for row in rows]
+
+    def get_count(self):
+        with self.mutex:
+            return self.db.execute('SELECT COALESCE(SUM(requests), 0) FROM daily').fetchone()[0]
+
+    def query_rollups(self, group_by, since_day=None):
+        columns = ', '.join('SUM({})'.format(column) for column in self.ROLLUP_COLUMNS)
+        sql = 'SELECT {}{} FROM daily'.format(group_by + ', ' if group_by else '', columns)
+        args = []
+        if since_day:
+            sql += ' WHERE day >= ?'
+            args.append(since_day)
+        if group_by:
+            sql += ' GROUP BY {} ORDER BY {}'.format(group_by, group_by)
+        with self.mutex:
+            rows = self.db.execute(sql, args).fetchall()
+
+        result = []
+        keys = len(group_by.split(',')) if group_by else 0
+        for row in rows:
+            item = dict(zip(self.ROLLUP_COLUMNS, (value or 0 for value in row[keys:])))
+            item['key'] = tuple(row[:keys])
+            # the averages of the chat requests, the cached requests never reached the supply
+            upstream = item['requests'] - item['cached']
+            item['average_latency'] = item['latency'] / upstream if upstream > 0 else 0.0
+            item['average_first_token_latency'] = item['first_token_latency'] / item['first_tokens'] if item['first_tokens'] else 0.0
+            result.append(item)
+        return result
+
+    def get_statistics(self, days=0):
+        '''
+        return {'total': rollup, 'models': [rollup], 'days': [rollup]} of the recent days, 0 means all the days
+        the key of a model rollup is (supply, model), the key of a day rollup is (day,)
+        '''
+        since_day = None
+        if days > 0:
+            since_day = time.strftime('%Y-%m-%d', time.localtime(time.time() - (days - 1) * 86400))
+        total = self.query_rollups('', since_day)
+        return {
+            'total': total[0] if total else None,
+            'models': self.query_rollups('supply, model', since_day),
+            'days': self.query_rollups('day', since_day),
+        }
+
+    def close(self):
+        with self.mutex:
+            self.db.close()
@@ -1,9 +1,26 @@
 
+import os
+
 from system.settings import settings
-from system.llm import openai_util 
-from system.llm import googleai_util
-from system.llm import slackapp_util
+from system.llm import model_cache
+from system.llm import provider_registry
+from system.llm import fanout
+from system.llm import best_of
+from system.llm import response_cache
+from system.llm import semantic_cache
+from system.llm import session_store
+from system.llm import context_budget
+from system.llm import example_packer
+from system.llm import example_slicer
+from system.llm import usage_ledger
+from system.llm import llm_interface
 from system.prompt import database
+from system import startup_report
+from system import request_scheduler
+from system import request_coalescer
+from system import code_validator
+import threading
+import time
 
 def call_system_decorator(system_name):
     """
@@ -51,6 +68,15 @@ class MainManager(object):
     '''
     _instance = None
 
+    # which settings each llm provider depends on, when one of the settings is changed,
+    # only the provider that depends on it is rebuilt
+    PROVIDER_SETTINGS = {
+        'openai_util': ('openai_api_key',),
+        'googleai_util': ('google_palm_key',),
+        'slackapp_util': ('slack_token', 'claude_user_id', 'general_channel_id', 'slack_app_token', 'slack_events_port',
+                          'slack_events_host', 'slack_signing_secret'),
+    }
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -59,56 +85,202 @@ class MainManager(object):
     def __init__(self):
         super().__init__()
         self.api_supply_dict = {}
+        self.dirty_providers = set()
+        self.models_listeners = []
         self.init_systems()
-        self.settings_dirty = False
 
     def init_systems(self):
 
+        self.startup_report = startup_report.StartupReport()
         self.settings = settings.Settings()
         self.database = database.ResultDatabase()
-        self.openai_util = openai_util.OpenAIUtil(self.settings.InterfaceGetOpenAIKey())
-        self.googleai_util = googleai_util.GoogleAIUtil(self.settings.InterfaceGetGooglePalmKey())
-        self.slackapp_util = slackapp_util.SlackAppUtil(self.settings.InterfaceGetSlackToken(), 
-                                                        self.settings.InterfaceGetClaudeUserID(), 
-                                                        self.settings.InterfaceGetGeneralChannelID())
-
-        # insert the valid llm interface
-        if self.openai_util.InterfaceIsValid():
-            self.api_supply_dict[self.openai_util.InterfaceGetSupplyName()] = self.call_openai_util
-        if self.googleai_util.InterfaceIsValid():
-            self.api_supply_dict[self.googleai_util.InterfaceGetSupplyName()] = self.call_googleai_util
-        if self.slackapp_util.InterfaceIsValid():
-            self.api_supply_dict[self.slackapp_util.InterfaceGetSupplyName()] = self.call_slackapp_util
+        # the model catalog cache is saved next to config.json
+        cache_file = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'model_cache.json')
+        self.model_cache = model_cache.ModelCatalogCache(cache_file, self.settings.InterfaceGetModelCacheTTL())
+        # fit the long chats into the context window of the model
+        self.context_budget = context_budget.ContextBudget(*self.settings.InterfaceGetContextOptions())
+        self.openai_util = None
+        self.googleai_util = None
+        self.slackapp_util = None
+        self.provider_mutex = threading.Lock()
+
+        # the providers are created in a worker pool, they appear in the supply dict when they are ready
+        self.provider_registry = provider_registry.ProviderRegistry(self.startup_report)
+        for provider in self.PROVIDER_SETTINGS:
+            self.init_provider(provider)
+
+        # all the chat requests are queued in the scheduler, it keeps the requests within the quotas of every supply
+        self.scheduler = request_scheduler.RequestScheduler(self.execute_chat_request, self.settings.InterfaceGetProviderQuotas())
+        # the identical requests in flight share one request to the supply
+        self.coalescer = request_coalescer.RequestCoalescer()
+        # the responses are cached next to config.json, the same request is replayed without calling the supply
+        cache_dir = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'response_cache')
+        self.response_cache = response_cache.ResponseCache(cache_dir, max_disk_bytes=self.settings.InterfaceGetResponseCacheSize() * 1024 * 1024)
+        semantic_file = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'semantic_cache.json')
+        self.semantic_cache = semantic_cache.SemanticCache(semantic_file, self.settings.InterfaceGetSemanticCacheThreshold())
+        # the embedding index of the project is created when it's used, it needs numpy
+        self.project_index = None
+        # the chat sessions and the conversation handles of the providers
+        session_file = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'sessions.json')
+        self.session_store = session_store.SessionStore(session_file)
+        # the symbols of the example files, cached by their content hash
+        slice_dir = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'example_slices')
+        self.example_slicer = example_slicer.ExampleSlicer(slice_dir)
+        # the usage and cost of every chat request
+        ledger_file = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'usage.sqlite')
+        self.usage_ledger = usage_ledger.UsageLedger(ledger_file)
+        # the generated code is checked in a process pool, it's started when the first reply is validated
+        self.code_validator = code_validator.CodeValidator()
+        # scorer(text, blocks, results) of the best of n candidates, None means only the validation and the length rank them
+        self.candidate_scorer = None
+
+        self.settings.InterfaceAddChangeListener(self.on_settings_changed)
+        self.startup_report.mark('manager initialized')
+
+    def get_provider_args(self, provider):
+        '''
+        get the arguments to create the provider, it is called in the worker thread
+        '''
+        if provider == 'openai_util':
+            return (self.settings.InterfaceGetOpenAIKey(), self.model_cache, self.on_models_updated, self.context_budget,
+                    self.record_provider_usage), {}
+        elif provider == 'googleai_util':
+            return (self.settings.InterfaceGetGooglePalmKey(), self.model_cache, self.on_models_updated, self.record_provider_usage), {}
+        elif provider == 'slackapp_util':
+            return (self.settings.InterfaceGetSlackToken(), 
+                    self.settings.InterfaceGetClaudeUserID(), 
+                    self.settings.InterfaceGetGeneralChannelID(),
+                    self.settings.InterfaceGetSlackAppToken(),
+                    self.settings.InterfaceGetSlackEventsPort(),
+                    self.settings.InterfaceGetSlackEventsHost(),
+                    self.settings.InterfaceGetSlackSigningSecret()), {}
+        else:
+            raise KeyError("Unknown llm provider {}".format(provider))
+
+    def init_provider(self, provider):
+        '''
+        create the llm interface of the provider asynchronously, and register it when it is ready
+        '''
+        get_args = lambda: self.get_provider_args(provider)
+        # the old provider releases its event server first, the new one listens on the same port,
+        # the old one still works by polling until it's replaced
+        self.provider_mutex.acquire()
+        old_util = getattr(self, provider, None)
+        self.provider_mutex.release()
+        if old_util is not None:
+            old_util.InterfaceShutdown()
+        return self.provider_registry.submit(provider, get_args, self.on_provider_ready)
+
+    def on_provider_ready(self, provider, util):
+        '''
+        called in the worker thread when the provider is created
+        '''
+        if util is None:
+            return
+
+        self.provider_mutex.acquire()
+        old_util = getattr(self, provider)
+        # unregister the old one, the supply name never changes
+        if old_util is not None:
+            self.api_supply_dict.pop(old_util.InterfaceGetSupplyName(), None)
+            old_util.InterfaceShutdown()
+        setattr(self, provider, util)
+        self.register_provider(provider)
+        self.provider_mutex.release()
+
+        # notify the listeners, so the gui can show the new supply
+        for listener in list(self.models_listeners):
+            listener(util.InterfaceGetSupplyName())
+
+    def wait_providers(self, timeout=None):
+        '''
+        wait until all the providers are created, used by the tools without gui
+        '''
+        self.provider_registry.wait(timeout)
+
+    def wait_providers_async(self, callback):
+        '''
+        call the callback in a thread when all the providers are created
+        '''
+        def wait_and_call():
+            self.wait_providers()
+            callback()
+        threading.Thread(target=wait_and_call, daemon=True).start()
+
+    def register_provider(self, provider):
+        '''
+        insert the llm interface to the supply dict if it is valid
+        '''
+        util = getattr(self, provider)
+        if util is None or not util.InterfaceIsValid():
+            return
+        self.api_supply_dict[util.InterfaceGetSupplyName()] = getattr(self, 'call_' + provider)
+
+    def on_models_updated(self, supply_name):
+        '''
+        called by the llm interface, maybe in a worker thread, when its model list is updated
+        '''
+        for provider in self.PROVIDER_SETTINGS:
+            util = getattr(self, provider, None)
+            if util is not None and util.InterfaceGetSupplyName() == supply_name:
+                # a provider may become valid only after its models are fetched
+                self.register_provider(provider)
+
+        for listener in list(self.models_listeners):
+            listener(supply_name)
+
+    def on_settings_changed(self, conf_key, old_value, new_value, version):
+        '''
+        called by settings only when a value is really changed
+        '''
+        if conf_key == 'model_cache_ttl':
+            self.model_cache.set_ttl(new_value)
+        elif conf_key == 'provider_quotas':
+            self.scheduler.set_quotas(new_value)
+        elif conf_key == 'response_cache_size_mb':
+            self.response_cache.set_limits(max_disk_bytes=new_value * 1024 * 1024)
+        elif conf_key == 'semantic_cache_threshold':
+            self.semantic_cache.set_threshold(new_value)
+        elif conf_key in ('context_token_budget', 'context_completion_reserve', 'context_summarize'):
+            self.context_budget.set_options(*self.settings.InterfaceGetContextOptions())
+
+        for provider, conf_keys in self.PROVIDER_SETTINGS.items():
+            if conf_key in conf_keys:
+                self.dirty_providers.add(provider)
 
     def refresh_system(self):
         '''
-        User may add api-key at runtime, so we need to refresh the system.
+        User may add api-key at runtime, so we need to refresh the providers whose settings are changed.
         '''
-        self.api_supply_dict = {}
-        self.init_systems()
+        dirty_providers = self.dirty_providers
+        self.dirty_providers = set()
+        for provider in dirty_providers:
+            self.init_provider(provider)
 
     @call_system_decorator("settings")
     def call_settings(self, *args, **kwargs):
-        self.settings_dirty = True
         return True
 
     @call_system_decorator("openai_util")
     def call_openai_util(self, *args, **kwargs):
-        if self.openai_util.InterfaceIsValid():
+        # the provider may be still creating in the worker pool
+        if self.openai_util is not None and self.openai_util.InterfaceIsValid():
             return True
         else:
             return False
 
     @call_system_decorator("googleai_util")
     def call_googleai_util(self, *args, **kwargs):
-        if self.googleai_util.InterfaceIsValid():
+        # the provider may be still creating in the worker pool
+        if self.googleai_util is not None and self.googleai_util.InterfaceIsValid():
             return True
         else:
             return False
 
     @call_system_decorator("slackapp_util")
     def call_slackapp_util(self, *args, **kwargs):
-        if self.slackapp_util.InterfaceIsValid():
+        # the provider may be still creating in the worker pool
+        if self.slackapp_util is not None and self.slackapp_util.InterfaceIsValid():
             return True
         else:
             return False
@@ -118,6 +290,10 @@ class MainManager(object):
         return True
 
     def call_llm(self, *args, **kwargs):
+        # fan-out mode, send the same request to several (supply, model) pairs at the same time
+        if kwargs.get('targets'):
+            return self.call_llm_fanout(**kwargs)
+
         if 'supply' in kwargs and kwargs['supply'] is not None:
             supply = kwargs['supply']
         else:
@@ -126,9 +302,273 @@ class MainManager(object):
         if supply not in self.api_supply_dict:
             print("Cannot find valid api supply name {}".format(supply))
             return None
+
+        func_kwargs = {k: v for k, v in kwargs.items() if k != 'supply'}
+        funcname = func_kwargs.get('func') or (args[1] if len(args) > 1 else None)
+        # chat requests are queued in the scheduler, a handle of the request is returned
+        if funcname == "InterfaceChatRequest":
+            return self.call_llm_scheduled(supply, **{k: v for k, v in func_kwargs.items() if k != 'func'})
+        return self.api_supply_dict[supply](*args[1:], **func_kwargs)
+
+    def call_llm_scheduled(self, supply, priority=request_scheduler.RequestScheduler.PRIORITY_NORMAL, use_cache=True, **kwargs):
+        '''
+        queue a chat request of the supply, return a handle that can be waited or cancelled
+        the same request is replayed from the response cache, or attached to the same request in flight,
+        unless use_cache is False
+        '''
+        # the session continues only when the request succeeds
+        if kwargs.get('session') is not None:
+            kwargs['callback'] = self.session_store.track(kwargs['session'], kwargs.get('callback', None))
+
+        # the semantic cache is looked up by the scheduler in the worker thread, the embedding request is slow
+        kwargs['use_cache'] = use_cache
+        if not use_cache:
+            return self.submit_chat_request(supply, priority, kwargs)
+
+        key = response_cache.ResponseCache.make_key(supply, kwargs.get('model', ''), kwargs.get('temperature', 0.0),
+                                                    kwargs.get('examples', []), kwargs.get('prompts', []),
+                                                    kwargs.get('new_chat', True))
+        cache_enabled = self.settings.InterfaceGetResponseCacheEnabled()
+        if cache_enabled:
+            chunks = self.response_cache.get(key)
+            if chunks is not None:
+                self.record_cached_usage(supply, kwargs)
+                return self.replay_cached_response(supply, priority, chunks, kwargs)
+
+        def submit(dispatch):
+            # only one request is sent to the supply, its reply is dispatched to all the identical requests
+            upstream_kwargs = dict(kwargs, callback=dispatch)
+            if cache_enabled:
+                upstream_kwargs['callback'] = self.record_response(supply, key, upstream_kwargs)
+            return self.submit_chat_request(supply, priority, upstream_kwargs)
+        return self.coalescer.submit(key, kwargs.get('callback', None), submit)
+
+    def submit_chat_request(self, supply, priority, kwargs):
+        # the estimated prompt tokens are used by the tokens per minute limit
+        tokens = 0
+        try:
+            estimate = self.call_llm(supply, "InterfaceGetEstimateCost", model=kwargs.get('model', ''),
+                                     examples=kwargs.get('examples', []), prompts=kwargs.get('prompts', []))
+            if estimate:
+                tokens = estimate[0]
+        except Exception as e:
+            print("Estimate tokens of the request failed: {}".format(e))
+        # the usage ledger uses the estimate if the supply doesn't report the usage
+        kwargs = dict(kwargs, prompt_tokens=tokens)
+        return self.scheduler.InterfaceSubmit(supply, kwargs, priority, tokens)
+
+    def record_response(self, supply, key, kwargs):
+        '''
+        wrap the callback of a request, the streamed response is cached when the request succeeds
+        '''
+        callback = kwargs.get('callback', None)
+        chunks = []
+        failed = []
+
+        def recording_callback(text, reason=None):
+            if text:
+                if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                    failed.append(text)
+                else:
+                    # the replaced text is never shown again, don't keep it
+                    if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                        chunks.clear()
+                    chunks.append((text, reason))
+            elif not failed and chunks:
+                # the empty text means the request is completed
+                request_info = {'supply': supply, 'model': kwargs.get('model', ''), 'temperature': kwargs.get('temperature', 0.0)}
+                self.response_cache.put(key, chunks, request_info)
+            if callback:
+                callback(text, reason)
+        return recording_callback
+
+    def replay_cached_response(self, supply, priority, chunks, kwargs):
+        '''
+        send the cached response to the callback the same as it is streamed, return a completed request
+        '''
+        request = request_scheduler.ScheduledRequest(0, supply, priority, 0, kwargs)
+        request.state = request_scheduler.ScheduledRequest.RUNNING
+        request.start_time = time.time()
+        callback = kwargs.get('callback', None)
+        if callback:
+            for text, reason in chunks:
+                callback(text, reason)
+            callback("")
+        request.state = request_scheduler.ScheduledRequest.COMPLETED
+        request.end_time = time.time()
+        request.done_event.set()
+        return request
+
+    def execute_chat_request(self, supply, kwargs):
+        '''
+        called by the scheduler in a worker thread, run the chat request and return when it is completed
+        '''
+        if supply not in self.api_supply_dict:
+            raise KeyError("Cannot find valid api supply name {}".format(supply))
+
+        semantic_request = self.get_semantic_request(supply, kwargs)
+        if semantic_request is None:
+            return self.run_chat_request(supply, kwargs)
+
+        context_key, prompt, embedding = semantic_request
+        chunks, similarity = self.semantic_cache.lookup(context_key, embedding)
+        callback = kwargs.get('callback', None)
+        if chunks is not None:
+            self.record_cached_usage(supply, kwargs)
+            if callback:
+                for text, reason in chunks:
+                    callback(text, reason)
+                callback("")
+            return None
+
+        # record the response, it's added to the semantic cache when the request succeeds
+        chunks = []
+        failed = []
+        def recording_callback(text, reason=None):
+            if text:
+                if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                    failed.append(text)
+                else:
+                    if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                        chunks.clear()
+                    chunks.append((text, reason))
+            if callback:
+                callback(text, reason)
+
+        result = self.run_chat_request(supply, dict(kwargs, callback=recording_callback))
+        cancel_event = kwargs.get('cancel_event', None)
+        if chunks and not failed and not (cancel_event is not None and cancel_event.is_set()):
+            self.semantic_cache.add(context_key, prompt, embedding, chunks)
+        return result
+
+    def run_chat_request(self, supply, kwargs):
+        '''
+        send the chat request to the supply in current thread, and record its usage in the ledger
+        '''
+        callback = kwargs.get('callback', None)
+        begin = time.perf_counter()
+        usage = {'first_token_latency': None, 'chunks': [], 'failed': False, 'reported': None}
+
+        def usage_callback(text, reason=None):
+            if text:
+                if usage['first_token_latency'] is None:
+                    usage['first_token_latency'] = time.perf_counter() - begin
+                if reason == llm_interface.LLMInterface.ReasonCode.FAILED:
+                    usage['failed'] = True
+                else:
+                    if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                        usage['chunks'].clear()
+                    usage['chunks'].append(text)
+            if callback:
+                callback(text, reason)
+
+        def report_usage(reported):
+            # the tokens counted by the supply are more accurate than the estimate
+            usage['reported'] = reported
+
+        try:
+            return self.api_supply_dict[supply]("InterfaceChatRequestBlocking",
+                                                **dict(kwargs, callback=usage_callback, usage_callback=report_usage))
+        except Exception:
+            usage['failed'] = True
+            raise
+        finally:
+            usage['latency'] = time.perf_counter() - begin
+            self.record_usage(supply, kwargs, usage)
+
+    def record_usage(self, supply, kwargs, usage):
+        model = kwargs.get('model', '')
+        cancel_event = kwargs.get('cancel_event', None)
+        if usage['failed']:
+            status = 'failed'
+        elif cancel_event is not None and cancel_event.is_set():
+            status = 'cancelled'
         else:
-            func_kwargs = {k: v for k, v in kwargs.items() if k != 'supply'}
-            return self.api_supply_dict[supply](*args[1:], **func_kwargs)
+            status = 'success'
+        try:
+            reported = usage['reported'] or {}
+            prompt_tokens = reported.get('prompt_tokens') or kwargs.get('prompt_tokens', 0)
+            completion_tokens = reported.get('completion_tokens')
+            if completion_tokens is None:
+                completion_tokens = self.call_llm(supply, "InterfaceCountTokens", ''.join(usage['chunks']), model) or 0
+            prompt_price, complete_price = self.call_llm(supply, "InterfaceGetPrice", model) or (0, 0)
+        except Exception as e:
+            print("Count the usage of the request failed: {}".format(e))
+            prompt_tokens, completion_tokens, prompt_price, complete_price = kwargs.get('prompt_tokens', 0), 0, 0, 0
+        self.usage_ledger.record({
+            'supply': supply, 'model': model, 'status': status,
+            'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'latency': usage['latency'], 'first_token_latency': usage['first_token_latency'],
+            'cost': (prompt_tokens * prompt_price + completion_tokens * complete_price) / 1000,
+        })
+
+    def record_provider_usage(self, supply, model, status, prompt_tokens, completion_tokens=0, latency=0.0):
+        '''
+        record the paid requests the providers send by themselves, like the summaries of the context and the embeddings,
+        they are called in the thread of the request
+        '''
+        try:
+            prompt_price, complete_price = self.call_llm(supply, "InterfaceGetPrice", model) or (0, 0)
+        except Exception as e:
+            print("Get the price of {} failed: {}".format(model, e))
+            prompt_price, complete_price = 0, 0
+        self.usage_ledger.record({
+            'supply': supply, 'model': model, 'status': status,
+            'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'latency': latency,
+            'cost': (prompt_tokens * prompt_price + completion_tokens * complete_price) / 1000,
+        })
+
+    def record_cached_usage(self, supply, kwargs):
+        # the cached response costs nothing, it's recorded to know how much the cache saves
+        self.usage_ledger.record({'supply': supply, 'model': kwargs.get('model', ''), 'status': 'cached',
+                                  'prompt_tokens': 0, 'completion_tokens': 0, 'latency': 0.0, 'cost': 0.0})
+
+    def get_semantic_request(self, supply, kwargs):
+        '''
+        return (context key, prompt, embedding) of the request if it uses the semantic cache, otherwise None
+        '''
+        if not kwargs.get('use_cache', True) or not self.settings.InterfaceGetSemanticCacheEnabled():
+            return None
+        if not self.semantic_cache.is_available():
+            return None
+
+        prompts = kwargs.get('prompts', [])
+        prompt = semantic_cache.SemanticCache.get_prompt_text(prompts)
+        embedding_supply = self.settings.InterfaceGetSemanticCacheSupply()
+        if not prompt or embedding_supply not in self.api_supply_dict:
+            return None
+
+        try:
+            embeddings = self.call_llm(embedding_supply, "InterfaceEmbeddingRequest", texts=[prompt])
+        except Exception as e:
+            print("Embed the prompt failed: {}".format(e))
+            return None
+        if not embeddings:
+            return None
+
+        context_key = semantic_cache.SemanticCache.make_context_key(supply, kwargs.get('model', ''), kwargs.get('temperature', 0.0),
+                                                                    kwargs.get('examples', []), prompts, kwargs.get('new_chat', True))
+        return context_key, prompt, embeddings[0]
+
+    def call_llm_fanout(self, targets, examples=None, prompts=None, temperature=0.0, callback=None, complete_callback=None, **kwargs):
+        '''
+        send the examples and prompts to every (supply, model) in targets concurrently
+        callback(index, text, reason) streams the reply of targets[index],
+        complete_callback(index, stats) reports the latency, tokens and cost of targets[index]
+        return the FanOutRequest, it can be waited
+        '''
+        request = fanout.FanOutRequest(self, targets, examples or [], prompts or [], temperature, callback, complete_callback)
+        return request.start()
+
+    def call_llm_best_of(self, supply, model, examples=None, prompts=None, temperature=0.7, count=3, callback=None, complete_callback=None):
+        '''
+        generate count candidates of the request, validate their code blocks and rank them
+        callback(index, text, reason) streams candidates[index], complete_callback(candidates) gets the ranked candidates
+        return the BestOfRequest, it can be waited or cancelled
+        '''
+        request = best_of.BestOfRequest(self, supply, model, examples or [], prompts or [], temperature, count,
+                                        self.candidate_scorer, callback, complete_callback)
+        return request.start()
 
     def InterfaceGetAllModels(self):
         """
@@ -137,10 +577,194 @@ class MainManager(object):
         Returns:
             A dict of all the models of the system.
         """
-        if self.settings_dirty:
+        if self.dirty_providers:
             self.refresh_system()
-            self.settings_dirty = False
         result = {}
-        for api_supply in self.api_supply_dict:
+        # the supply dict may be changed by the thread that fetches the models
+        for api_supply in list(self.api_supply_dict):
             result[api_supply] = self.call_llm(api_supply, "InterfaceGetAllModelNames")
-        return result
\ No newline at end of file
+        return result
+
+    def InterfaceAddModelsListener(self, listener):
+        """
+        Add a listener that is called as listener(supply_name) when the models of a supply are updated.
+        The listener may be called in a worker thread.
+        """
+        if listener not in self.models_listeners:
+            self.models_listeners.append(listener)
+
+    def InterfaceRemoveModelsListener(self, listener):
+        """
+        Remove a listener added by InterfaceAddModelsListener.
+        """
+        if listener in self.models_listeners:
+            self.models_listeners.remove(listener)
+
+    def InterfaceGetResponseCacheStatistics(self):
+        """
+        Get (hits, misses, entries in memory, bytes on disk) of the response cache.
+        """
+        return self.response_cache.InterfaceGetStatistics()
+
+    def InterfacePackExamples(self, supply, model, examples, prompts):
+        """
+        Choose the most relevant examples, or the first part of them, within the example token budget.
+        The budget is example_token_budget, or the room left by the prompts in the context budget of the model.
+        Return (packed examples, report), report[i] tells whether and how much of examples[i] is sent.
+        """
+        packer = example_packer.ExamplePacker()
+        budget = self.settings.InterfaceGetExampleTokenBudget()
+        if budget <= 0:
+            prompt_tokens = sum(packer.count_tokens(prompt.get('system', '')) + packer.count_tokens(prompt.get('content', ''))
+                                + packer.count_tokens(prompt.get('response', '')) for prompt in prompts)
+            budget = self.context_budget.get_budget(model) - prompt_tokens
+        return packer.pack(examples, prompts, budget)
+
+    def InterfaceAnalyzeExample(self, file_path, text):
+        """
+        Get the imports and symbols of an example file with their token counts, it's cached by the content hash.
+        """
+        return self.example_slicer.analyze(file_path, text)
+
+    def InterfaceSliceExample(self, text, analysis, selected, keep_signatures=True):
+        """
+        Get the example that keeps the imports and the selected symbols of the file,
+        the other functions and classes are reduced to their signatures if keep_signatures is set.
+        """
+        return self.example_slicer.build(text, analysis, selected, keep_signatures)
+
+    def InterfaceSelectExampleSymbols(self, text, analysis, prompts, budget=0, keep_signatures=True):
+        """
+        Choose the symbols of an example file most relevant to the prompts within the budget.
+        The budget is example_slice_tokens if it's 0.
+        """
+        if budget <= 0:
+            budget = self.settings.InterfaceGetExampleSliceTokens()
+        return self.example_slicer.select(text, analysis, prompts, budget, keep_signatures)
+
+    def get_project_index(self):
+        if self.project_index is None:
+            from system import project_index
+            index_dir = os.path.join(os.path.dirname(self.settings.InterfaceGetConfFile()), 'project_index')
+            self.project_index = project_index.ProjectIndex(index_dir)
+        return self.project_index
+
+    def embed_texts(self, supply, texts):
+        embeddings = self.call_llm(supply, "InterfaceEmbeddingRequest", texts=texts)
+        if embeddings is None:
+            raise RuntimeError("Cannot embed the texts by the supply {}".format(supply))
+        return embeddings
+
+    def InterfaceUpdateProjectIndex(self, progress=None, cancel_event=None):
+        """
+        Update the embedding index of the project root, only the changed files are embedded again.
+        It's slow, call it in a worker thread. progress(done files, total files, message) is called in the same thread.
+        Return {'files', 'changed', 'removed', 'chunks', 'seconds'}.
+        """
+        root_dir = self.settings.InterfaceGetProjectRootDir()
+        if not root_dir or not os.path.isdir(root_dir):
+            raise RuntimeError("The project root dir is not set")
+        supply = self.settings.InterfaceGetProjectIndexSupply()
+        return self.get_project_index().update(root_dir, lambda texts: self.embed_texts(supply, texts), supply, progress, cancel_event)
+
+    def InterfaceSearchProjectIndex(self, text, top_k=10):
+        """
+        Get [(score, path, symbol, start line, end line)] of the chunks of the project most similar to the text.
+        The path is relative to the project root.
+        """
+        supply = self.settings.InterfaceGetProjectIndexSupply()
+        vector = self.embed_texts(supply, [text])[0]
+        return self.get_project_index().search(vector, top_k)
+
+    def InterfaceSuggestExamples(self, prompts, count=3):
+        """
+        Get the chunks of the project most similar to the last prompt, they can be sent as examples.
+        It embeds the prompt, call it in a worker thread.
+        Return [{'file', 'symbol', 'start_line', 'end_line', 'score', 'content'}], the file is an absolute path.
+        """
+        if not prompts:
+            return []
+        prompt = prompts[-1]
+        text = "\n".join(part for part in (prompt.get('system', ''), prompt.get('content', '')) if part)
+        if not text.strip():
+            return []
+
+        root_dir = self.settings.InterfaceGetProjectRootDir()
+        suggestions = []
+        # search more chunks than needed, the overlapping ones and the unreadable ones are skipped
+        for score, path, symbol, start_line, end_line in self.InterfaceSearchProjectIndex(text, count * 3):
+            file_path = os.path.join(root_dir, path)
+            if any(item['file'] == file_path and item['start_line'] <= end_line and start_line <= item['end_line'] for item in suggestions):
+                continue
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            content = ''.join(lines[start_line - 1:end_line])
+            if not content.strip():
+                continue
+            suggestions.append({'file': file_path, 'symbol': symbol, 'start_line': start_line, 'end_line': end_line,
+                                'score': score, 'content': content})
+            if len(suggestions) >= count:
+                break
+        return suggestions
+
+    def InterfaceValidateCode(self, blocks, callback=None):
+        """
+        Check the code blocks [(language, code)] by compiling them and running the lint and test commands of the settings.
+        It blocks until all the checks are completed, call it in a worker thread.
+        Return [ValidationResult], callback(result) is called when every check is completed.
+        """
+        _, lint_command, test_command, timeout = self.settings.InterfaceGetValidationOptions()
+        return self.code_validator.validate(blocks, lint_command, test_command, timeout, callback)
+
+    def InterfaceSetCandidateScorer(self, scorer):
+        """
+        Set the scorer(text, blocks, results) of the best of n candidates, it returns a number, the higher the better.
+        It ranks the candidates that pass the same validation, None removes it.
+        """
+        self.candidate_scorer = scorer
+
+    def InterfaceGetUsageHistory(self, offset=0, limit=200, supply=None):
+        """
+        Get the usage of the chat requests from the newest one, every entry is a dict of UsageLedger.HISTORY_COLUMNS.
+        """
+        return self.usage_ledger.get_history(offset, limit, supply)
+
+    def InterfaceGetUsageStatistics(self, days=0):
+        """
+        Get {'total', 'models', 'days'} rollups of the usage of the recent days, 0 means all the days.
+        """
+        return self.usage_ledger.get_statistics(days)
+
+    def InterfaceGetProjectIndexStatistics(self):
+        """
+        Get (files, chunks, capacity, dim) of the project index.
+        """
+        return self.get_project_index().get_statistics()
+
+    def InterfaceMatchSession(self, examples, prompts):
+        """
+        Get the chat session that the examples and prompts continue, or a new session.
+        Pass it to the chat request as session=session, new_chat=session.new_chat.
+        """
+        return self.session_store.match(examples, prompts)
+
+    def InterfaceGetCoalescerStatistics(self):
+        """
+        Get (requests in flight, requests attached to another request in total) of the coalescer.
+        """
+        return self.coalescer.get_statistics()
+
+    def InterfaceGetSemanticCacheStatistics(self):
+        """
+        Get the lookups, hits, hit rate and the similarity of every hit of the semantic cache.
+        """
+        return self.semantic_cache.InterfaceGetStatistics()
+
+    def InterfaceGetStartupReport(self):
+        """
+        Get the startup report, including the import time of every module and the init time of every provider.
+        """
+        return self.startup_report.InterfaceGetReport()
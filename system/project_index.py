@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+# Purpose: a persistent embedding index of the source files of the project
+#   the files are split into chunks by code_chunker, the chunks are embedded in batches,
+#   the normalized vectors are stored in a memory-mapped float32 matrix,
+#   and the files and chunks are recorded in a sqlite table next to it,
+#   a file is read again only if its size or modify time is changed, and embedded again only if its content hash is changed,
+#   so updating the index of a huge project only touches the changed files
+#   a small index is searched by brute force, a large one by an inverted file index (ivf),
+#   the vectors are clustered by k-means and only the lists of the nearest centroids are scanned
+#   numpy is required
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from system import code_chunker
+
+
+class ProjectIndex(object):
+    '''
+    ProjectIndex keeps the embeddings of the code chunks of a project
+    embed(texts) returns the embedding vectors of the texts, it's called in the thread that updates the index
+    '''
+
+    SOURCE_EXTENSIONS = (
+        '.py', '.lua', '.c', '.h', '.cc', '.cpp', '.hpp', '.cs', '.java', '.js', '.ts', '.go', '.rs',
+        '.shader', '.hlsl', '.glsl', '.md', '.txt', '.json', '.xml', '.yaml', '.yml', '.ini', '.sh', '.bat',
+    )
+    IGNORE_DIRS = ('.git', '.svn', '.hg', '__pycache__', 'node_modules', '.venv', 'venv', 'build', 'dist', 'Library', 'Temp', 'obj', 'bin')
+    # the huge files are usually generated, skip them
+    MAX_FILE_SIZE = 1024 * 1024
+    # the text of a chunk that is embedded, the rest is ignored
+    MAX_CHUNK_CHARS = 6000
+    BATCH_SIZE = 64
+    MIN_CAPACITY = 1024
+    # the ivf index is built when there are more chunks than this, the brute force search is exact and fast enough below it
+    IVF_MIN_CHUNKS = 50000
+    # how many lists of the ivf index are scanned by a query
+    IVF_PROBES = 8
+    # the centroids are trained on a sample of the vectors
+    IVF_SAMPLE_SIZE = 20000
+    IVF_ITERATIONS = 8
+    # the ivf index is trained again when the count of chunks is changed by this ratio
+    IVF_RETRAIN_RATIO = 0.5
+
+    def __init__(self, index_dir, use_ivf=None):
+        super().__init__()
+        if numpy is None:
+            raise ImportError("numpy is required by the project index, please install it by 'pip install numpy'")
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        self.vector_file = os.path.join(index_dir, 'vectors.f32')
+        self.mutex = threading.RLock()
+
+        self.db = sqlite3.connect(os.path.join(index_dir, 'index.sqlite'), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash TEXT, size INTEGER, mtime REAL);
+            CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, path TEXT, symbol TEXT, start_line INTEGER, end_line INTEGER);
+            CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path);
+        ''')
+        self.db.commit()
+
+        self.dim = int(self.get_meta('dim', 0))
+        self.capacity = int(self.get_meta('capacity', 0))
+        self.matrix = None
+        # valid[row] is True if the row holds the vector of a chunk
+        self.valid = numpy.zeros(self.capacity, dtype=bool)
+        self.free_rows = []
+        # None means the ivf index is used only when the index is large
+        self.use_ivf = use_ivf
+        # the centroids of the ivf lists, assignments[row] is the list of the row, -1 means not assigned
+        self.centroids = None
+        self.assignments = None
+        self.ivf_chunks = 0
+        self.open_matrix()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def open_matrix(self):
+        if not self.dim or not self.capacity or not os.path.exists(self.vector_file):
+            self.capacity = 0
+            self.valid = numpy.zeros(0, dtype=bool)
+            return
+        self.matrix = numpy.memmap(self.vector_file, dtype=numpy.float32, mode='r+', shape=(self.capacity, self.dim))
+        self.valid = numpy.zeros(self.capacity, dtype=bool)
+        rows = [row for (row,) in self.db.execute('SELECT row FROM chunks')]
+        if rows:
+            self.valid[numpy.asarray(rows, dtype=numpy.int64)] = True
+        self.free_rows = [int(row) for row in numpy.flatnonzero(~self.valid)[::-1]]
+
+    def grow(self, needed):
+        '''
+        make room for needed more rows, the matrix file is doubled
+        '''
+        if len(self.free_rows) >= needed:
+            return
+        capacity = max(self.MIN_CAPACITY, self.capacity * 2)
+        while capacity - self.capacity + len(self.free_rows) < needed:
+            capacity *= 2
+
+        temp_file = self.vector_file + '.tmp'
+        matrix = numpy.memmap(temp_file, dtype=numpy.float32, mode='w+', shape=(capacity, self.dim))
+        if self.matrix is not None:
+            matrix[:self.capacity] = self.matrix
+            self.matrix.flush()
+            del self.matrix
+        matrix.flush()
+        del matrix
+        os.replace(temp_file, self.vector_file)
+
+        self.free_rows = list(range(capacity - 1, self.capacity - 1, -1)) + self.free_rows
+        self.valid = numpy.concatenate([self.valid, numpy.zeros(capacity - self.capacity, dtype=bool)])
+        if self.assignments is not None:
+            self.assignments = numpy.concatenate([self.assignments, numpy.full(capacity - self.capacity, -1, dtype=numpy.int32)])
+        self.capacity = capacity
+        self.set_meta('capacity', capacity)
+        self.db.commit()
+        self.matrix = numpy.memmap(self.vector_file, dtype=numpy.float32, mode='r+', shape=(self.capacity, self.dim))
+
+    def clear(self):
+        '''
+        remove all the vectors, used when the embedding model is changed
+        '''
+        with self.mutex:
+            self.db.execute('DELETE FROM files')
+            self.db.execute('DELETE FROM chunks')
+            self.set_meta('dim', 0)
+            self.set_meta('capacity', 0)
+            self.db.commit()
+            self.matrix = None
+            if os.path.exists(self.vector_file):
+                os.remove(self.vector_file)
+            self.dim = 0
+            self.capacity = 0
+            self.valid = numpy.zeros(0, dtype=bool)
+            self.free_rows = []
+            self.reset_ivf()
+
+    def collect_files(self, root_dir):
+        '''
+        return {relative path: (absolute path, size, mtime)} of the source files
+        '''
+        files = {}
+        for current_dir, dir_names, file_names in os.walk(root_dir):
+            dir_names[:] = [name for name in dir_names if name not in self.IGNORE_DIRS and not name.startswith('.')]
+            for name in file_names:
+                if not name.endswith(self.SOURCE_EXTENSIONS):
+                    continue
+                file_path = os.path.join(current_dir, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if stat.st_size > self.MAX_FILE_SIZE:
+                    continue
+                relative_path = os.path.relpath(file_path, root_dir).replace(os.sep, '/')
+                files[relative_path] = (file_path, stat.st_size, stat.st_mtime)
+        return files
+
+    def remove_file(self, relative_path):
+        # called with the mutex acquired
+        rows = [row for (row,) in self.db.execute('SELECT row FROM chunks WHERE path = ?', (relative_path,))]
+        for row in rows:
+            self.valid[row] = False
+            self.free_rows.append(row)
+        self.db.execute('DELETE FROM chunks WHERE path = ?', (relative_path,))
+        self.db.execute('DELETE FROM files WHERE path = ?', (relative_path,))
+
+    def normalize(self, vectors):
+        matrix = numpy.asarray(vectors, dtype=numpy.float32)
+        norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def write_chunks(self, relative_path, file_hash, size, mtime, chunks, vectors):
+        with self.mutex:
+            vectors = self.normalize(vectors)
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self.set_meta('dim', self.dim)
+            self.remove_file(relative_path)
+            self.grow(len(chunks))
+            for chunk, vector in zip(chunks, vectors):
+                row = self.free_rows.pop()
+                self.matrix[row] = vector # type: ignore
+                self.valid[row] = True
+                if self.centroids is not None:
+                    # a new vector joins the list of its nearest centroid, the centroids are not moved
+                    self.assignments[row] = int(numpy.argmax(self.centroids @ vector)) # type: ignore
+                self.db.execute('INSERT INTO chunks (row, path, symbol, start_line, end_line) VALUES (?, ?, ?, ?, ?)',
+                                (row, relative_path, chunk.symbol, chunk.start_line, chunk.end_line))
+            self.db.execute('INSERT OR REPLACE INTO files (path, hash, size, mtime) VALUES (?, ?, ?, ?)',
+                            (relative_path, file_hash, size, mtime))
+
+    def update(self, root_dir, embed, embed_name='', progress=None, cancel_event=None):
+        '''
+        update the index of the files under root_dir
+        embed_name tells the embedding model, the index is rebuilt when it is changed
+        progress(done files, total files, message) is called in current thread
+        return {'files', 'changed', 'removed', 'chunks', 'seconds'}
+        '''
+        begin = time.perf_counter()
+        with self.mutex:
+            if embed_name != self.get_meta('embed_name', embed_name):
+                self.clear()
+            self.set_meta('embed_name', embed_name)
+
+        files = self.collect_files(root_dir)
+        result = {'files': len(files), 'changed': 0, 'removed': 0, 'chunks': 0, 'seconds': 0.0}
+
+        with self.mutex:
+            known = {path: (file_hash, size, mtime) for path, file_hash, size, mtime in self.db.execute('SELECT path, hash, size, mtime FROM files')}
+            for relative_path in set(known) - set(files):
+                self.remove_file(relative_path)
+                result['removed'] += 1
+            self.db.commit()
+
+        # the chunks waiting for embedding, they are embedded in batches across files
+        pending = []
+        pending_texts = []
+
+        def flush():
+            if not pending:
+                return
+            vectors = []
+            for start in range(0, len(pending_texts), self.BATCH_SIZE):
+                vectors.extend(embed(pending_texts[start:start + self.BATCH_SIZE]))
+            offset = 0
+            for relative_path, file_hash, size, mtime, chunks in pending:
+                self.write_chunks(relative_path, file_hash, size, mtime, chunks, vectors[offset:offset + len(chunks)])
+                offset += len(chunks)
+            with self.mutex:
+                self.set_meta('capacity', self.capacity)
+                if self.matrix is not None:
+                    self.matrix.flush()
+                self.db.commit()
+            pending.clear()
+            pending_texts.clear()
+
+        for done, (relative_path, (file_path, size, mtime)) in enumerate(sorted(files.items()), 1):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if progress and done % 200 == 0:
+                progress(done, len(files), relative_path)
+
+            old = known.get(relative_path)
+            # the size and modify time are not changed, don't read the file
+            if old is not None and old[1] == size and old[2] == mtime:
+                continue
+            try:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            file_hash = hashlib.sha1(data).hexdigest()
+            if old is not None and old[0] == file_hash:
+                # only touched, remember the new modify time
+                with self.mutex:
+                    self.db.execute('UPDATE files SET size = ?, mtime = ? WHERE path = ?', (size, mtime, relative_path))
+                continue
+
+            text = data.decode('utf-8', errors='replace')
+            chunks = code_chunker.chunk_source(relative_path, text)
+            result['changed'] += 1
+            if not chunks:
+                with self.mutex:
+                    self.remove_file(relative_path)
+                    self.db.execute('INSERT OR REPLACE INTO files (path, hash, size, mtime) VALUES (?, ?, ?, ?)',
+                                    (relative_path, file_hash, size, mtime))
+                continue
+            pending.append((relative_path, file_hash, size, mtime, chunks))
+            pending_texts.extend("{}: {}\n{}".format(relative_path, chunk.symbol, chunk.text)[:self.MAX_CHUNK_CHARS] for chunk in chunks)
+            result['chunks'] += len(chunks)
+            if len(pending_texts) >= self.BATCH_SIZE * 4:
+                flush()
+
+        flush()
+        with self.mutex:
+            self.db.commit()
+        result['seconds'] = time.perf_counter() - begin
+        if progress:
+            progress(len(files), len(files), "completed")
+        return result
+
+    def reset_ivf(self):
+        self.centroids = None
+        self.assignments = None
+        self.ivf_chunks = 0
+
+    def is_ivf_enabled(self, chunks):
+        if self.use_ivf is None:
+            return chunks >= self.IVF_MIN_CHUNKS
+        return self.use_ivf
+
+    def build_ivf(self, lists=None):
+        '''
+        train the centroids by k-means on a sample of the vectors, and assign every vector to its nearest centroid
+        called with the mutex acquired
+        '''
+        rows = numpy.flatnonzero(self.valid)
+        if lists is None:
+            lists = int(numpy.sqrt(len(rows)))
+        lists = max(1, min(lists, 4096, len(rows)))
+
+        generator = numpy.random.default_rng(0)
+        sample_rows = numpy.sort(generator.choice(rows, min(len(rows), self.IVF_SAMPLE_SIZE), replace=False))
+        sample = numpy.asarray(self.matrix[sample_rows]) # type: ignore
+        centroids = sample[generator.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(self.IVF_ITERATIONS):
+            nearest = numpy.argmax(sample @ centroids.T, axis=1)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, nearest, sample)
+            counts = numpy.bincount(nearest, minlength=lists)
+            # an empty list keeps its old centroid
+            filled = counts > 0
+            centroids[filled] = self.normalize(sums[filled])
+
+        assignments = numpy.full(self.capacity, -1, dtype=numpy.int32)
+        for start in range(0, len(rows), 16384):
+            block = rows[start:start + 16384]
+            assignments[block] = numpy.argmax(numpy.asarray(self.matrix[block]) @ centroids.T, axis=1) # type: ignore
+        self.centroids = centroids
+        self.assignments = assignments
+        self.ivf_chunks = len(rows)
+
+    def get_candidate_rows(self, query, top_k, probes):
+        '''
+        return the rows in the nearest ivf lists of the query, or None to search all the rows
+        called with the mutex acquired
+        '''
+        chunks = int(self.valid.sum())
+        if not self.is_ivf_enabled(chunks):
+            self.reset_ivf()
+            return None
+        if self.centroids is None or abs(chunks - self.ivf_chunks) > self.ivf_chunks * self.IVF_RETRAIN_RATIO:
+            self.build_ivf()
+
+        probes = min(probes or self.IVF_PROBES, len(self.centroids)) # type: ignore
+        lists = numpy.argpartition(-(self.centroids @ query), probes - 1)[:probes] # type: ignore
+        rows = numpy.flatnonzero(numpy.isin(self.assignments, lists) & self.valid)
+        # too few candidates, the nearest lists are almost empty
+        if len(rows) < top_k:
+            return None
+        return rows
+
+    def search(self, vector, top_k=10, probes=None):
+        '''
+        return [(score, path, symbol, start line, end line)] of the chunks most similar to the vector
+        probes is how many ivf lists are scanned if the ivf index is used
+        '''
+        with self.mutex:
+            if self.matrix is None or not self.valid.any():
+                return []
+            query = self.normalize([vector])[0]
+            if query.shape[0] != self.dim:
+                return []
+            candidates = self.get_candidate_rows(query, top_k, probes)
+            if candidates is None:
+                scores = numpy.asarray(self.matrix @ query)
+                scores[~self.valid] = -numpy.inf
+                candidates = numpy.arange(self.capacity)
+            else:
+                scores = numpy.asarray(self.matrix[candidates] @ query)
+            top_k = min(top_k, int(self.valid.sum()), len(candidates))
+            best = numpy.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[numpy.argsort(-scores[best])]
+            result = []
+            for index in best:
+                row = int(candidates[index])
+                chunk = self.db.execute('SELECT path, symbol, start_line, end_line FROM chunks WHERE row = ?', (row,)).fetchone()
+                if chunk:
+                    result.append((float(scores[index]),) + tuple(chunk))
+            return result
+
+    def get_statistics(self):
+        '''
+        return (files, chunks, capacity, dim)
+        '''
+        with self.mutex:
+            files = self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            return files, int(self.valid.sum()), self.capacity, self.dim
+
+    def close(self):
+        with self.mutex:
+            if self.matrix is not None:
+                self.matrix.flush()
+            self.db.close()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Purpose: share one upstream chat request between the identical requests that run at the same time
+#   the first request is sent to the supply, the later ones attach to it,
+#   they receive the chunks already streamed and then every new chunk,
+#   the upstream request is cancelled only when all the attached requests are cancelled
+
+import threading
+import time
+
+from system.llm import llm_interface
+from system import request_scheduler
+
+
+class InflightRequest(object):
+    '''
+    InflightRequest fans the stream of one upstream request out to all the attached callbacks
+    '''
+
+    def __init__(self, key, on_completed):
+        super().__init__()
+        self.key = key
+        self.on_completed = on_completed
+        self.mutex = threading.Lock()
+        self.chunks = []
+        self.subscribers = []
+        self.completed = False
+        self.upstream = None
+
+    def dispatch(self, text, reason=None):
+        '''
+        the callback of the upstream request
+        '''
+        self.mutex.acquire()
+        if text:
+            # a late subscriber only needs the text after the last replacement
+            if reason == llm_interface.LLMInterface.ReasonCode.NEW_REPLY:
+                self.chunks.clear()
+            self.chunks.append((text, reason))
+        else:
+            self.completed = True
+        subscribers = list(self.subscribers)
+        self.mutex.release()
+
+        if not text:
+            # no one can attach to a completed request
+            self.on_completed(self)
+        for subscriber in subscribers:
+            subscriber.send(text, reason)
+
+    def subscribe(self, callback):
+        '''
+        attach a callback, return its CoalescedRequest, or None if the upstream request is completed
+        '''
+        subscriber = CoalescedRequest(self, callback)
+        self.mutex.acquire()
+        # a cancelled upstream request is going to complete without the reply
+        if self.completed or (self.upstream is not None and self.upstream.is_cancelled()):
+            self.mutex.release()
+            return None
+        # replay the chunks streamed before, the lock keeps the order with the new chunks
+        for text, reason in self.chunks:
+            subscriber.send(text, reason)
+        self.subscribers.append(subscriber)
+        self.mutex.release()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.mutex.acquire()
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        remain = len(self.subscribers)
+        upstream = self.upstream
+        self.mutex.release()
+
+        # nobody waits for the reply, stop the upstream request,
+        # if it's not submitted yet, set_upstream cancels it
+        if remain == 0 and upstream is not None:
+            upstream.cancel()
+
+    def set_upstream(self, upstream):
+        self.mutex.acquire()
+        self.upstream = upstream
+        remain = len(self.subscribers)
+        self.mutex.release()
+
+        # all the subscribers are cancelled while the request is submitted
+        if remain == 0 and upstream is not None:
+            upstream.cancel()
+
+
+class CoalescedRequest(object):
+    '''
+    CoalescedRequest is the handle of one attached request, it has the same methods as ScheduledRequest
+    '''
+
+    def __init__(self, inflight, callback):
+        super().__init__()
+        self.inflight = inflight
+        self.callback = callback
+        self.state = request_scheduler.ScheduledRequest.RUNNING
+        self.submit_time = time.time()
+        self.end_time = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def send(self, text, reason=None):
+        if self.cancel_event.is_set():
+            return
+        if text:
+            if self.callback:
+                self.callback(text, reason)
+            return
+        self.finish(request_scheduler.ScheduledRequest.COMPLETED)
+
+    def finish(self, state):
+        self.state = state
+        self.end_time = time.time()
+        if self.callback:
+            self.callback("")
+        self.done_event.set()
+
+    def cancel(self):
+        if self.cancel_event.is_set() or self.done_event.is_set():
+            return
+        self.cancel_event.set()
+        self.inflight.unsubscribe(self)
+        if self.callback:
+            self.callback("Request is cancelled.", llm_interface.LLMInterface.ReasonCode.FAILED)
+        self.finish(request_scheduler.ScheduledRequest.CANCELLED)
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+    def get_state(self):
+        return self.state
+
+
+class RequestCoalescer(object):
+    '''
+    RequestCoalescer keeps the inflight requests by the key of their content
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.mutex = threading.Lock()
+        self.inflight = {}
+        self.coalesced = 0
+
+    def submit(self, key, callback, submit):
+        '''
+        attach the callback to the inflight request of the key,
+        or start a new one by submit(dispatch), which sends the request to the supply and returns the upstream request
+        return the handle of the callback
+        '''
+        self.mutex.acquire()
+        inflight = self.inflight.get(key)
+        if inflight is not None:
+            subscriber = inflight.subscribe(callback)
+            if subscriber is not None:
+                self.coalesced += 1
+                self.mutex.release()
+                return subscriber
+
+        inflight = InflightRequest(key, self.on_completed)
+        subscriber = inflight.subscribe(callback)
+        self.inflight[key] = inflight
+        self.mutex.release()
+
+        inflight.set_upstream(submit(inflight.dispatch))
+        return subscriber
+
+    def on_completed(self, inflight):
+        self.mutex.acquire()
+        if self.inflight.get(inflight.key) is inflight:
+            del self.inflight[inflight.key]
+        self.mutex.release()
+
+    def get_statistics(self):
+        '''
+        return (inflight requests, coalesced requests in total)
+        '''
+        self.mutex.acquire()
+        result = len(self.inflight), self.coalesced
+        self.mutex.release()
+        return result
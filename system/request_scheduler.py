@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Purpose: schedule the chat requests of all the llm providers
+#   every provider has a concurrency limit and rate limits of requests per minute and tokens per minute,
+#   the requests wait in a priority queue of their provider and are dispatched when the limits allow,
+#   a request can be cancelled while it's waiting or running
+
+import heapq
+import itertools
+import threading
+import time
+
+from system.llm import llm_interface
+
+
+class TokenBucket(object):
+    '''
+    TokenBucket refills `rate_per_minute` tokens every minute, and holds at most one minute of tokens
+    rate_per_minute <= 0 means unlimited
+    '''
+
+    def __init__(self, rate_per_minute):
+        super().__init__()
+        self.rate_per_minute = rate_per_minute
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self.last_time
+        self.last_time = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_minute / 60.0)
+
+    def wait_time(self, amount, now):
+        '''
+        seconds to wait until the amount of tokens are available, 0 if they are available now
+        '''
+        if self.rate_per_minute <= 0:
+            return 0.0
+        self.refill(now)
+        # a request bigger than the bucket only waits for a full bucket, otherwise it waits forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.rate_per_minute
+
+    def consume(self, amount):
+        if self.rate_per_minute <= 0:
+            return
+        self.tokens -= min(amount, self.capacity)
+
+
+class ScheduledRequest(object):
+    '''
+    ScheduledRequest is the handle of a request in the scheduler, it can be waited or cancelled
+    the scheduler is woken up when the request is cancelled, so a queued request is dropped at once
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, request_id, supply, priority, tokens, kwargs, scheduler=None):
+        super().__init__()
+        self.scheduler = scheduler
+        self.request_id = request_id
+        self.supply = supply
+        self.priority = priority
+        self.tokens = tokens
+        self.kwargs = kwargs
+        self.callback = kwargs.get('callback', None)
+        self.state = ScheduledRequest.QUEUED
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+        # the dispatcher may be waiting for a running request of the supply, it drops the queued request now
+        if self.scheduler is not None:
+            self.scheduler.wake_up()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+    def get_state(self):
+        return self.state
+
+
+class RequestScheduler(object):
+    '''
+    RequestScheduler dispatches the requests of every provider within its limits
+    quotas is {supply: {'concurrency': n, 'rpm': requests per minute, 'tpm': tokens per minute}}
+    '''
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 10
+    PRIORITY_LOW = 20
+
+    DEFAULT_QUOTA = {'concurrency': 2, 'rpm': 60, 'tpm': 0}
+
+    def __init__(self, execute, quotas=None):
+        '''
+        execute(supply, kwargs) runs the request in current thread, it returns when the request is completed
+        '''
+        super().__init__()
+        self.execute = execute
+        self.quotas = {}
+        self.condition = threading.Condition()
+        self.queues = {}
+        self.running = {}
+        self.request_buckets = {}
+        self.token_buckets = {}
+        self.request_ids = itertools.count(1)
+        self.stopped = False
+
+        self.set_quotas(quotas or {})
+
+        self.dispatch_thread = threading.Thread(target=self.dispatch_loop, name='request-scheduler', daemon=True)
+        self.dispatch_thread.start()
+
+    def set_quotas(self, quotas):
+        self.condition.acquire()
+        self.quotas = dict(quotas)
+        # rebuild the buckets, the new quota takes effect immediately
+        self.request_buckets = {}
+        self.token_buckets = {}
+        self.condition.notify_all()
+        self.condition.release()
+
+    def get_quota(self, supply):
+        quota = dict(self.DEFAULT_QUOTA)
+        quota.update(self.quotas.get(supply, {}))
+        return quota
+
+    def get_buckets(self, supply):
+        # called with the condition acquired
+        if supply not in self.request_buckets:
+            quota = self.get_quota(supply)
+            self.request_buckets[supply] = TokenBucket(quota['rpm'])
+            self.token_buckets[supply] = TokenBucket(quota['tpm'])
+        return self.request_buckets[supply], self.token_buckets[supply]
+
+    def submit(self, supply, kwargs, priority=PRIORITY_NORMAL, tokens=0):
+        '''
+        queue a chat request, tokens is the estimated prompt tokens used by the tokens per minute limit
+        lower priority value is dispatched first, the requests with the same priority are dispatched in order
+        '''
+        request = ScheduledRequest(next(self.request_ids), supply, priority, tokens, kwargs, self)
+        self.condition.acquire()
+        queue = self.queues.setdefault(supply, [])
+        heapq.heappush(queue, (priority, request.request_id, request))
+        self.condition.notify_all()
+        self.condition.release()
+        return request
+
+    def cancel(self, request):
+        '''
+        cancel a request, a queued request is removed at once, the replies of a running request are dropped
+        '''
+        request.cancel()
+        self.wake_up()
+
+    def wake_up(self):
+        self.condition.acquire()
+        self.condition.notify_all()
+        self.condition.release()
+
+    def get_statistics(self):
+        '''
+        return {supply: (queued requests, running requests)}
+        '''
+        self.condition.acquire()
+        supplies = set(self.queues) | set(self.running)
+        result = {supply: (len(self.queues.get(supply, [])), self.running.get(supply, 0)) for supply in supplies}
+        self.condition.release()
+        return result
+
+    def dispatch_loop(self):
+        self.condition.acquire()
+        while not self.stopped:
+            wait_time = None
+            now = time.monotonic()
+            for supply, queue in self.queues.items():
+                self.drop_cancelled(queue)
+                while queue:
+                    quota = self.get_quota(supply)
+                    if self.running.get(supply, 0) >= quota['concurrency']:
+                        break
+
+                    request = queue[0][2]
+                    request_bucket, token_bucket = self.get_buckets(supply)
+                    delay = max(request_bucket.wait_time(1, now), token_bucket.wait_time(request.tokens, now))
+                    if delay > 0:
+                        wait_time = delay if wait_time is None else min(wait_time, delay)
+                        break
+
+                    heapq.heappop(queue)
+                    request_bucket.consume(1)
+                    token_bucket.consume(request.tokens)
+                    self.start_request(request)
+
+            # wait for a new request, a completed request, or the buckets are refilled
+            self.condition.wait(wait_time)
+        self.condition.release()
+
+    def drop_cancelled(self, queue):
+        # called with the condition acquired
+        cancelled = [item for item in queue if item[2].is_cancelled()]
+        if not cancelled:
+            return
+        queue[:] = [item for item in queue if not item[2].is_cancelled()]
+        heapq.heapify(queue)
+        for _, _, request in cancelled:
+            # finish the request in another thread, the callback should not run with the lock acquired
+            threading.Thread(target=self.finish_cancelled, args=(request,), daemon=True).start()
+
+    def finish_cancelled(self, request):
+        request.state = ScheduledRequest.CANCELLED
+        request.end_time = time.time()
+        if request.callback:
+            request.callback("Request is cancelled.", llm_interface.LLMInterface.ReasonCode.FAILED)
+            request.callback("")
+        request.done_event.set()
+
+    def start_request(self, request):
+        # called with the condition acquired
+        self.running[request.supply] = self.running.get(request.supply, 0) + 1
+        request.state = ScheduledRequest.RUNNING
+        request.start_time = time.time()
+        threading.Thread(target=self.run_request, args=(request,), daemon=True).start()
+
+    def run_request(self, request):
+        callback = request.callback
+
+        def scheduled_callback(text, reason=None):
+            # the completion is sent once after the request returns
+            if not text:
+                return
+            # drop the replies of a cancelled request
+            if request.is_cancelled():
+                return
+            if callback:
+                callback(text, reason)
+
+        kwargs = dict(request.kwargs)
+        kwargs['callback'] = scheduled_callback
+        # the provider can stop the stream early if it supports cancel_event
+        kwargs['cancel_event'] = request.cancel_event
+        try:
+            self.execute(request.supply, kwargs)
+        except Exception as e:
+            scheduled_callback("Request failed: {}".format(e), llm_interface.LLMInterface.ReasonCode.FAILED)
+
+        request.end_time = time.time()
+        if request.is_cancelled():
+            request.state = ScheduledRequest.CANCELLED
+            if callback:
+                callback("Request is cancelled.", llm_interface.LLMInterface.ReasonCode.FAILED)
+        else:
+            request.state = ScheduledRequest.COMPLETED
+        if callback:
+            callback("")
+
+        self.condition.acquire()
+        self.running[request.supply] -= 1
+        self.condition.notify_all()
+        self.condition.release()
+        request.done_event.set()
+
+    def stop(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notify_all()
+        self.condition.release()
+
+    def InterfaceSubmit(self, supply, kwargs, priority=PRIORITY_NORMAL, tokens=0):
+        return self.submit(supply, kwargs, priority, tokens)
+
+    def InterfaceCancel(self, request):
+        return self.cancel(request)
+
+    def InterfaceGetStatistics(self):
+        return self.get_statistics()
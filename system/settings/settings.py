@@ -7,9 +7,46 @@ import os
 class Settings(object):
     '''
     Settings is a singleton class, it is used to load, parse and save setting file
+
+    Every value is versioned, setters only bump the version and notify the
+    listeners when the value really changes, so the users of the settings
+    can rebuild only the parts that depend on the changed value.
     '''
     _instance = None
 
+    # map the key in config.json to the attribute name
+    CONF_ATTRIBUTES = {
+        'openai_api_key': 'open_ai_key',
+        'google_palm_key': 'google_palm_key',
+        'project_root_dir': 'project_root_dir',
+        'result_json_dir': 'result_json_dir',
+        'slack_token': 'slack_token',
+        'claude_user_id': 'claude_user_id',
+        'general_channel_id': 'general_channel_id',
+        'model_cache_ttl': 'model_cache_ttl',
+        'slack_app_token': 'slack_app_token',
+        'slack_events_port': 'slack_events_port',
+        'slack_events_host': 'slack_events_host',
+        'slack_signing_secret': 'slack_signing_secret',
+        'provider_quotas': 'provider_quotas',
+        'response_cache_enabled': 'response_cache_enabled',
+        'response_cache_size_mb': 'response_cache_size_mb',
+        'semantic_cache_enabled': 'semantic_cache_enabled',
+        'semantic_cache_threshold': 'semantic_cache_threshold',
+        'semantic_cache_supply': 'semantic_cache_supply',
+        'context_token_budget': 'context_token_budget',
+        'context_completion_reserve': 'context_completion_reserve',
+        'context_summarize': 'context_summarize',
+        'example_token_budget': 'example_token_budget',
+        'project_index_supply': 'project_index_supply',
+        'example_slice_tokens': 'example_slice_tokens',
+        'validation_enabled': 'validation_enabled',
+        'validation_lint_command': 'validation_lint_command',
+        'validation_test_command': 'validation_test_command',
+        'validation_timeout': 'validation_timeout',
+        'best_of_count': 'best_of_count',
+    }
+
     def __new__(cls):
         if cls._instance is None:
             cls.instance = super().__new__(cls)
@@ -26,6 +63,57 @@ class Settings(object):
         self.slack_token = ""
         self.claude_user_id = ""
         self.general_channel_id = ""
+        # seconds before the cached model list is revalidated
+        self.model_cache_ttl = 24 * 60 * 60
+        # claude's reply is pushed by socket mode if the app-level token is set,
+        # or by the events api if the port is set, otherwise we poll the slack thread
+        self.slack_app_token = ""
+        self.slack_events_port = 0
+        # the events api server only listens on this machine unless the host is changed,
+        # its requests must be signed by the signing secret of the slack app, it's disabled without the secret
+        self.slack_events_host = "127.0.0.1"
+        self.slack_signing_secret = ""
+        # the limits of the request scheduler for every supply,
+        # concurrency requests, requests per minute and tokens per minute, 0 means unlimited
+        self.provider_quotas = {
+            'OpenAI': {'concurrency': 4, 'rpm': 3500, 'tpm': 90000},
+            'Google': {'concurrency': 2, 'rpm': 60, 'tpm': 0},
+            'Slack': {'concurrency': 1, 'rpm': 30, 'tpm': 0},
+        }
+        # the responses of the same request are replayed from the cache,
+        # the least recently used responses are removed when the cache on disk is bigger than the size
+        self.response_cache_enabled = True
+        self.response_cache_size_mb = 256
+        # the response of a similar prompt is served when the cosine similarity of their embeddings is above the threshold,
+        # the prompts are embedded by the supply, it needs numpy
+        self.semantic_cache_enabled = False
+        self.semantic_cache_threshold = 0.95
+        self.semantic_cache_supply = 'OpenAI'
+        # the old turns of a long chat are dropped or truncated to fit the prompt into the budget,
+        # 0 means the context window of the model minus the tokens reserved for the completion,
+        # the dropped turns are summarized if context_summarize is set, it costs an extra request
+        self.context_token_budget = 0
+        self.context_completion_reserve = 1024
+        self.context_summarize = False
+        # the max tokens of the packed examples, 0 means the room left by the prompts in the context budget
+        self.example_token_budget = 0
+        # the supply that embeds the code chunks of the project index
+        self.project_index_supply = 'OpenAI'
+        # an example file longer than the tokens is reduced to the symbols relevant to the prompts, 0 means never
+        self.example_slice_tokens = 2000
+        # the code blocks of a reply are validated when it's completed, the lint and test commands are optional,
+        # {file} in a command is replaced by the file of the code block, or the file is appended to the command
+        self.validation_enabled = True
+        self.validation_lint_command = ''
+        self.validation_test_command = ''
+        self.validation_timeout = 30
+        # how many candidates are generated by a request, the best one is shown, 1 means only one reply
+        self.best_of_count = 1
+
+        # version is increased every time a value is changed
+        self.version = 0
+        self.value_versions = {}
+        self.change_listeners = []
 
         self.init_conf_file()
 
@@ -55,35 +143,42 @@ class Settings(object):
         '''
         unpack the config json file
         '''
-        if 'openai_api_key' in conf_json:
-            self.open_ai_key = conf_json['openai_api_key']
-
-        if 'google_palm_key' in conf_json:
-            self.google_palm_key = conf_json['google_palm_key']
+        for conf_key, attribute in self.CONF_ATTRIBUTES.items():
+            if conf_key in conf_json:
+                setattr(self, attribute, conf_json[conf_key])
 
-        if 'project_root_dir' in conf_json:
-            self.project_root_dir = conf_json['project_root_dir']
+    def pack_conf(self, conf_json):
+        for conf_key, attribute in self.CONF_ATTRIBUTES.items():
+            conf_json[conf_key] = getattr(self, attribute)
 
-        if 'result_json_dir' in conf_json:
-            self.result_json_dir = conf_json['result_json_dir']
+    def get_value(self, conf_key):
+        return getattr(self, self.CONF_ATTRIBUTES[conf_key])
 
-        if 'slack_token' in conf_json:
-            self.slack_token = conf_json['slack_token']
+    def set_value(self, conf_key, value):
+        '''
+        set a value by the key in config.json
+        only save the file and notify the listeners when the value is changed
+        return True if the value is changed
+        '''
+        old_value = self.get_value(conf_key)
+        if old_value == value:
+            return False
 
-        if 'claude_user_id' in conf_json:
-            self.claude_user_id = conf_json['claude_user_id']
+        setattr(self, self.CONF_ATTRIBUTES[conf_key], value)
+        self.version += 1
+        self.value_versions[conf_key] = self.version
+        self.save_conf()
 
-        if 'general_channel_id' in conf_json:
-            self.general_channel_id = conf_json['general_channel_id']
+        # copy the list, a listener may remove itself when it is notified
+        for listener in list(self.change_listeners):
+            listener(conf_key, old_value, value, self.version)
+        return True
 
-    def pack_conf(self, conf_json):
-        conf_json['openai_api_key'] = self.open_ai_key
-        conf_json['google_palm_key'] = self.google_palm_key
-        conf_json['project_root_dir'] = self.project_root_dir
-        conf_json['result_json_dir'] = self.result_json_dir
-        conf_json['slack_token'] = self.slack_token
-        conf_json['claude_user_id'] = self.claude_user_id
-        conf_json['general_channel_id'] = self.general_channel_id
+    def get_value_version(self, conf_key):
+        '''
+        get the version of the last change of the value, 0 means never changed
+        '''
+        return self.value_versions.get(conf_key, 0)
 
     def save_conf(self):
         '''
@@ -120,6 +215,30 @@ class Settings(object):
         '''
         self.save_conf()
 
+    def InterfaceGetVersion(self):
+        '''
+        Interface, called outside
+        get the version of the settings, it is increased when any value is changed
+        '''
+        return self.version
+
+    def InterfaceAddChangeListener(self, listener):
+        '''
+        Interface, called outside
+        add a listener, it is called as listener(conf_key, old_value, new_value, version)
+        only when a value is really changed
+        '''
+        if listener not in self.change_listeners:
+            self.change_listeners.append(listener)
+
+    def InterfaceRemoveChangeListener(self, listener):
+        '''
+        Interface, called outside
+        remove a listener added by InterfaceAddChangeListener
+        '''
+        if listener in self.change_listeners:
+            self.change_listeners.remove(listener)
+
     def InterfaceGetOpenAIKey(self):
         '''
         Interface, called outside
@@ -146,24 +265,21 @@ class Settings(object):
         Interface, called outside
         set the openai key
         '''
-        self.open_ai_key = key
-        self.save_conf()
+        return self.set_value('openai_api_key', key)
 
     def InterfaceSetGooglePalmKey(self, key):
         '''
         Interface, called outside
         set the google palm key
         '''
-        self.google_palm_key = key
-        self.save_conf()
+        return self.set_value('google_palm_key', key)
 
     def InterfaceSetProjectRootDir(self, dir):
         '''
         Interface, called outside
         set the project root dir
         '''
-        self.project_root_dir = dir
-        self.save_conf()
+        return self.set_value('project_root_dir', dir)
 
     def InterfaceGetProjectRootDir(self):
         '''
@@ -177,8 +293,7 @@ class Settings(object):
         Interface, called outside
         set the result json dir
         '''
-        self.result_json_dir = dir
-        self.save_conf()
+        return self.set_value('result_json_dir', dir)
 
     def InterfaceGetResultJsonDir(self):
         '''
@@ -192,24 +307,21 @@ class Settings(object):
         Interface, called outside
         set the slack token
         '''
-        self.slack_token = token
-        self.save_conf()
+        return self.set_value('slack_token', token)
 
     def InterfaceSetClaudeUserID(self, id):
         '''
         Interface, called outside
         set the claude user id
         '''
-        self.claude_user_id = id
-        self.save_conf()
+        return self.set_value('claude_user_id', id)
 
     def InterfaceSetGeneralChannelID(self, id):
         '''
         Interface, called outside
         set the general channel id
         '''
-        self.general_channel_id = id
-        self.save_conf()
+        return self.set_value('general_channel_id', id)
 
     def InterfaceGetSlackToken(self):
         '''
@@ -230,4 +342,277 @@ class Settings(object):
         Interface, called outside
         get the general channel id
         '''
-        return self.general_channel_id
\ No newline at end of file
+        return self.general_channel_id
+
+    def InterfaceGetModelCacheTTL(self):
+        '''
+        Interface, called outside
+        get the seconds before the cached model list is revalidated
+        '''
+        return self.model_cache_ttl
+
+    def InterfaceSetModelCacheTTL(self, ttl):
+        '''
+        Interface, called outside
+        set the seconds before the cached model list is revalidated
+        '''
+        return self.set_value('model_cache_ttl', ttl)
+
+    def InterfaceGetSlackAppToken(self):
+        '''
+        Interface, called outside
+        get the app-level token of slack, it's used by socket mode
+        '''
+        return self.slack_app_token
+
+    def InterfaceSetSlackAppToken(self, token):
+        '''
+        Interface, called outside
+        set the app-level token of slack, it's used by socket mode
+        '''
+        return self.set_value('slack_app_token', token)
+
+    def InterfaceGetSlackEventsPort(self):
+        '''
+        Interface, called outside
+        get the port that receives the slack events api requests, 0 means disabled
+        '''
+        return self.slack_events_port
+
+    def InterfaceSetSlackEventsPort(self, port):
+        '''
+        Interface, called outside
+        set the port that receives the slack events api requests, 0 means disabled
+        '''
+        return self.set_value('slack_events_port', port)
+
+    def InterfaceGetSlackEventsHost(self):
+        '''
+        Interface, called outside
+        get the address the slack events api server listens on
+        '''
+        return self.slack_events_host
+
+    def InterfaceSetSlackEventsHost(self, host):
+        '''
+        Interface, called outside
+        set the address the slack events api server listens on, 0.0.0.0 accepts the requests from the network
+        '''
+        return self.set_value('slack_events_host', host)
+
+    def InterfaceGetSlackSigningSecret(self):
+        '''
+        Interface, called outside
+        get the signing secret of the slack app, it verifies the events api requests
+        '''
+        return self.slack_signing_secret
+
+    def InterfaceSetSlackSigningSecret(self, secret):
+        '''
+        Interface, called outside
+        set the signing secret of the slack app, it verifies the events api requests
+        '''
+        return self.set_value('slack_signing_secret', secret)
+
+    def InterfaceGetProviderQuotas(self):
+        '''
+        Interface, called outside
+        get the concurrency and rate limits of every supply
+        '''
+        return self.provider_quotas
+
+    def InterfaceSetProviderQuotas(self, quotas):
+        '''
+        Interface, called outside
+        set the concurrency and rate limits of every supply
+        '''
+        return self.set_value('provider_quotas', quotas)
+
+    def InterfaceGetResponseCacheEnabled(self):
+        '''
+        Interface, called outside
+        get whether the responses of the same request are replayed from the cache
+        '''
+        return self.response_cache_enabled
+
+    def InterfaceSetResponseCacheEnabled(self, enabled):
+        '''
+        Interface, called outside
+        set whether the responses of the same request are replayed from the cache
+        '''
+        return self.set_value('response_cache_enabled', enabled)
+
+    def InterfaceGetResponseCacheSize(self):
+        '''
+        Interface, called outside
+        get the max size in MB of the response cache on disk
+        '''
+        return self.response_cache_size_mb
+
+    def InterfaceSetResponseCacheSize(self, size_mb):
+        '''
+        Interface, called outside
+        set the max size in MB of the response cache on disk
+        '''
+        return self.set_value('response_cache_size_mb', size_mb)
+
+    def InterfaceGetSemanticCacheEnabled(self):
+        '''
+        Interface, called outside
+        get whether the responses of similar prompts are served from the cache
+        '''
+        return self.semantic_cache_enabled
+
+    def InterfaceSetSemanticCacheEnabled(self, enabled):
+        '''
+        Interface, called outside
+        set whether the responses of similar prompts are served from the cache
+        '''
+        return self.set_value('semantic_cache_enabled', enabled)
+
+    def InterfaceGetSemanticCacheThreshold(self):
+        '''
+        Interface, called outside
+        get the min cosine similarity of a semantic cache hit
+        '''
+        return self.semantic_cache_threshold
+
+    def InterfaceSetSemanticCacheThreshold(self, threshold):
+        '''
+        Interface, called outside
+        set the min cosine similarity of a semantic cache hit
+        '''
+        return self.set_value('semantic_cache_threshold', threshold)
+
+    def InterfaceGetSemanticCacheSupply(self):
+        '''
+        Interface, called outside
+        get the supply that embeds the prompts of the semantic cache
+        '''
+        return self.semantic_cache_supply
+
+    def InterfaceSetSemanticCacheSupply(self, supply):
+        '''
+        Interface, called outside
+        set the supply that embeds the prompts of the semantic cache
+        '''
+        return self.set_value('semantic_cache_supply', supply)
+
+    def InterfaceGetContextOptions(self):
+        '''
+        Interface, called outside
+        get (token budget, completion reserve, summarize) of the chat context
+        '''
+        return self.context_token_budget, self.context_completion_reserve, self.context_summarize
+
+    def InterfaceSetContextTokenBudget(self, budget):
+        '''
+        Interface, called outside
+        set the max prompt tokens of a chat request, 0 means the context window of the model
+        '''
+        return self.set_value('context_token_budget', budget)
+
+    def InterfaceSetContextCompletionReserve(self, tokens):
+        '''
+        Interface, called outside
+        set the tokens reserved for the completion in the context window
+        '''
+        return self.set_value('context_completion_reserve', tokens)
+
+    def InterfaceSetContextSummarize(self, summarize):
+        '''
+        Interface, called outside
+        set whether the dropped turns of a long chat are summarized
+        '''
+        return self.set_value('context_summarize', summarize)
+
+    def InterfaceGetExampleTokenBudget(self):
+        '''
+        Interface, called outside
+        get the max tokens of the packed examples, 0 means the room left by the prompts
+        '''
+        return self.example_token_budget
+
+    def InterfaceSetExampleTokenBudget(self, budget):
+        '''
+        Interface, called outside
+        set the max tokens of the packed examples, 0 means the room left by the prompts
+        '''
+        return self.set_value('example_token_budget', budget)
+
+    def InterfaceGetProjectIndexSupply(self):
+        '''
+        Interface, called outside
+        get the supply that embeds the code chunks of the project index
+        '''
+        return self.project_index_supply
+
+    def InterfaceSetProjectIndexSupply(self, supply):
+        '''
+        Interface, called outside
+        set the supply that embeds the code chunks of the project index
+        '''
+        return self.set_value('project_index_supply', supply)
+
+    def InterfaceGetExampleSliceTokens(self):
+        '''
+        Interface, called outside
+        get the tokens above which an example file is reduced to its relevant symbols, 0 means never
+        '''
+        return self.example_slice_tokens
+
+    def InterfaceSetExampleSliceTokens(self, tokens):
+        '''
+        Interface, called outside
+        set the tokens above which an example file is reduced to its relevant symbols, 0 means never
+        '''
+        return self.set_value('example_slice_tokens', tokens)
+
+    def InterfaceGetValidationOptions(self):
+        '''
+        Interface, called outside
+        get (enabled, lint command, test command, timeout seconds) of the validation of the generated code
+        '''
+        return self.validation_enabled, self.validation_lint_command, self.validation_test_command, self.validation_timeout
+
+    def InterfaceSetValidationEnabled(self, enabled):
+        '''
+        Interface, called outside
+        set whether the code blocks of a reply are validated when it's completed
+        '''
+        return self.set_value('validation_enabled', enabled)
+
+    def InterfaceSetValidationLintCommand(self, command):
+        '''
+        Interface, called outside
+        set the lint command of the generated code, empty means no lint
+        '''
+        return self.set_value('validation_lint_command', command)
+
+    def InterfaceSetValidationTestCommand(self, command):
+        '''
+        Interface, called outside
+        set the test command of the generated code, empty means no test
+        '''
+        return self.set_value('validation_test_command', command)
+
+    def InterfaceSetValidationTimeout(self, timeout):
+        '''
+        Interface, called outside
+        set the seconds a lint or test command can run
+        '''
+        return self.set_value('validation_timeout', timeout)
+
+    def InterfaceGetBestOfCount(self):
+        '''
+        Interface, called outside
+        get how many candidates are generated by a request
+        '''
+        return self.best_of_count
+
+    def InterfaceSetBestOfCount(self, count):
+        '''
+        Interface, called outside
+        set how many candidates are generated by a request, 1 means only one reply
+        '''
+        return self.set_value('best_of_count', count)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Purpose: measure the startup of the tool, so the regressions of startup time are measurable
+#   it records the import time of every module and the init time of every llm provider
+
+import contextlib
+import threading
+import time
+
+
+class StartupReport(object):
+    '''
+    StartupReport is a singleton class, it collects the timing of the startup
+    all the times are in seconds, relative to the creation of the report
+    '''
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.initialized = False
+        return cls._instance
+
+    def __init__(self):
+        # the report is shared by main.py and the manager, only init it once
+        if self.initialized:
+            return
+        super().__init__()
+        self.initialized = True
+
+        self.start_time = time.perf_counter()
+        self.mutex = threading.Lock()
+        self.imports = []
+        self.providers = []
+        self.marks = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def record_import(self, module_name, seconds):
+        self.mutex.acquire()
+        self.imports.append((module_name, seconds))
+        self.mutex.release()
+
+    def record_provider(self, provider, seconds, status):
+        '''
+        status is a short text, for example 'ready', 'invalid' or the error message
+        '''
+        self.mutex.acquire()
+        self.providers.append((provider, seconds, status, self.elapsed()))
+        self.mutex.release()
+
+    def mark(self, name):
+        '''
+        mark a milestone of the startup, for example 'main window shown'
+        '''
+        self.mutex.acquire()
+        self.marks.append((name, self.elapsed()))
+        self.mutex.release()
+
+    @contextlib.contextmanager
+    def measure_import(self, module_name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_import(module_name, time.perf_counter() - begin)
+
+    def format(self):
+        self.mutex.acquire()
+        lines = ['Startup report:']
+        for name, at in self.marks:
+            lines.append('  {:<40} at {:8.3f}s'.format(name, at))
+        for module_name, seconds in self.imports:
+            lines.append('  import {:<33} {:8.3f}s'.format(module_name, seconds))
+        for provider, seconds, status, at in self.providers:
+            lines.append('  init {:<35} {:8.3f}s  ready at {:8.3f}s  ({})'.format(provider, seconds, at, status))
+        self.mutex.release()
+        return '\n'.join(lines)
+
+    def InterfaceGetReport(self):
+        return self.format()